@@ -0,0 +1,282 @@
+"""
+Batch sweeps run the magazine and all ammo tests over whole grids of weapon configurations at once.
+
+Building a Weapon and running FiringRange once per cell repeats the same work for every cell. For perk combinations
+that only refund rounds from thin air (TripleTap, FourthTimesTheCharm and no perk) every cell in the grid is answered by
+the same function: the number of shots it takes to empty a pool of n rounds (the magazine plus the reserves, see
+MagazineEngine). The sweep advances a single counter state for each perk combination once, recording when the pool of
+every size up to the largest one in the grid runs dry, and then fills in each cell with a lookup.
+
+Perk combinations that have no closed form (RewindRounds) are run through MagazineEngine one cell at a time, with the
+perks' printing silenced.
+
+NumPy is not a dependency of this project, so results are stored in columns of the standard library `array` type.
+"""
+
+import math
+from array import array
+
+from weaponConfig import WeaponConfig
+from magazineEngine import TESTS, run_test
+from perks import PERK_TYPES
+from perk import Perk
+
+# The numeric fields of Weapon.report(), and the numeric fields of each perk's report.
+WEAPON_FIELDS = ("magazine", "magazine_size", "reserves", "shots_fired", "reloads")
+PERK_FIELDS = ("procs", "refunded", "counter", "disabled_shots")
+
+class SweepTable():
+  """
+  A columnar table of sweep results, one row per weapon configuration.
+
+  Attributes:
+  - test (str): The test the results are for ("magazine" or "all_ammo").
+  - configs (list): The WeaponConfig of each row.
+  - perk_slots (int): The number of perk columns groups in the table.
+  - columns (dict): An `array` of signed integers for every field, keyed by field name.
+    Weapon fields use the same names as Weapon.report(), perk fields are named `perk<slot>_<field>`.
+  """
+  def __init__(self, test: str, perk_slots: int):
+    """
+    Initializes a new, empty instance of the SweepTable class.
+
+    Parameters:
+    - test (str): The test the results are for ("magazine" or "all_ammo").
+    - perk_slots (int): The largest number of perks on a single configuration.
+    """
+    self.test = test
+    self.configs = []
+    self.perk_slots = perk_slots
+    self.columns = {field: array('q') for field in WEAPON_FIELDS}
+
+    for slot in range(perk_slots):
+      for field in PERK_FIELDS:
+        self.columns[f"perk{slot}_{field}"] = array('q')
+
+  def __len__(self):
+    return len(self.configs)
+
+  def append(self, config: WeaponConfig, state: dict):
+    """
+    Adds a row to the table.
+
+    Parameters:
+    - config (WeaponConfig): The configuration the row is for.
+    - state (dict): The weapon fields of the row, and a "perks" list with one dictionary (or None) per perk slot.
+    """
+    self.configs.append(config)
+
+    for field in WEAPON_FIELDS:
+      self.columns[field].append(state[field])
+
+    perk_states = state["perks"]
+    for slot in range(self.perk_slots):
+      perk_state = perk_states[slot] if slot < len(perk_states) else None
+      for field in PERK_FIELDS:
+        self.columns[f"perk{slot}_{field}"].append(perk_state.get(field, 0) if perk_state else 0)
+
+  def append_closed_form(self, config: WeaponConfig, perk_types: list, shots: int, reserves: int, reloads: int):
+    """
+    Adds a row for a weapon with only fixed-ratio refund perks that fired `shots` shots from a fresh weapon and
+    finished with an empty magazine. Writes straight to the columns, this is the hot path of a sweep.
+
+    Parameters:
+    - config (WeaponConfig): The configuration the row is for.
+    - perk_types (list): The perk class in each perk slot of the configuration.
+    - shots (int): The number of shots fired.
+    - reserves (int): The rounds left in reserves.
+    - reloads (int): The number of reloads.
+    """
+    columns = self.columns
+    self.configs.append(config)
+
+    columns["magazine"].append(0)
+    columns["magazine_size"].append(config.magazine_size)
+    columns["reserves"].append(reserves)
+    columns["shots_fired"].append(shots)
+    columns["reloads"].append(reloads)
+
+    for slot in range(self.perk_slots):
+      perk_type = perk_types[slot] if slot < len(perk_types) else Perk
+      procs = 0 if perk_type is Perk else shots // perk_type.trigger_count
+
+      columns[f"perk{slot}_procs"].append(procs)
+      columns[f"perk{slot}_refunded"].append(procs * perk_type.refund_amount if procs else 0)
+      columns[f"perk{slot}_counter"].append(0 if perk_type is Perk else shots % perk_type.trigger_count)
+      columns[f"perk{slot}_disabled_shots"].append(0)
+
+  def report(self, row: int):
+    """
+    Returns the results of a row in the same shape as Weapon.report().
+
+    Parameters:
+    - row (int): The index of the row.
+    """
+    perk_states = {}
+
+    for slot, (name, enhanced) in enumerate(self.configs[row].perks):
+      perk_fields = _perk_report_fields(name)
+      if perk_fields is None:
+        perk_states[name] = None
+        continue
+
+      perk_states[name] = {field: self.columns[f"perk{slot}_{field}"][row] for field in perk_fields}
+
+    report = {field: self.columns[field][row] for field in WEAPON_FIELDS}
+    report["perks"] = perk_states
+
+    return report
+
+  def rows(self):
+    """
+    Yields every row of the table as a (WeaponConfig, report) pair.
+    """
+    for row in range(len(self.configs)):
+      yield self.configs[row], self.report(row)
+
+
+_report_fields = {}
+
+def _perk_report_fields(name: str):
+  """
+  Returns the fields a perk reports, in the order it reports them, or None for perks that report nothing.
+  """
+  if name not in _report_fields:
+    state = PERK_TYPES[name]().state()
+    _report_fields[name] = tuple(state) if state is not None else None
+
+  return _report_fields[name]
+
+
+def _pool_shots(perks: list, largest_pool: int):
+  """
+  Returns an array where entry n is the number of shots it takes to empty a pool of n rounds with fixed-ratio refund
+  perks whose counters start at 0, or None if the perks refund rounds at least as fast as they are used.
+
+  Parameters:
+  - perks (list): The fixed-ratio refund perks, as (trigger count, refund amount) pairs.
+  - largest_pool (int): The largest pool to record.
+  """
+  period = 1
+  for trigger_count, refund_amount in perks:
+    period = math.lcm(period, trigger_count)
+
+  if period <= sum(refund_amount * (period // trigger_count) for trigger_count, refund_amount in perks):
+    return None
+
+  pool_shots = array('q', [0]) * (largest_pool + 1)
+
+  # Rounds taken out of the pool so far, net of refunds. This can only grow by one per shot, so the first time it
+  # reaches n is the number of shots it takes to empty a pool of n rounds.
+  drained = 0
+  emptied = 0
+  shots = 0
+  while emptied < largest_pool:
+    shots += 1
+    drained += 1
+    for trigger_count, refund_amount in perks:
+      if shots % trigger_count == 0:
+        drained -= refund_amount
+
+    if drained > emptied:
+      emptied = drained
+      pool_shots[emptied] = shots
+
+  return pool_shots
+
+
+def _closed_form_combo(perks: tuple):
+  """
+  Returns the (trigger count, refund amount) pairs for a perk combination, or None if it has no closed form.
+  """
+  closed_form_perks = []
+
+  for name, enhanced in perks:
+    perk_type = PERK_TYPES[name]
+    if perk_type is Perk:
+      continue
+
+    if getattr(perk_type, "trigger_count", None) is None:
+      return None
+
+    closed_form_perks.append((perk_type.trigger_count, perk_type.refund_amount))
+
+  return closed_form_perks
+
+
+def _simulated_state(config: WeaponConfig, test: str):
+  """
+  Runs a test on a fresh weapon through MagazineEngine with printing silenced and returns the resulting state.
+  A weapon that never runs out of ammo is reported with -1 shots fired.
+  """
+  weapon = config.build()
+  run_test(weapon, test)
+
+  state = weapon.state()
+  state["perks"] = [perk.state() for perk in weapon.perks]
+
+  return state
+
+
+def sweep(magazine_sizes, reserves_sizes, perk_combos, fire_rates=(0,), test: str = "magazine"):
+  """
+  Runs a test over every combination of the given magazine sizes, reserves sizes, perk combinations and fire rates.
+  Returns a SweepTable with one row per configuration, ordered by perk combination, fire rate, magazine size and
+  then reserves size.
+
+  Fire rates only change the results of perks that use them (RewindRounds). Every other perk combination is only run
+  with the first fire rate given.
+
+  Parameters:
+  - magazine_sizes (iterable): The magazine sizes to test.
+  - reserves_sizes (iterable): The reserves sizes to test. -1 means infinite reserves.
+  - perk_combos (iterable): The perk combinations to test, as tuples of (perk name, enhanced) pairs.
+  - fire_rates (iterable): The fire rates to test, in rounds per minute.
+  - test (str): The test to run, "magazine" or "all_ammo".
+  """
+  if test not in TESTS:
+    raise ValueError(f"Unknown test '{test}'. Expected one of: {', '.join(TESTS)}")
+
+  magazine_sizes = list(magazine_sizes)
+  reserves_sizes = list(reserves_sizes)
+  perk_combos = [tuple(perks) for perks in perk_combos]
+  fire_rates = list(fire_rates)
+
+  table = SweepTable(test, max((len(perks) for perks in perk_combos), default=0))
+  # The magazine test only ever empties a magazine, so the reserves only add to the pool for the all ammo test
+  largest_pool = max(magazine_sizes, default=0)
+  if test == "all_ammo":
+    largest_pool += max(max(reserves_sizes, default=0), 0)
+
+  for perks in perk_combos:
+    closed_form_perks = _closed_form_combo(perks)
+
+    if closed_form_perks is None:
+      # No closed form, run every cell on its own
+      for fire_rate in fire_rates:
+        for magazine_size in magazine_sizes:
+          for reserves_size in reserves_sizes:
+            config = WeaponConfig(magazine_size, reserves_size, fire_rate, perks)
+            table.append(config, _simulated_state(config, test))
+      continue
+
+    pool_shots = _pool_shots(closed_form_perks, largest_pool)
+    perk_types = [PERK_TYPES[name] for name, enhanced in perks]
+
+    for magazine_size in magazine_sizes:
+      for reserves_size in reserves_sizes:
+        config = WeaponConfig(magazine_size, reserves_size, fire_rates[0], perks)
+
+        # Perks that never run out of ammo have no table, and are run one cell at a time
+        if pool_shots is None:
+          table.append(config, _simulated_state(config, test))
+          continue
+
+        # Reloads fail without reserves, so the all ammo test is the same as the magazine test
+        if test == "magazine" or reserves_size <= 0:
+          table.append_closed_form(config, perk_types, pool_shots[magazine_size], reserves_size, 0)
+        else:
+          reloads = math.ceil(reserves_size / magazine_size)
+          table.append_closed_form(config, perk_types, pool_shots[magazine_size + reserves_size], 0, reloads)
+
+  return table
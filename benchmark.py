@@ -0,0 +1,342 @@
+"""
+Benchmarks the per-shot simulator, to catch changes to Weapon.shoot, Weapon.reload or a perk that make it slower.
+
+Every case fires a weapon round by round the same way FiringRange's tests would without MagazineEngine's shortcuts,
+with all output sent to a silent sink:
+- "magazine" shoots until the magazine is empty.
+- "all_ammo" shoots and reloads until the magazine and reserves are empty.
+
+The cases cover every pair of perks that can be picked in main.py (see main.return_perk), with and without the
+enhanced flag, at each size in SIZES. Pairs that never run out of ammo (like FourthTimesTheCharm twice) are skipped,
+which is checked with MagazineEngine before timing anything.
+
+Each case reports the shots fired, the best wall time per firing out of a few repeats, the shots per second, and the peak memory
+allocated while firing (measured in a separate run, since tracing memory slows everything down). Results can be saved
+as a baseline, and later runs compared against it:
+
+  python benchmark.py --save benchmarkBaseline.json
+  python benchmark.py --baseline benchmarkBaseline.json --threshold 0.2
+
+A comparison fails (exit status 1) when a case fires fewer shots per second or uses more memory than the baseline by
+more than the threshold, or when it fires a different number of shots.
+
+Shots per second also depend on how fast the machine is at the time. Every run times a fixed loop of plain Python that
+doesn't touch the simulator, and the baseline's speeds are scaled by how much faster or slower that loop ran, so a
+baseline from another machine (or a busy one) can still be compared against. Timings are still noisy on a shared
+machine, so raise the threshold or the repeats there.
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from itertools import product
+
+from weapon import Weapon
+from magazineEngine import MagazineEngine, TESTS
+from resultSink import ResultSink, use_sink
+from main import return_perk
+
+# Bump this whenever the format of the baseline changes.
+BASELINE_FORMAT = 1
+
+# (magazine size, reserves size, fire rate) of each size of weapon.
+SIZES = {
+  "small": (6, 30, 600),
+  "medium": (60, 600, 600),
+  "huge": (300, 20000, 600),
+}
+
+# The perk selections from the menu in main.py.
+PERK_SELECTIONS = ("1", "2", "3", "4")
+
+# The "no perk" selection, which has no enhanced version, so it only appears once in the cases.
+NO_PERK = "4"
+
+
+def build_weapon(size: str, perks: tuple):
+  """
+  Returns a new weapon of the given size with perks picked the same way as main.define_weapon.
+
+  Parameters:
+  - size (str): The size of the weapon, a key of SIZES.
+  - perks (tuple): The perks as (menu selection, enhanced) pairs.
+  """
+  magazine_size, reserves_size, fire_rate = SIZES[size]
+  return Weapon(magazine_size=magazine_size, fire_rate=fire_rate, reserves_size=reserves_size,
+                perks=[return_perk(selection, enhanced) for selection, enhanced in perks])
+
+
+def case_name(size: str, test: str, weapon: Weapon):
+  """
+  Returns the name a case is stored under in the baseline, like "medium/all_ammo/TripleTap+RewindRounds*".
+  Enhanced perks are marked with a "*".
+  """
+  perks = "+".join(perk.__class__.__name__ + ("*" if perk.enhanced else "") for perk in weapon.perks)
+  return f"{size}/{test}/{perks}"
+
+
+def fire(weapon: Weapon, test: str):
+  """
+  Runs a test round by round on the weapon.
+
+  Parameters:
+  - weapon (Weapon): The weapon to fire.
+  - test (str): "magazine" or "all_ammo".
+  """
+  shoot = weapon.shoot
+
+  while shoot():
+    pass
+
+  if test == "all_ammo":
+    reload = weapon.reload
+    while reload():
+      while shoot():
+        pass
+
+
+class Calibration():
+  """
+  A stand in for a weapon, only used to time plain Python attribute updates and calls.
+  """
+  __slots__ = ("magazine", "counter")
+
+
+def calibrate(repeat: int = 5, loops: int = 200000):
+  """
+  Returns how many iterations per second a fixed loop of plain Python runs at, the best out of `repeat` runs.
+  The loop does the same kind of work as a shot (attribute updates, a comparison and a call) without the simulator.
+  """
+  def step(state):
+    state.counter += 1
+    if state.counter == 3:
+      state.counter = 0
+      state.magazine += 1
+
+  best = None
+  for run in range(repeat):
+    state = Calibration()
+    state.magazine = loops
+    state.counter = 0
+
+    start = time.perf_counter()
+    for loop in range(loops):
+      state.magazine -= 1
+      step(state)
+    wall = time.perf_counter() - start
+
+    if best is None or wall < best:
+      best = wall
+
+  return loops / best
+
+
+def runs_out(weapon: Weapon, test: str):
+  """
+  Returns True if the test on the weapon ever finishes, worked out with MagazineEngine. Leaves the weapon resupplied.
+  """
+  try:
+    if test == "magazine":
+      MagazineEngine.fire_magazine(weapon)
+    else:
+      MagazineEngine.expend_all(weapon)
+  except ValueError:
+    return False
+  finally:
+    weapon.resupply()
+
+  return True
+
+
+def time_case(size: str, test: str, perks: tuple, repeat: int = 3, memory: bool = True, min_time: float = 0.02):
+  """
+  Times a single case and returns a dictionary with its shots fired, best wall time, shots per second and peak memory,
+  or None if the weapon never runs out of ammo.
+
+  Small weapons empty in microseconds, which is too short to time reliably, so each timed run resupplies and fires the
+  weapon as many times as it takes to last at least `min_time` seconds. The wall time is per firing.
+
+  Parameters:
+  - size (str): The size of the weapon, a key of SIZES.
+  - test (str): "magazine" or "all_ammo".
+  - perks (tuple): The perks as (menu selection, enhanced) pairs.
+  - repeat (int): The number of timed runs, the fastest one is kept (default is 3).
+  - memory (bool): Whether to measure the peak memory in an extra run (default is True).
+  - min_time (float): The shortest a timed run may last in seconds (default is 0.02).
+  """
+  weapon = build_weapon(size, perks)
+  if not runs_out(weapon, test):
+    return None
+
+  # Work out how many firings make a run long enough, doubling like timeit does
+  number = 1
+  while True:
+    start = time.perf_counter()
+    for firing in range(number):
+      weapon.resupply()
+      fire(weapon, test)
+    if time.perf_counter() - start >= min_time:
+      break
+    number *= 2
+
+  shots = weapon.shots_fired
+  best = None
+  for run in range(repeat):
+    start = time.perf_counter()
+    for firing in range(number):
+      weapon.resupply()
+      fire(weapon, test)
+    wall = (time.perf_counter() - start) / number
+
+    if best is None or wall < best:
+      best = wall
+
+  peak_memory = None
+  if memory:
+    weapon = build_weapon(size, perks)
+    tracemalloc.start()
+    try:
+      fire(weapon, test)
+      peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+
+  return {
+    "shots": shots,
+    "wall": best,
+    "shots_per_sec": shots / best if best > 0 else float("inf"),
+    "peak_memory": peak_memory,
+  }
+
+
+def run_suite(sizes: tuple = tuple(SIZES), tests: tuple = TESTS, enhanced: bool = True, repeat: int = 3, memory: bool = True,
+              min_time: float = 0.02):
+  """
+  Times every case and returns a dictionary of results by case name. Skipped cases aren't included.
+
+  Parameters:
+  - sizes (tuple): The sizes to run, keys of SIZES (default is all of them).
+  - tests (tuple): The tests to run (default is both).
+  - enhanced (bool): Whether to include the enhanced version of each perk (default is True).
+  - repeat (int): The number of timed runs of each case (default is 3).
+  - memory (bool): Whether to measure the peak memory of each case (default is True).
+  - min_time (float): The shortest a timed run of a case may last in seconds (default is 0.02).
+  """
+  enhanced_options = (False, True) if enhanced else (False,)
+  # An enhanced "no perk" builds the same weapon under the same name, so it would be timed twice
+  options = [(selection, flag) for selection, flag in product(PERK_SELECTIONS, enhanced_options)
+             if not (flag and selection == NO_PERK)]
+  results = {}
+
+  with use_sink(ResultSink()):
+    for size, test, first, second in product(sizes, tests, options, options):
+      perks = (first, second)
+      result = time_case(size, test, perks, repeat, memory, min_time)
+      if result is not None:
+        results[case_name(size, test, build_weapon(size, perks))] = result
+
+  return results
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2, speed: float = 1.0):
+  """
+  Compares results against a baseline and returns a list of the regressions, as human readable lines.
+  Cases that are only in one of them are ignored.
+
+  Parameters:
+  - results (dict): The results of run_suite.
+  - baseline (dict): The results of an earlier run_suite.
+  - threshold (float): The fraction a case may get slower or use more memory by before it counts (default is 0.2).
+  - speed (float): How many times faster the machine is now than when the baseline was run (default is 1.0).
+  """
+  regressions = []
+
+  for name, result in results.items():
+    before = baseline.get(name)
+    if before is None:
+      continue
+
+    if result["shots"] != before["shots"]:
+      regressions.append(f"{name}: fired {result['shots']} shots, the baseline fired {before['shots']}")
+
+    expected = before["shots_per_sec"] * speed
+    if result["shots_per_sec"] < expected * (1 - threshold):
+      regressions.append(f"{name}: {result['shots_per_sec']:,.0f} shots/sec, down from {expected:,.0f}")
+
+    if result["peak_memory"] is not None and before["peak_memory"] is not None:
+      if result["peak_memory"] > before["peak_memory"] * (1 + threshold) + 1024:
+        regressions.append(f"{name}: {result['peak_memory']:,} bytes peak memory, up from {before['peak_memory']:,}")
+
+  return regressions
+
+
+def load_baseline(path: str):
+  """
+  Returns the results and calibration stored in a baseline file.
+  """
+  with open(path) as file:
+    baseline = json.load(file)
+
+  if baseline.get("format") != BASELINE_FORMAT:
+    raise ValueError(f"The baseline in {path} is in an old format. Save a new one with --save.")
+
+  return baseline["results"], baseline["calibration"]
+
+
+def save_baseline(path: str, results: dict, calibration: float):
+  """
+  Stores results and the calibration they were run with in a baseline file.
+  """
+  with open(path, "w") as file:
+    json.dump({"format": BASELINE_FORMAT, "calibration": calibration, "results": results}, file, indent=2, sort_keys=True)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark the per-shot simulator across perk combinations.")
+  parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES), help="weapon sizes to run (default is all)")
+  parser.add_argument("--tests", nargs="+", choices=TESTS, default=list(TESTS), help="tests to run (default is both)")
+  parser.add_argument("--no-enhanced", action="store_true", help="leave out the enhanced perks")
+  parser.add_argument("--repeat", type=int, default=3, help="timed runs of each case, the fastest is kept (default is 3)")
+  parser.add_argument("--min-time", type=float, default=0.02, help="shortest a timed run may last in seconds (default is 0.02)")
+  parser.add_argument("--no-memory", action="store_true", help="skip measuring peak memory")
+  parser.add_argument("--baseline", help="baseline JSON to compare against")
+  parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown or memory growth as a fraction (default is 0.2)")
+  parser.add_argument("--save", help="save the results as a baseline JSON")
+  args = parser.parse_args(argv)
+
+  # Calibrate before and after, so a change in the machine's speed during the run is averaged out
+  calibration = calibrate()
+  results = run_suite(tuple(args.sizes), tuple(args.tests), not args.no_enhanced, args.repeat, not args.no_memory,
+                      args.min_time)
+  calibration = (calibration + calibrate()) / 2
+
+  for name, result in results.items():
+    memory = "" if result["peak_memory"] is None else f"  {result['peak_memory']:>10,} B"
+    print(f"{name:<60} {result['shots']:>10,} shots  {result['wall'] * 1000:>9.2f} ms  {result['shots_per_sec']:>12,.0f} shots/sec{memory}")
+
+  total_shots = sum(result["shots"] for result in results.values())
+  total_wall = sum(result["wall"] for result in results.values())
+  print(f"\n{len(results)} cases, {total_shots:,} shots in {total_wall:.2f} s ({total_shots / max(total_wall, 1e-9):,.0f} shots/sec)")
+  print(f"Calibration: {calibration:,.0f} loops/sec")
+
+  if args.save:
+    save_baseline(args.save, results, calibration)
+    print(f"Saved baseline to {args.save}")
+
+  if args.baseline:
+    baseline, baseline_calibration = load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.threshold, calibration / baseline_calibration)
+    if regressions:
+      print(f"\n{len(regressions)} regressions past the {args.threshold:.0%} threshold:")
+      for regression in regressions:
+        print(regression)
+      return 1
+    print(f"\nNo regressions past the {args.threshold:.0%} threshold.")
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,398 @@
+"""
+CalculatorService serves the calculator as a JSON API over HTTP, using only asyncio from the standard library.
+
+Endpoints (every request and response body is JSON):
+- GET  /health    Returns {"status": "ok"} and the service's counters.
+- POST /mag       Runs the magazine test on one weapon, like FiringRange.mag_test.
+- POST /all-ammo  Runs the all ammo test on one weapon, like FiringRange.all_ammo_test.
+- POST /sweep     Runs a test on every combination of the given sizes and perks, see batchSweep.sweep.
+
+/mag and /all-ammo take a weapon in the same shape as a line of headless.py's input:
+
+  {"magazine_size": 12, "reserves_size": 100, "fire_rate": 600, "perks": ["TripleTap", "RewindRounds+"]}
+
+and return the same result FiringRange sends to a sink (the test, the configuration, any error, the weapon's state
+and its extra shots). /sweep takes lists of sizes and perk combinations:
+
+  {"magazine_sizes": [4, 8, 12], "reserves_sizes": [-1], "perk_combos": [["TripleTap", "FourthTimesTheCharm"]],
+   "fire_rates": [0], "test": "magazine"}
+
+and returns {"rows": [{"config": ..., "state": ...}, ...]}.
+
+Weapons are held to the same limits as main.py's prompts (see check_limits), sweeps to MAX_SWEEP weapons and
+MAX_SWEEP_POOL pooled rounds, request bodies to MAX_BODY bytes and headers to MAX_HEADERS lines, so no single request
+can keep a worker busy or growing without bound.
+
+The event loop only parses requests and writes responses. Every simulation runs in a pool of worker processes, so a
+slow weapon never holds up other requests. Requests are keyed by their endpoint and weapon configuration, which gives
+two kinds of sharing:
+- A request identical to one already being simulated waits for that simulation instead of starting another.
+- Recent responses are kept in a bounded cache, least recently used first out, and returned without simulating.
+
+  python calculatorService.py --port 8080 --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+
+from weaponConfig import WeaponConfig
+from firingRange import FiringRange
+from batchSweep import sweep
+from magazineEngine import TESTS
+from resultSink import ResultSink, use_sink
+from headless import parse_config, parse_perk
+
+# The largest number of weapons a single sweep may run.
+MAX_SWEEP = 100000
+
+# The largest request body in bytes, and the most header lines a request may have. A request or header line longer
+# than the stream's limit (64 KiB) is refused the same way as too many headers.
+MAX_BODY = 1 << 20
+MAX_HEADERS = 100
+
+# The most rounds a sweep's closed-form pools may hold across all its perk combinations, see batchSweep._pool_shots.
+# Filling a pool takes about a second per 750000 rounds, so this keeps a sweep's pools well under a second.
+MAX_SWEEP_POOL = 250000
+
+# The largest magazine, reserves and fire rate a weapon may have, the same limits as main.py's prompts.
+MAX_MAGAZINE = 300
+MAX_RESERVES = 10000000
+MAX_FIRE_RATE = 1000
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+           431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+
+
+def check_limits(magazine_size: int, reserves_size: int, fire_rate: int):
+  """
+  Raises a ValueError if a weapon's numbers are outside what the service simulates, so a single request can't make a
+  worker run without bound.
+  """
+  if not 1 <= magazine_size <= MAX_MAGAZINE:
+    raise ValueError(f"Magazine sizes must be between 1 and {MAX_MAGAZINE}.")
+  if not -1 <= reserves_size <= MAX_RESERVES:
+    raise ValueError(f"Reserves sizes must be between -1 (infinite) and {MAX_RESERVES}.")
+  if not 0 <= fire_rate <= MAX_FIRE_RATE:
+    raise ValueError(f"Fire rates must be between 0 and {MAX_FIRE_RATE}.")
+
+
+class CollectSink(ResultSink):
+  """
+  A sink that keeps the results sent to it, and drops messages.
+
+  Attributes:
+  - results (list): The results, in the order they were sent.
+  """
+  def __init__(self, stream=None):
+    super().__init__(stream)
+    self.results = []
+
+  def result(self, record: dict):
+    self.results.append(record)
+
+
+def run_weapon_test(config: WeaponConfig, test: str):
+  """
+  Runs a test through FiringRange on a fresh weapon and returns its result. Runs in a worker process.
+
+  Parameters:
+  - config (WeaponConfig): The configuration of the weapon.
+  - test (str): "magazine" or "all_ammo".
+  """
+  sink = CollectSink()
+
+  with use_sink(sink):
+    if test == "magazine":
+      FiringRange.mag_test(config.build(), sink)
+    else:
+      FiringRange.all_ammo_test(config.build(), sink)
+
+  return sink.results[0]
+
+
+def run_sweep(magazine_sizes: list, reserves_sizes: list, perk_combos: list, fire_rates: list, test: str):
+  """
+  Runs a sweep and returns its rows as a list of {"config", "state"} dictionaries. Runs in a worker process.
+  """
+  with use_sink(ResultSink()):
+    table = sweep(magazine_sizes, reserves_sizes, perk_combos, fire_rates, test)
+
+  return {"rows": [{"config": config._asdict(), "state": state} for config, state in table.rows()]}
+
+
+class HttpError(Exception):
+  """
+  An error that is sent back to the client with an HTTP status.
+  """
+  def __init__(self, status: int, message: str):
+    super().__init__(message)
+    self.status = status
+
+
+class CalculatorService():
+  """
+  The HTTP service.
+
+  Attributes:
+  - pool (ProcessPoolExecutor): The worker processes simulations run in.
+  - in_flight (dict): The future of every simulation currently running, by request key.
+  - cache (OrderedDict): Recent responses as JSON bytes, by request key, from least to most recently used.
+  - max_cache (int): The largest number of responses kept in the cache.
+  - stats (dict): Counts of requests, simulations, coalesced requests and cache hits.
+  """
+  def __init__(self, workers: int = None, max_cache: int = 4096):
+    """
+    Initializes a new instance of the CalculatorService class.
+
+    Parameters:
+    - workers (int): The number of worker processes (default is None, one per CPU).
+    - max_cache (int): The largest number of responses kept in the cache (default is 4096).
+    """
+    self.pool = ProcessPoolExecutor(max_workers=workers)
+    self.in_flight = {}
+    self.cache = OrderedDict()
+    self.max_cache = max_cache
+    self.stats = {"requests": 0, "simulations": 0, "coalesced": 0, "cache_hits": 0}
+
+  async def compute(self, key: str, function, *args):
+    """
+    Returns the JSON response for a request, from the cache, from an identical request in flight, or by running the
+    function in the worker pool.
+
+    Parameters:
+    - key (str): The key identifying the request.
+    - function: The function to run in a worker, returning something that can be turned into JSON.
+    - args: The arguments to the function.
+    """
+    body = self.cache.get(key)
+    if body is not None:
+      self.cache.move_to_end(key)
+      self.stats["cache_hits"] += 1
+      return body
+
+    task = self.in_flight.get(key)
+    if task is not None:
+      self.stats["coalesced"] += 1
+    else:
+      # Start the simulation as its own task, so it finishes for everyone waiting even if this client goes away
+      task = asyncio.ensure_future(self.simulate(key, function, *args))
+      self.in_flight[key] = task
+      self.stats["simulations"] += 1
+
+    return await asyncio.shield(task)
+
+  async def simulate(self, key: str, function, *args):
+    """
+    Runs the function in the worker pool and caches the JSON response.
+    """
+    loop = asyncio.get_running_loop()
+
+    try:
+      result = await loop.run_in_executor(self.pool, function, *args)
+    finally:
+      del self.in_flight[key]
+
+    body = json.dumps(result).encode()
+    self.cache[key] = body
+    while len(self.cache) > self.max_cache:
+      self.cache.popitem(last=False)
+
+    return body
+
+  async def route(self, method: str, path: str, body: bytes):
+    """
+    Returns the JSON response body for a request. Raises an HttpError for requests that can't be answered.
+    """
+    if path == "/health":
+      if method != "GET":
+        raise HttpError(405, "Use GET for /health.")
+      return json.dumps({"status": "ok", **self.stats}).encode()
+
+    tests = {"/mag": "magazine", "/all-ammo": "all_ammo"}
+    if path not in tests and path != "/sweep":
+      raise HttpError(404, f"Unknown endpoint {path}.")
+    if method != "POST":
+      raise HttpError(405, f"Use POST for {path}.")
+
+    try:
+      request = json.loads(body or b"{}")
+      if not isinstance(request, dict):
+        raise ValueError("The request body must be a JSON object.")
+
+      if path in tests:
+        if request.get("magazine_size") in (None, ""):
+          raise ValueError("Missing magazine_size.")
+        config = parse_config(request)
+        check_limits(config.magazine_size, config.reserves_size, config.fire_rate)
+        key = json.dumps([tests[path], *config])
+        return await self.compute(key, run_weapon_test, config, tests[path])
+
+      return await self.sweep(request)
+    except (ValueError, TypeError, KeyError) as error:
+      raise HttpError(400, str(error))
+
+  async def sweep(self, request: dict):
+    """
+    Returns the JSON response body for a sweep request.
+    """
+    magazine_sizes = [int(size) for size in request["magazine_sizes"]]
+    reserves_sizes = [int(size) for size in request.get("reserves_sizes", [-1])]
+    fire_rates = [int(rate) for rate in request.get("fire_rates", [0])]
+    perk_combos = [tuple(parse_perk(perk) for perk in combo) for combo in request.get("perk_combos", [[]])]
+    test = request.get("test", "magazine")
+
+    if test not in TESTS:
+      raise ValueError(f"Unknown test '{test}'. Expected one of: {', '.join(TESTS)}")
+    for magazine_size in magazine_sizes:
+      check_limits(magazine_size, -1, 0)
+    for reserves_size in reserves_sizes:
+      check_limits(1, reserves_size, 0)
+    for fire_rate in fire_rates:
+      check_limits(1, -1, fire_rate)
+
+    count = len(magazine_sizes) * len(reserves_sizes) * len(fire_rates) * len(perk_combos)
+    if count > MAX_SWEEP:
+      raise ValueError(f"A sweep may run at most {MAX_SWEEP} weapons, this one has {count}.")
+
+    # Each perk combination may fill a pool as large as the largest magazine, plus the largest reserves for all ammo
+    pool = max(magazine_sizes, default=0)
+    if test == "all_ammo":
+      pool += max(max(reserves_sizes, default=0), 0)
+    if pool * len(perk_combos) > MAX_SWEEP_POOL:
+      raise ValueError(f"A sweep's largest magazine plus reserves times its perk combinations may be at most "
+                       f"{MAX_SWEEP_POOL} rounds, this one has {pool * len(perk_combos)}.")
+
+    key = json.dumps(["sweep", magazine_sizes, reserves_sizes, fire_rates, perk_combos, test])
+    return await self.compute(key, run_sweep, magazine_sizes, reserves_sizes, perk_combos, fire_rates, test)
+
+  async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """
+    Serves the requests on one connection, keeping it open between requests unless the client asks to close it.
+    """
+    try:
+      while True:
+        # readline raises a ValueError for a line longer than the stream's limit
+        try:
+          request_line = await reader.readline()
+          if not request_line:
+            break
+
+          headers = {}
+          for count in range(MAX_HEADERS + 1):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+              break
+            if count == MAX_HEADERS:
+              raise ValueError("Too many header lines.")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        except ValueError:
+          error = f"Request and header lines must be under 64 KiB, with at most {MAX_HEADERS} headers."
+          await self.respond(writer, 431, json.dumps({"error": error}).encode(), False)
+          break
+
+        try:
+          method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+          await self.respond(writer, 400, json.dumps({"error": "Malformed request line."}).encode(), False)
+          break
+
+        # The body is only read once its length is known to be sane, anything else ends the connection
+        length = headers.get("content-length", "0") or "0"
+        if not (length.isascii() and length.isdigit()):
+          await self.respond(writer, 400, json.dumps({"error": "Content-Length must be a whole number."}).encode(), False)
+          break
+        if int(length) > MAX_BODY:
+          await self.respond(writer, 413, json.dumps({"error": f"Request bodies may be at most {MAX_BODY} bytes."}).encode(), False)
+          break
+
+        body = await reader.readexactly(int(length))
+        keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+        self.stats["requests"] += 1
+
+        try:
+          status, response = 200, await self.route(method, urlsplit(target).path, body)
+        except HttpError as error:
+          status, response = error.status, json.dumps({"error": str(error)}).encode()
+        except Exception as error:
+          status, response = 500, json.dumps({"error": f"{error.__class__.__name__}: {error}"}).encode()
+
+        await self.respond(writer, status, response, keep_alive)
+        if not keep_alive:
+          break
+    except (ConnectionError, asyncio.IncompleteReadError):
+      pass
+    finally:
+      writer.close()
+
+  async def respond(self, writer: asyncio.StreamWriter, status: int, body: bytes, keep_alive: bool):
+    """
+    Writes a JSON response.
+    """
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+
+  async def serve(self, host: str = "127.0.0.1", port: int = 8080, ready=None):
+    """
+    Serves requests until cancelled.
+
+    Parameters:
+    - host (str): The address to listen on (default is 127.0.0.1).
+    - port (int): The port to listen on (default is 8080, 0 picks a free port).
+    - ready: A function called with the port once the service is listening (default is None).
+    """
+    # Start the workers before any connection is open, so a forked worker never holds a copy of a client's socket
+    # (which kept connections open after the service closed them)
+    await asyncio.get_running_loop().run_in_executor(self.pool, int)
+
+    server = await asyncio.start_server(self.handle, host, port)
+    port = server.sockets[0].getsockname()[1]
+    if ready is not None:
+      ready(port)
+
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      self.pool.shutdown(cancel_futures=True)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Serve the calculator as a JSON API.")
+  parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default is 127.0.0.1)")
+  parser.add_argument("--port", type=int, default=8080, help="port to listen on (default is 8080)")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default is one per CPU)")
+  parser.add_argument("--cache", type=int, default=4096, help="responses kept in the cache (default is 4096)")
+  args = parser.parse_args(argv)
+
+  service = CalculatorService(args.workers, args.cache)
+
+  async def run():
+    serve_task = asyncio.ensure_future(
+      service.serve(args.host, args.port, lambda port: print(f"Listening on http://{args.host}:{port}", flush=True)))
+    # A terminate cancels the service from the event loop, between callbacks, so serve's finally block shuts the worker
+    # processes down without interrupting a response half way through
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serve_task.cancel)
+    try:
+      await serve_task
+    except asyncio.CancelledError:
+      pass
+
+  try:
+    asyncio.run(run())
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == '__main__':
+  main()
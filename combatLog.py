@@ -0,0 +1,335 @@
+"""
+Replays recorded combat logs through the perks, to see what they would have done on real engagements.
+
+A log is a list of timestamped events, one per line, in a JSONL or CSV file:
+
+  {"engagement": "raid-1", "time": 0.1, "event": "shot", "hit": true, "precision": true}
+
+  engagement,time,event,hit,precision
+  raid-1,0.1,shot,1,1
+
+The event is "shot" (the default) or "reload". Hit and precision default to true, and take true/false, 1/0 or yes/no
+in CSV. The time is in seconds. Events are expected in order, with each engagement's events next to each other.
+
+Every event is handed to the perks as it is read: a shot runs each perk's shot_trigger with the logged hit and
+precision, and a reload runs Weapon.reload (and so the perks' reload_trigger). The log drives the weapon, so:
+- A logged shot fired while the simulated magazine is empty reloads it first (an automatic reload), and is a dry shot
+  if there are no reserves left to reload from.
+- With timing on (the default), the timestamps decide the perks' windows and cooldowns like dpsPhase.py does: a perk
+  with a hit window loses its counter when the gap since the last hit is longer than the window, and a perk with a
+  cooldown ignores shots until it is over (instead of the disabled shots of the shot by shot simulation).
+
+When an engagement ends, its statistics (shots, hits, reloads and every perk's procs and refunds) are sent to the sink
+and the weapon is resupplied for the next one. The log is read one line at a time and only the current engagement is
+kept, so memory use doesn't grow with the size of the log. Pass --mmap to read the file through a memory map instead of
+buffered reads.
+
+  python combatLog.py engagements.csv --magazine 12 --reserves 80 --fire-rate 600 --perks TripleTap RewindRounds+
+"""
+
+import argparse
+import csv
+import json
+import mmap
+import sys
+from itertools import chain, groupby
+from operator import itemgetter
+
+from weaponConfig import WeaponConfig
+from dpsPhase import DpsPhase
+from resultSink import SINKS, ResultSink, use_sink
+from headless import parse_perk
+
+LOG_FORMATS = ("jsonl", "csv")
+
+# The CSV values read as true.
+TRUE_VALUES = frozenset(("1", "true", "True", "TRUE", "yes", "y"))
+
+
+def open_log(path: str, memory_map: bool = False):
+  """
+  Returns an iterable of the lines of a log file, and a function that closes it.
+
+  Parameters:
+  - path (str): The log file.
+  - memory_map (bool): Whether to read the file through a memory map (default is False).
+  """
+  file = open(path, "rb" if memory_map else "r", newline=None if memory_map else "")
+  if not memory_map:
+    return file, file.close
+
+  # An empty file can't be mapped
+  try:
+    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+  except ValueError:
+    return iter(()), file.close
+
+  def close():
+    mapped.close()
+    file.close()
+
+  return (line.decode() for line in iter(mapped.readline, b"")), close
+
+
+def read_events(lines, log_format: str = "jsonl"):
+  """
+  Yields an (engagement, time, event, hit, precision) tuple for every event in a log, one at a time so the log is
+  never held in memory.
+
+  Parameters:
+  - lines (iterable): The lines of the log.
+  - log_format (str): "jsonl" or "csv" (default is "jsonl").
+  """
+  if log_format == "csv":
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+      return
+
+    columns = {name.strip(): index for index, name in enumerate(header)}
+    if "engagement" not in columns:
+      raise ValueError("Line 1: The log needs an engagement column.")
+
+    # Missing columns read as their defaults
+    width = len(header)
+    get_engagement = columns["engagement"]
+    get_time = columns.get("time", width)
+    get_event = columns.get("event", width)
+    get_hit = columns.get("hit", width)
+    get_precision = columns.get("precision", width)
+
+    for line_number, row in enumerate(reader, start=2):
+      if not row:
+        continue
+      row.append("")
+      try:
+        time = row[get_time]
+        event = row[get_event] or "shot"
+        hit = row[get_hit]
+        precision = row[get_precision]
+        yield (row[get_engagement], float(time) if time else 0.0, event,
+               hit in TRUE_VALUES if hit else True, precision in TRUE_VALUES if precision else True)
+      except (ValueError, IndexError) as error:
+        raise ValueError(f"Line {line_number}: {error}") from None
+    return
+
+  for line_number, line in enumerate(lines, start=1):
+    if not line.strip():
+      continue
+    try:
+      record = json.loads(line)
+      yield (record["engagement"], float(record.get("time", 0)), record.get("event", "shot"),
+             bool(record.get("hit", True)), bool(record.get("precision", True)))
+    except (ValueError, TypeError, KeyError) as error:
+      raise ValueError(f"Line {line_number}: {error}") from None
+
+
+class LogReplay():
+  """
+  Replays the events of one engagement at a time on a weapon.
+
+  Attributes:
+  - weapon (Weapon): The weapon the events are replayed on.
+  - use_time (bool): Whether the timestamps decide the perks' windows and cooldowns.
+  - engagement: The engagement being replayed, or None before the first one.
+  - stats (dict): The counts for the engagement being replayed.
+  """
+  def __init__(self, config: WeaponConfig, use_time: bool = True):
+    """
+    Initializes a new instance of the LogReplay class.
+
+    Parameters:
+    - config (WeaponConfig): The weapon to replay the log on.
+    - use_time (bool): Whether the timestamps decide the perks' windows and cooldowns (default is True).
+    """
+    self.weapon = config.build()
+    self.use_time = use_time
+    self.engagement = None
+
+    # Perks are handled here instead of through Weapon.shoot, so their windows and cooldowns can be applied
+    self.shot_perks = [perk for perk in self.weapon.perks if "shot" in perk.events]
+    self.windows = [perk.enhanced_hit_window if perk.enhanced else perk.hit_window for perk in self.shot_perks]
+    if use_time:
+      # The cooldown replaces the disabled shots of the shot by shot simulation
+      for perk in self.shot_perks:
+        if perk.cooldown is not None:
+          perk.inactive_shots = 0
+    else:
+      self.windows = [None] * len(self.shot_perks)
+
+  def start(self, engagement, time: float):
+    """
+    Resupplies the weapon and starts counting a new engagement.
+    """
+    self.weapon.resupply()
+    self.engagement = engagement
+    self.last_hit = [None] * len(self.shot_perks)
+    self.inactive_until = [float("-inf")] * len(self.shot_perks)
+    self.stats = {"start": time, "end": time, "shots": 0, "hits": 0, "precision_hits": 0, "reloads": 0,
+                  "auto_reloads": 0, "dry_shots": 0}
+
+  def shot(self, time: float, hit: bool, precision: bool):
+    """
+    Fires a logged shot, running the perks' shot triggers with the logged hit and precision.
+    """
+    weapon = self.weapon
+    stats = self.stats
+    stats["end"] = time
+
+    # The log kept firing, so the simulated weapon reloads if it can
+    if weapon.magazine == 0:
+      if not DpsPhase.reload(weapon):
+        stats["dry_shots"] += 1
+        return
+      stats["auto_reloads"] += 1
+
+    weapon.hit = hit
+    weapon.precision_hit = hit and precision
+    weapon.magazine -= 1
+    weapon.shots_fired += 1
+    stats["shots"] += 1
+    if hit:
+      stats["hits"] += 1
+      if precision:
+        stats["precision_hits"] += 1
+
+    if not self.use_time:
+      for perk in self.shot_perks:
+        perk.shot_trigger(weapon)
+      return
+
+    for index, perk in enumerate(self.shot_perks):
+      # Hits during the perk's cooldown don't count
+      if time < self.inactive_until[index]:
+        continue
+
+      # The counter is lost when no hit landed inside the window
+      window = self.windows[index]
+      if window is not None and self.last_hit[index] is not None and time - self.last_hit[index] > window:
+        perk.counter = 0
+
+      procs = perk.procs
+      perk.shot_trigger(weapon)
+      if hit:
+        self.last_hit[index] = time
+
+      if perk.cooldown is not None and perk.procs > procs:
+        self.inactive_until[index] = time + perk.cooldown
+
+  def reload(self, time: float):
+    """
+    Reloads the weapon for a logged reload, running the perks' reload triggers.
+    """
+    self.stats["end"] = time
+    if DpsPhase.reload(self.weapon):
+      self.stats["reloads"] += 1
+
+  def result(self):
+    """
+    Returns the statistics of the engagement being replayed.
+    """
+    stats = self.stats
+    perks = {perk.__class__.__name__: perk.state() for perk in self.weapon.perks}
+    # Placeholder perks have no state
+    perks = {name: state for name, state in perks.items() if state is not None}
+
+    return {
+      "engagement": self.engagement,
+      "duration": stats["end"] - stats["start"],
+      **stats,
+      "refunded": sum(state.get("refunded", 0) for state in perks.values()),
+      "magazine": self.weapon.magazine,
+      "reserves": self.weapon.reserves,
+      "perks": perks,
+    }
+
+
+def replay(events, config: WeaponConfig, use_time: bool = True):
+  """
+  Yields the statistics of every engagement in a stream of events, as soon as the engagement ends.
+
+  Parameters:
+  - events (iterable): The (engagement, time, event, hit, precision) tuples from read_events.
+  - config (WeaponConfig): The weapon to replay the log on.
+  - use_time (bool): Whether the timestamps decide the perks' windows and cooldowns (default is True).
+  """
+  log = LogReplay(config, use_time)
+
+  # Each run of events with the same engagement is one engagement, read lazily from the stream
+  for engagement, group in groupby(events, key=itemgetter(0)):
+    first = next(group)
+    log.start(engagement, first[1])
+
+    # Output from inside the perks (like RewindRounds procs) isn't wanted for every event
+    with use_sink(ResultSink()):
+      for _, time, event, hit, precision in chain((first,), group):
+        if event == "shot":
+          log.shot(time, hit, precision)
+        elif event == "reload":
+          log.reload(time)
+        else:
+          raise ValueError(f"Unknown event '{event}' in engagement {engagement}. Expected 'shot' or 'reload'.")
+
+    yield log.result()
+
+
+def report(result: dict, sink):
+  """
+  Shows an engagement's statistics on the sink and sends them as a result.
+  """
+  if sink.verbose:
+    sink.message(f"\nEngagement {result['engagement']} ({result['duration']:.2f} s)")
+    sink.message(f"Shots: {result['shots']} | Hits: {result['hits']} | Precision Hits: {result['precision_hits']}")
+    sink.message(f"Reloads: {result['reloads']} | Automatic Reloads: {result['auto_reloads']} | Dry Shots: {result['dry_shots']}")
+    for name, state in result["perks"].items():
+      sink.message(f"{name}: {state['procs']} procs, {state['refunded']} refunded")
+  sink.result(result)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Replay recorded combat logs through the perks.")
+  parser.add_argument("log", help="JSONL or CSV file of logged events")
+  parser.add_argument("--log-format", choices=LOG_FORMATS, help="format of the log (default is from the file extension, or jsonl)")
+  parser.add_argument("--mmap", action="store_true", help="read the log through a memory map")
+  parser.add_argument("--magazine", type=int, required=True, help="magazine size")
+  parser.add_argument("--reserves", type=int, default=-1, help="reserves size (default is -1, infinite)")
+  parser.add_argument("--fire-rate", type=int, default=0, help="fire rate in rounds per minute (default is 0)")
+  parser.add_argument("--perks", nargs="*", default=[], help="perk names, with a '+' after enhanced perks")
+  parser.add_argument("--no-timing", action="store_true", help="ignore the timestamps, like the shot by shot simulation")
+  parser.add_argument("--sink", choices=list(SINKS), default="json", help="how to write the results (default is json)")
+  parser.add_argument("--output", default="-", help="file to write the results to (default is stdout)")
+  args = parser.parse_args(argv)
+
+  try:
+    perks = tuple(parse_perk(perk) for perk in args.perks)
+  except ValueError as error:
+    parser.error(str(error))
+  if args.magazine < 1:
+    parser.error("--magazine must be at least 1")
+
+  log_format = args.log_format
+  if log_format is None:
+    log_format = "csv" if args.log.lower().endswith(".csv") else "jsonl"
+
+  config = WeaponConfig(args.magazine, args.reserves, args.fire_rate, perks)
+  lines, close = open_log(args.log, args.mmap)
+  output_file = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+  sink = SINKS[args.sink](output_file)
+
+  try:
+    for result in replay(read_events(lines, log_format), config, not args.no_timing):
+      report(result, sink)
+  except ValueError as error:
+    print(f"combatLog.py: {error}", file=sys.stderr)
+    return 1
+  finally:
+    sink.close()
+    close()
+    if output_file is not sys.stdout:
+      output_file.close()
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
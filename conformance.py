@@ -0,0 +1,706 @@
+"""
+The conformance harness checks every fast way of running a test against the per-shot simulator.
+
+The reference is the simulator at its plainest: a fresh weapon, `Weapon.shoot` until the magazine is empty, and for the
+all ammo test `Weapon.reload` and again until a reload fails. Every other way of getting the same answer is an engine,
+a function taking a WeaponConfig and a test and returning the weapon's outcome (or None if the engine can't answer for
+that weapon). The engines registered here are:
+- magazine_engine: MagazineEngine's closed form and cycle skipping, through run_test.
+- sweep: batchSweep's pooled closed-form tables.
+- weapon_batch: WeaponBatch's columns, loaded into and stored from its working copy.
+- lookup_table: the precomputed lookupTable.bin, for the weapons it covers (and none if it isn't built).
+- compiled_perks: the reference with the perks swapped for the ones compiled from SPECS by perkSpec.py.
+- snapshots: the reference, restoring a snapshot taken before every reload and every seventh shot and doing it again.
+More can be added with register_engine.
+
+The outcome of a test is the weapon's magazine, reserves, shots fired and reloads and every perk's state, in order, or
+NEVER_EMPTIES for a weapon that never runs out of ammo. The reference can't know a weapon never empties, so it gives up
+after 16 times the weapon's ammo (plus 1024) shots and calls the case unbounded. That is far past anything a weapon that
+empties fires with thin air refunds (TripleTap and FourthTimesTheCharm together, the fastest, fire 6 times the ammo),
+but RewindRounds on infinite reserves can keep going for a long time before it empties. An engine agrees with an
+unbounded case by giving up on the same budget or by not finishing either: engines run under a timer, and one that is
+still going after a few times as long as the reference took is stopped. An engine that says the weapon never empties,
+or that fires more shots than the reference could check, is checked against a reference run with LONG_RUN times the
+budget, and has to match it if that run finishes. An engine that runs out of time on a case the reference finished is
+a failure.
+
+Cases come from two places:
+- Boundary cases, every perk pairing on the magazines, reserves and fire rates where the perks change behaviour: the
+  smallest magazines, each side of every step of RewindRounds' activation threshold (28.75% of the magazine, rounded
+  down), multiples of the refund perks' trigger counts, reserves of none, one, and around a magazine, and fire rates
+  on each side of the steps of the disabled shots (fire rate // 60) where RewindRounds changes behaviour for the
+  magazine, see boundary_fire_rates.
+- Random cases, mostly small weapons (where the edges are) with every perk and random reserves and fire rates.
+Perks registered with perkSpec.register before the run are picked as well.
+
+Cases are split into chunks run by a pool of worker processes. Workers are only sent the seed and the chunk's number and
+generate their own cases, so nothing but the failures goes back. Every failure is shrunk to the smallest weapon that
+still fails the same way: perks are dropped or made plain, and the magazine, reserves and fire rate are cut down as far
+as they go.
+
+  python conformance.py --cases 200000 --seconds 60
+"""
+
+import argparse
+import contextlib
+import math
+import os
+import random
+import signal
+import sys
+import time
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+from weapon import Weapon
+from weaponConfig import WeaponConfig
+from weaponBatch import WeaponBatch
+from magazineEngine import TESTS, run_test
+from batchSweep import sweep, _perk_report_fields
+from lookupTable import LookupTable
+from perkSpec import SPECS, compile_perk
+from perks import PERK_TYPES
+from resultSink import SINKS, ResultSink, use_sink
+
+# The outcome of a weapon that never runs out of ammo.
+NEVER_EMPTIES = "never empties"
+
+# The outcome of a reference run that gave up, and of an engine that ran out of time.
+UNBOUNDED = "unbounded"
+TIMED_OUT = "timed out"
+
+# How many times the shot budget the reference gets when an engine says a weapon it gave up on never empties.
+LONG_RUN = 8
+
+# A common fire rate checked on every boundary magazine along with the steps from boundary_fire_rates.
+COMMON_FIRE_RATE = 600
+FIRE_RATES = (60, 72, 90, 110, 120, 140, 150, 180, 200, 225, 260, 300, 340, 360, 390, 450, 540, 600, 720, 900, 1000)
+
+
+def outcome(weapon: Weapon):
+  """
+  Returns the outcome of a test on the weapon: its magazine, reserves, shots fired and reloads and the state of each
+  perk, in order, or NEVER_EMPTIES if the test found that it never runs out of ammo.
+  """
+  if weapon.shots_fired == -1:
+    return NEVER_EMPTIES
+
+  return (weapon.magazine, weapon.reserves, weapon.shots_fired, weapon.reloads, tuple(perk.state() for perk in weapon.perks))
+
+
+def shot_budget(config: WeaponConfig):
+  """
+  Returns the shots the reference fires before it decides a weapon never runs out of ammo.
+  """
+  return 16 * (config.magazine_size + max(config.reserves_size, 0)) + 1024
+
+
+def reference(config: WeaponConfig, test: str, budget: int = None):
+  """
+  Runs a test shot by shot on a fresh weapon. Returns the outcome, or UNBOUNDED if the weapon was still firing after
+  its shot budget.
+
+  Parameters:
+  - config (WeaponConfig): The weapon to test.
+  - test (str): "magazine" or "all_ammo".
+  - budget (int): The shots to fire before giving up (default is None, see shot_budget).
+  """
+  weapon = config.build()
+  budget = shot_budget(config) if budget is None else budget
+
+  with use_sink(ResultSink()):
+    while True:
+      while weapon.shoot():
+        if weapon.shots_fired > budget:
+          return UNBOUNDED
+      if test != "all_ammo" or not weapon.reload():
+        break
+
+  return outcome(weapon)
+
+
+def run_magazine_engine(config: WeaponConfig, test: str):
+  """
+  Runs a test through MagazineEngine, see magazineEngine.run_test.
+  """
+  weapon = config.build()
+  run_test(weapon, test)
+
+  return outcome(weapon)
+
+
+def run_sweep(config: WeaponConfig, test: str):
+  """
+  Runs a test as a sweep of one configuration, see batchSweep.sweep.
+  """
+  table = sweep([config.magazine_size], [config.reserves_size], [config.perks], [config.fire_rate], test)
+  columns = table.columns
+  if columns["shots_fired"][0] == -1:
+    return NEVER_EMPTIES
+
+  perk_states = []
+  for slot, (name, enhanced) in enumerate(config.perks):
+    fields = _perk_report_fields(name)
+    perk_states.append(None if fields is None else {field: columns[f"perk{slot}_{field}"][0] for field in fields})
+
+  return (columns["magazine"][0], columns["reserves"][0], columns["shots_fired"][0], columns["reloads"][0],
+          tuple(perk_states))
+
+
+def run_weapon_batch(config: WeaponConfig, test: str):
+  """
+  Runs a test on a batch of one weapon, see WeaponBatch.
+  """
+  batch = WeaponBatch.from_configs([config])
+
+  with use_sink(ResultSink()):
+    if test == "magazine":
+      batch.fire_magazine()
+    else:
+      batch.expend_all()
+
+  return outcome(batch.load(0))
+
+
+# The lookup table each process reads from, opened the first time it is needed (False until then).
+_table = False
+
+def run_lookup_table(config: WeaponConfig, test: str):
+  """
+  Reads a test's result from lookupTable.bin. Returns None if there is no table or it doesn't cover the weapon.
+  """
+  global _table
+  if _table is False:
+    _table = LookupTable.open()
+  if _table is None:
+    return None
+
+  weapon = config.build()
+  try:
+    if test == "magazine":
+      shots = _table.fire_magazine(weapon)
+    else:
+      shots = _table.expend_all(weapon)
+  except ValueError:
+    return NEVER_EMPTIES
+
+  return None if shots is None else outcome(weapon)
+
+
+# The perks compiled from their specs, by name.
+_compiled = {}
+
+def run_compiled_perks(config: WeaponConfig, test: str):
+  """
+  Runs the reference with every perk that has a spec swapped for its compiled version, see perkSpec.py.
+  Returns None if none of the weapon's perks have a spec.
+  """
+  if not any(name in SPECS for name, enhanced in config.perks):
+    return None
+
+  perks = []
+  for name, enhanced in config.perks:
+    if name in SPECS and name not in _compiled:
+      _compiled[name] = compile_perk(SPECS[name])
+    perks.append(_compiled.get(name, PERK_TYPES[name])(enhanced=enhanced))
+
+  weapon = Weapon(magazine_size=config.magazine_size, fire_rate=config.fire_rate, reserves_size=config.reserves_size, perks=perks)
+  budget = shot_budget(config)
+
+  with use_sink(ResultSink()):
+    while True:
+      while weapon.shoot():
+        if weapon.shots_fired > budget:
+          return UNBOUNDED
+      if test != "all_ammo" or not weapon.reload():
+        break
+
+  return outcome(weapon)
+
+
+def run_snapshots(config: WeaponConfig, test: str):
+  """
+  Runs the reference, but takes a snapshot before every reload and every seventh shot, restores it afterwards and does
+  it again, see Weapon.snapshot. Anything a snapshot misses changes the outcome. Seven shares no factor with the trigger
+  counts, so the shots that are done twice land on every point of the perks' cycles.
+  """
+  weapon = config.build()
+  budget = shot_budget(config)
+
+  def again(action):
+    snapshot = weapon.snapshot()
+    action()
+    weapon.restore(snapshot)
+    return action()
+
+  def shoot():
+    return again(weapon.shoot) if weapon.shots_fired % 7 == 0 else weapon.shoot()
+
+  with use_sink(ResultSink()):
+    while True:
+      while shoot():
+        if weapon.shots_fired > budget:
+          return UNBOUNDED
+      if test != "all_ammo" or not again(weapon.reload):
+        break
+
+  return outcome(weapon)
+
+
+# The engines checked against the reference, by name.
+ENGINES = {
+  "magazine_engine": run_magazine_engine,
+  "sweep": run_sweep,
+  "weapon_batch": run_weapon_batch,
+  "lookup_table": run_lookup_table,
+  "compiled_perks": run_compiled_perks,
+  "snapshots": run_snapshots,
+}
+
+
+def register_engine(name: str, engine):
+  """
+  Adds an engine to be checked against the reference. Raises a ValueError if an engine with the same name exists.
+
+  Parameters:
+  - name (str): The name of the engine, used in reports.
+  - engine: A function taking a WeaponConfig and a test and returning the outcome (see outcome), or None if it can't
+    answer for the weapon. Engines run in worker processes, so the function has to be importable from a module.
+  """
+  if name in ENGINES:
+    raise ValueError(f"An engine named {name} is already registered.")
+
+  ENGINES[name] = engine
+
+
+@contextlib.contextmanager
+def time_limit(seconds: float):
+  """
+  Raises a TimeoutError in the block if it runs longer than `seconds`. Does nothing where there are no interval timers.
+  """
+  if not hasattr(signal, "setitimer"):
+    yield
+    return
+
+  def expired(signum, frame):
+    raise TimeoutError()
+
+  previous = signal.signal(signal.SIGALRM, expired)
+  signal.setitimer(signal.ITIMER_REAL, seconds)
+  try:
+    yield
+  finally:
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    signal.signal(signal.SIGALRM, previous)
+
+
+def check_case(config: WeaponConfig, test: str, engines: tuple, timeout: float = 2.0):
+  """
+  Runs a case through the reference and the engines. Returns the reference's outcome and a dictionary with the
+  outcome of every engine that answered for it.
+
+  Parameters:
+  - config (WeaponConfig): The weapon to test.
+  - test (str): "magazine" or "all_ammo".
+  - engines (tuple): The names of the engines to run.
+  - timeout (float): The seconds an engine gets on a case the reference finished (default is 2).
+  """
+  start = time.perf_counter()
+  expected = reference(config, test)
+  elapsed = time.perf_counter() - start
+
+  # When the reference gave up, an engine that keeps going is only given a few times as long
+  limit = 4 * elapsed + 0.05 if expected == UNBOUNDED else timeout
+
+  outcomes = {}
+  for name in engines:
+    try:
+      with time_limit(limit):
+        actual = ENGINES[name](config, test)
+    except TimeoutError:
+      actual = TIMED_OUT
+    if actual is not None:
+      outcomes[name] = actual
+
+  return expected, outcomes
+
+
+@lru_cache(maxsize=64)
+def long_reference(config: WeaponConfig, test: str):
+  """
+  Runs the reference with LONG_RUN times the shot budget, once per case however many engines need it.
+  """
+  return reference(config, test, LONG_RUN * shot_budget(config))
+
+
+def agrees(expected, actual, config: WeaponConfig, test: str):
+  """
+  Returns whether an engine's outcome agrees with the reference's.
+
+  Parameters:
+  - expected: The reference's outcome.
+  - actual: The engine's outcome.
+  - config (WeaponConfig): The weapon tested.
+  - test (str): The test run.
+  """
+  if expected == UNBOUNDED:
+    # Giving up on the same budget, or not finishing in time, says nothing the reference didn't
+    if actual == UNBOUNDED or actual == TIMED_OUT:
+      return True
+
+    # Anything else is a claim past the budget, so check it against a longer run
+    longer = long_reference(config, test)
+    if longer == UNBOUNDED:
+      return actual == NEVER_EMPTIES or actual[2] > LONG_RUN * shot_budget(config)
+    return actual == longer
+
+  return actual == expected
+
+
+def perk_options():
+  """
+  Returns every (perk name, enhanced) option, including perks registered by perkSpec.register.
+  """
+  return [(name, enhanced) for name in PERK_TYPES for enhanced in ((False,) if name == "Perk" else (False, True))]
+
+
+def boundary_fire_rates(magazine: int):
+  """
+  Returns the fire rates on each side of every step of RewindRounds' disabled shots (fire rate // 60, so a step at
+  every multiple of 60) where the perk behaves differently for the magazine: the first step, the refund of a full
+  magazine (plain or enhanced) less the activation threshold, where the shots left after a refund stop reaching the
+  threshold, and the refund itself, where every refunded shot is disabled. COMMON_FIRE_RATE is included too.
+
+  Parameters:
+  - magazine (int): The magazine size.
+  """
+  threshold = max(1, math.floor(magazine * 0.2875))
+  steps = {1}
+  for percentage_refund in (0.6, 0.7):
+    refund = min(math.ceil(magazine * percentage_refund), magazine)
+    steps.update((refund - threshold, refund - threshold + 1, refund, refund + 1))
+
+  fire_rates = {COMMON_FIRE_RATE}
+  for step in steps:
+    if step >= 1:
+      fire_rates.update((60 * step - 1, 60 * step))
+
+  return sorted(fire_rates)
+
+
+def boundary_cases():
+  """
+  Returns the boundary cases as a list of (config, test) pairs, in a fixed order.
+  """
+  # Magazines on each side of every step of the activation threshold, and around multiples of the trigger counts
+  magazines = set(range(1, 13))
+  for magazine in range(2, 61):
+    if math.floor(magazine * 0.2875) != math.floor((magazine - 1) * 0.2875):
+      magazines.update((magazine - 1, magazine))
+  for trigger_count in {getattr(perk_type, "trigger_count", None) for perk_type in PERK_TYPES.values()} - {None}:
+    for multiple in range(trigger_count, 25, trigger_count):
+      magazines.update((multiple - 1, multiple, multiple + 1))
+  magazines.update((100, 300))
+
+  options = perk_options()
+  combos = [()] + [(option,) for option in options] + list(product(options, repeat=2))
+  cases = []
+
+  for perks in combos:
+    # Fire rates only matter to perks that use them
+    uses_fire_rate = any(PERK_TYPES[name].uses_fire_rate for name, enhanced in perks)
+
+    for magazine in sorted(magazines):
+      fire_rates = boundary_fire_rates(magazine) if uses_fire_rate else (0,)
+      for reserves in sorted({-1, 0, 1, magazine - 1, magazine, magazine + 1}):
+        for fire_rate in fire_rates:
+          config = WeaponConfig(magazine, reserves, fire_rate, tuple(perks))
+          # Reloads fail without reserves, so the all ammo test only differs with some
+          for test in TESTS if reserves > 0 else ("magazine",):
+            cases.append((config, test))
+
+  return cases
+
+
+def random_case(rng: random.Random, options: list):
+  """
+  Returns a random (config, test) pair. Most weapons are small, where the perks' edges are.
+  """
+  roll = rng.random()
+  if roll < 0.5:
+    magazine = rng.randint(1, 20)
+  elif roll < 0.85:
+    magazine = rng.randint(1, 100)
+  else:
+    magazine = rng.randint(1, 400)
+
+  roll = rng.random()
+  if roll < 0.25:
+    reserves = -1
+  elif roll < 0.35:
+    reserves = 0
+  elif roll < 0.8:
+    reserves = rng.randint(1, 3 * magazine)
+  else:
+    reserves = rng.randint(1, 1000)
+
+  roll = rng.random()
+  if roll < 0.3:
+    fire_rate = 0
+  elif roll < 0.8:
+    fire_rate = rng.choice(FIRE_RATES)
+  else:
+    fire_rate = rng.randint(0, 1200)
+
+  perks = tuple(rng.choice(options) for slot in range(rng.choice((0, 1, 2, 2, 2))))
+
+  return WeaponConfig(magazine, reserves, fire_rate, perks), rng.choice(TESTS)
+
+
+# The boundary cases, worked out once per process.
+_boundary = None
+
+def run_chunk(chunk_index: int, seed: int, chunk_size: int, engines: tuple, timeout: float, boundary: bool):
+  """
+  Checks a chunk of cases. This is the function run by the workers. Returns a dictionary with the number of cases,
+  unbounded cases, comparisons made by each engine, and the failures as (config, test, engine, expected, actual) tuples.
+
+  Parameters:
+  - chunk_index (int): The position of the chunk, among the boundary chunks or the random chunks.
+  - seed (int): The seed random chunks are generated from.
+  - chunk_size (int): The number of cases in a chunk.
+  - engines (tuple): The names of the engines to check.
+  - timeout (float): The seconds an engine gets on a case.
+  - boundary (bool): Whether the chunk is taken from the boundary cases instead of generated.
+  """
+  global _boundary
+
+  if boundary:
+    if _boundary is None:
+      _boundary = boundary_cases()
+    cases = _boundary[chunk_index * chunk_size:(chunk_index + 1) * chunk_size]
+  else:
+    rng = random.Random(seed * 1000003 + chunk_index)
+    options = perk_options()
+    cases = [random_case(rng, options) for case in range(chunk_size)]
+
+  comparisons = dict.fromkeys(engines, 0)
+  failures = []
+  unbounded = 0
+
+  for config, test in cases:
+    expected, outcomes = check_case(config, test, engines, timeout)
+    if expected == UNBOUNDED:
+      unbounded += 1
+
+    for name, actual in outcomes.items():
+      comparisons[name] += 1
+      if not agrees(expected, actual, config, test):
+        failures.append((config, test, name, expected, actual))
+
+  return {"cases": len(cases), "unbounded": unbounded, "comparisons": comparisons, "failures": failures}
+
+
+def shrink_candidates(config: WeaponConfig, test: str):
+  """
+  Yields simpler versions of a case, simplest first, as (config, test) pairs.
+  """
+  magazine, reserves, fire_rate, perks = config
+
+  if test == "all_ammo":
+    yield config, "magazine"
+
+  for slot in range(len(perks)):
+    yield config._replace(perks=perks[:slot] + perks[slot + 1:]), test
+  for slot, (name, enhanced) in enumerate(perks):
+    if enhanced:
+      yield config._replace(perks=perks[:slot] + ((name, False),) + perks[slot + 1:]), test
+
+  for smaller in sorted({1, magazine // 2, magazine - 1}):
+    if 1 <= smaller < magazine:
+      yield config._replace(magazine_size=smaller), test
+  for smaller in sorted({0, reserves // 2, reserves - 1}):
+    if 0 <= smaller < reserves:
+      yield config._replace(reserves_size=smaller), test
+  for smaller in sorted({0, fire_rate // 2, fire_rate - 60, fire_rate - 1}):
+    if 0 <= smaller < fire_rate:
+      yield config._replace(fire_rate=smaller), test
+
+
+def shrink(config: WeaponConfig, test: str, engine: str, timeout: float = 2.0, max_checks: int = 2000):
+  """
+  Shrinks a failing case to the simplest case where the engine still disagrees with the reference.
+  Returns the (config, test, expected, actual) of the smallest failure found.
+
+  Parameters:
+  - config (WeaponConfig): The weapon that failed.
+  - test (str): The test that failed.
+  - engine (str): The engine that disagreed.
+  - timeout (float): The seconds the engine gets on a case (default is 2).
+  - max_checks (int): The most cases to try (default is 2000).
+  """
+  def failure(config, test):
+    expected, outcomes = check_case(config, test, (engine,), timeout)
+    actual = outcomes.get(engine)
+    if actual is not None and not agrees(expected, actual, config, test):
+      return expected, actual
+    return None
+
+  found = failure(config, test)
+  if found is None:
+    return config, test, None, None
+
+  checks = 1
+  shrunk = True
+  while shrunk and checks < max_checks:
+    shrunk = False
+    for candidate, candidate_test in shrink_candidates(config, test):
+      checks += 1
+      smaller = failure(candidate, candidate_test)
+      if smaller is not None:
+        config, test, found = candidate, candidate_test, smaller
+        shrunk = True
+        break
+      if checks >= max_checks:
+        break
+
+  return config, test, found[0], found[1]
+
+
+def run(cases: int = 100000, seconds: float = None, seed: int = 0, engines: tuple = None, workers: int = None,
+        chunk_size: int = 256, timeout: float = 2.0, boundary: bool = True):
+  """
+  Checks the engines against the reference on the boundary cases and then random cases, on a pool of worker processes.
+  Returns a dictionary with the number of cases, unbounded cases and comparisons, the comparisons by engine, the
+  elapsed seconds and comparisons per second, and the shrunk failures (one per engine and test).
+
+  Parameters:
+  - cases (int): The number of random cases (default is 100000).
+  - seconds (float): Stop handing out chunks after this many seconds (default is None, no limit).
+  - seed (int): The seed the random cases are generated from (default is 0).
+  - engines (tuple): The names of the engines to check (default is None, every registered engine).
+  - workers (int): The number of worker processes. Defaults to the number of CPUs.
+  - chunk_size (int): The number of cases sent to a worker at a time (default is 256).
+  - timeout (float): The seconds an engine gets on a case (default is 2).
+  - boundary (bool): Whether to check the boundary cases first (default is True).
+  """
+  engines = tuple(ENGINES) if engines is None else tuple(engines)
+  for name in engines:
+    if name not in ENGINES:
+      raise ValueError(f"Unknown engine '{name}'. Expected one of: {', '.join(ENGINES)}")
+
+  workers = workers or os.cpu_count() or 1
+  chunks = []
+  if boundary:
+    chunks += [(index, True) for index in range(math.ceil(len(boundary_cases()) / chunk_size))]
+  chunks += [(index, False) for index in range(math.ceil(cases / chunk_size))]
+
+  totals = {"cases": 0, "unbounded": 0, "comparisons": dict.fromkeys(engines, 0)}
+  failures = []
+  start = time.perf_counter()
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    # Keep a few chunks queued per worker, so the time limit is never far off
+    pending = set()
+    chunks = iter(chunks)
+
+    def submit_chunks():
+      while len(pending) < workers * 2:
+        if seconds is not None and time.perf_counter() - start > seconds:
+          return
+        chunk = next(chunks, None)
+        if chunk is None:
+          return
+        index, from_boundary = chunk
+        pending.add(pool.submit(run_chunk, index, seed, chunk_size, engines, timeout, from_boundary))
+
+    submit_chunks()
+    while pending:
+      done = next(iter(pending))
+      for future in pending:
+        if future.done():
+          done = future
+          break
+      pending.remove(done)
+      result = done.result()
+
+      totals["cases"] += result["cases"]
+      totals["unbounded"] += result["unbounded"]
+      for name, count in result["comparisons"].items():
+        totals["comparisons"][name] += count
+      failures += result["failures"]
+
+      submit_chunks()
+
+  elapsed = time.perf_counter() - start
+  comparisons = sum(totals["comparisons"].values())
+
+  # Failures of the same engine on the same test usually have the same cause, only the first is shrunk
+  shrunk = {}
+  for config, test, engine, expected, actual in failures:
+    if (engine, test) not in shrunk:
+      shrunk[(engine, test)] = (engine,) + shrink(config, test, engine, timeout)
+  # Shrinking often takes both tests down to the same case
+  shrunk = {failure[:3]: failure for failure in shrunk.values()}
+
+  return {
+    "cases": totals["cases"],
+    "unbounded": totals["unbounded"],
+    "comparisons": comparisons,
+    "by_engine": totals["comparisons"],
+    "failures": len(failures),
+    "seconds": elapsed,
+    "comparisons_per_second": comparisons / elapsed if elapsed else 0,
+    "shrunk": [
+      {"engine": engine, "test": test, "config": config._asdict(), "expected": expected, "actual": actual}
+      for engine, config, test, expected, actual in shrunk.values()
+    ],
+  }
+
+
+def report(result: dict, sink):
+  """
+  Shows the result of a run on the sink and sends every shrunk failure as a result.
+  """
+  if sink.verbose:
+    sink.message(f"\nCases: {result['cases']} ({result['unbounded']} unbounded) | Comparisons: {result['comparisons']}")
+    sink.message(f"{result['seconds']:.1f} s, {result['comparisons_per_second']:.0f} comparisons per second")
+    for name, count in result["by_engine"].items():
+      sink.message(f"  {name}: {count}")
+    sink.message(f"Mismatches: {result['failures']}")
+
+  for failure in result["shrunk"]:
+    if sink.verbose:
+      config = WeaponConfig(**failure["config"])
+      sink.message(f"\n{failure['engine']} disagrees on the {failure['test']} test of {config}")
+      sink.message(f"  Expected: {failure['expected']}")
+      sink.message(f"  Actual:   {failure['actual']}")
+    sink.result(failure)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Check the fast engines against the per-shot simulator.")
+  parser.add_argument("--cases", type=int, default=100000, help="random cases to check (default is 100000)")
+  parser.add_argument("--seconds", type=float, help="stop after this many seconds (default is no limit)")
+  parser.add_argument("--seed", type=int, default=0, help="seed for the random cases (default is 0)")
+  parser.add_argument("--engines", nargs="+", choices=list(ENGINES), help="engines to check (default is every engine)")
+  parser.add_argument("--workers", type=int, help="worker processes (default is one per CPU)")
+  parser.add_argument("--chunk-size", type=int, default=256, help="cases sent to a worker at a time (default is 256)")
+  parser.add_argument("--timeout", type=float, default=2.0, help="seconds an engine gets on a case (default is 2)")
+  parser.add_argument("--no-boundary", action="store_true", help="skip the boundary cases")
+  parser.add_argument("--sink", choices=list(SINKS), default="text", help="how to write the result (default is text)")
+  args = parser.parse_args(argv)
+
+  result = run(args.cases, args.seconds, args.seed, args.engines, args.workers, args.chunk_size, args.timeout,
+               not args.no_boundary)
+
+  sink = SINKS[args.sink]()
+  report(result, sink)
+  sink.close()
+
+  return 1 if result["failures"] else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
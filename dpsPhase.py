@@ -0,0 +1,210 @@
+"""
+DpsPhase simulates a weapon over time instead of shot by shot, to answer how many shots and damage ticks a weapon gets
+out in a damage phase of a given length.
+
+The shot by shot simulation assumes every hit lands inside each perk's window and approximates RewindRounds' inactive
+second with a number of disabled shots. Here every event has a time:
+- Shots are fired at the weapon's fire rate (rounds per minute), starting at time 0.
+- When the magazine is empty the weapon reloads, which takes the given reload time.
+- TripleTap and FourthTimesTheCharm lose their counter when no hit lands inside their window (2 seconds, or 3 when
+  enhanced). This only matters when the weapon fires slower than the window, or a reload takes longer than it.
+- RewindRounds is inactive for 1 second after a proc, ignoring every hit during that second.
+Every shot is still assumed to be a precision hit.
+
+Events are kept on a priority queue ordered by time. Shots follow a fixed cadence, so the next shot is tracked on its own
+and only the events that break the cadence (reloads and closing windows) go on the queue.
+"""
+
+import heapq
+
+from weapon import Weapon
+from resultSink import ResultSink, use_sink
+
+# Kinds of events, in the order they are handled when they happen at the same time.
+RELOADED = 0
+WINDOW_CLOSED = 1
+
+
+class EventScheduler():
+  """
+  A priority queue of timed events.
+
+  Attributes:
+  - queue (list): A heap of (time, kind, sequence, payload) events.
+  - sequence (int): The number of events scheduled, used to keep events at the same time in the order they were added.
+  """
+  def __init__(self):
+    """
+    Initializes a new, empty instance of the EventScheduler class.
+    """
+    self.queue = []
+    self.sequence = 0
+
+  def __len__(self):
+    return len(self.queue)
+
+  def schedule(self, time: float, kind: int, payload=None):
+    """
+    Adds an event to the queue.
+
+    Parameters:
+    - time (float): The time of the event in seconds.
+    - kind (int): The kind of event.
+    - payload: Any data the event needs when it is handled.
+    """
+    heapq.heappush(self.queue, (time, kind, self.sequence, payload))
+    self.sequence += 1
+
+  def peek(self):
+    """
+    Returns the time of the next event, or None if the queue is empty.
+    """
+    return self.queue[0][0] if self.queue else None
+
+  def pop(self):
+    """
+    Removes the next event from the queue and returns it as a (time, kind, payload) tuple.
+    """
+    time, kind, sequence, payload = heapq.heappop(self.queue)
+    return time, kind, payload
+
+
+class DpsPhase():
+  """
+  A class that holds the methods for simulating a weapon over a timed damage phase.
+  """
+
+  def run(weapon: Weapon, duration: float, reload_time: float, ticks_per_shot: int = 1):
+    """
+    Fires the weapon for `duration` seconds, starting from its current state, and reloading whenever it is empty.
+    Returns a dictionary with the shots fired, damage ticks and reloads during the phase, the weapon's ammo at the end
+    of it, when it ran out of ammo (or None), and the state of each perk.
+
+    Parameters:
+    - weapon (Weapon): The weapon to fire. Its fire rate is in rounds per minute and must be above 0.
+    - duration (float): The length of the damage phase in seconds.
+    - reload_time (float): The time a reload takes in seconds.
+    - ticks_per_shot (int): The number of damage ticks each shot deals (default is 1).
+    """
+    if weapon.fire_rate <= 0:
+      raise ValueError("The weapon needs a fire rate above 0 to be simulated over time.")
+
+    weapon.compile()
+    interval = 60 / weapon.fire_rate
+    scheduler = EventScheduler()
+
+    # Perks are handled here instead of through Weapon.shoot, so their windows and cooldowns can be applied
+    shot_perks = [perk for perk in weapon.perks if "shot" in perk.events]
+    windows = [perk.enhanced_hit_window if perk.enhanced else perk.hit_window for perk in shot_perks]
+    last_hit = [None] * len(shot_perks)
+    inactive_until = [0.0] * len(shot_perks)
+
+    shots_fired = weapon.shots_fired
+    reloads = weapon.reloads
+    out_of_ammo = None
+    next_shot = 0.0
+
+    try:
+      # The cooldown replaces the disabled shots of the shot by shot simulation
+      for perk in shot_perks:
+        if perk.cooldown is not None:
+          perk.inactive_shots = 0
+
+      with use_sink(ResultSink()):
+        while True:
+          # Handle any events that happen before the next shot, a hit landing exactly as a window closes still counts
+          next_event = scheduler.peek()
+          if next_event is not None and (next_shot is None or next_event < next_shot):
+            time, kind, payload = scheduler.pop()
+            if time >= duration:
+              break
+
+            if kind == RELOADED:
+              if not DpsPhase.reload(weapon):
+                out_of_ammo = time
+                break
+              next_shot = time
+
+            elif kind == WINDOW_CLOSED:
+              # Only reset the counter if no hit has landed since the window was opened
+              index, hit_time = payload
+              if last_hit[index] == hit_time:
+                shot_perks[index].counter = 0
+            continue
+
+          if next_shot is None or next_shot >= duration:
+            break
+
+          time = next_shot
+
+          # A weapon that starts out empty reloads before its first shot
+          if weapon.magazine == 0:
+            next_shot = None
+            scheduler.schedule(time + reload_time, RELOADED)
+            continue
+
+          weapon.magazine -= 1
+          weapon.shots_fired += 1
+
+          for index, perk in enumerate(shot_perks):
+            # Hits during the perk's cooldown don't count
+            if time < inactive_until[index]:
+              continue
+
+            procs = perk.procs
+            perk.shot_trigger(weapon)
+            last_hit[index] = time
+
+            if perk.cooldown is not None and perk.procs > procs:
+              inactive_until[index] = time + perk.cooldown
+
+          # Start reloading as soon as the magazine is empty, otherwise keep to the fire rate
+          if weapon.magazine == 0:
+            next_shot = None
+            scheduler.schedule(time + reload_time, RELOADED)
+            gap = reload_time
+          else:
+            next_shot = time + interval
+            gap = interval
+
+          # Only schedule a window to close if it can close before the next hit
+          for index, window in enumerate(windows):
+            if window is not None and last_hit[index] == time and gap > window:
+              scheduler.schedule(time + window, WINDOW_CLOSED, (index, time))
+    finally:
+      # Put back anything the cooldowns replaced, even if the phase stopped early, so the weapon can go back to the
+      # shot by shot simulation
+      weapon.compile()
+
+    shots = weapon.shots_fired - shots_fired
+
+    return {
+      "duration": duration,
+      "shots_fired": shots,
+      "damage_ticks": shots * ticks_per_shot,
+      "reloads": weapon.reloads - reloads,
+      "magazine": weapon.magazine,
+      "reserves": weapon.reserves,
+      "out_of_ammo": out_of_ammo,
+      "perks": {perk.__class__.__name__: perk.state() for perk in weapon.perks},
+    }
+
+  def reload(weapon: Weapon):
+    """
+    Reloads the weapon, the same as Weapon.reload, except that weapons with infinite reserves (-1) can always reload.
+    Returns True if the weapon was reloaded, False if there were no reserves to reload from.
+
+    Parameters:
+    - weapon (Weapon): The weapon to reload.
+    """
+    if weapon.reserves_size != -1:
+      return weapon.reload()
+
+    # Primary ammo never runs out, so a full magazine is always available
+    weapon.magazine = weapon.magazine_size
+    weapon.reloads += 1
+
+    for reload_trigger in weapon.reload_hooks:
+      reload_trigger(weapon)
+
+    return True
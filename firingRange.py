@@ -1,65 +1,108 @@
 from weapon import Weapon
+from weaponConfig import WeaponConfig
+from magazineEngine import MagazineEngine
+from resultSink import ResultSink, current_sink
 
 class FiringRange():
   """
   A class that holds the methods for simulating the tests for firing the weapons.
+  Output goes to the given sink, or the current sink (see resultSink.py) when none is given.
+  Given a LookupTable (see lookupTable.py), results are read from it whenever it covers the weapon.
   """
 
-  def mag_test(weapon: Weapon):
+  def mag_test(weapon: Weapon, sink: ResultSink = None, table=None):
     """
     Tests Firing one magazine of a weapon.
     - Weapon: The weapon object to be tested.
+    - sink (ResultSink): The sink to send the report and result to (default is the current sink).
+    - table (LookupTable): A table to read the result from, if it covers the weapon (default is None, simulate it).
     """
+    sink = sink or current_sink()
+
     # Fire the weapon until the magazine is empty
-    print("\nMAGAZINE TEST")
-    
+    sink.message("\nMAGAZINE TEST")
+
     # Fire the weapon until the magazine is empty
-    remaining_ammo = True
-    while (remaining_ammo):
-      remaining_ammo = weapon.shoot()
+    try:
+      if table is None or table.fire_magazine(weapon) is None:
+        MagazineEngine.fire_magazine(weapon)
+    except ValueError as error:
+      sink.message(str(error))
+      sink.result(FiringRange.record(weapon, "magazine", error=str(error)))
+      weapon.resupply()
+      return
 
     # Report the status of the weapon after using the magazine
-    weapon.report()
+    weapon.report(sink)
 
     # Determine the number of shots fired and compare to the magazine size
-    print("Extra Shots Fired: " + str(weapon.shots_fired - weapon.magazine_size))
-    print("\nMagazine test completed.\n")
+    extra_shots = weapon.shots_fired - weapon.magazine_size
+    sink.message("Extra Shots Fired: " + str(extra_shots))
+    sink.message("\nMagazine test completed.\n")
+    sink.result(FiringRange.record(weapon, "magazine", extra_shots=extra_shots))
 
     weapon.resupply()
 
-  def all_ammo_test(weapon: Weapon):
+  def all_ammo_test(weapon: Weapon, sink: ResultSink = None, table=None):
     """
     Tests expending all ammo from a weapon.
 
     Parameters:
     - weapon: The weapon object to be tested.
+    - sink (ResultSink): The sink to send the report and result to (default is the current sink).
+    - table (LookupTable): A table to read the result from, if it covers the weapon (default is None, simulate it).
     """
+    sink = sink or current_sink()
 
     # Exit test if the weapon has infinite reserves.
     if weapon.reserves_size == -1:
-      print ("This weapon uses primary ammo meaning it has infinite reserves. Cannot test all ammo.")
+      error = "This weapon uses primary ammo meaning it has infinite reserves. Cannot test all ammo."
+      sink.message(error)
+      sink.result(FiringRange.record(weapon, "all_ammo", error=error))
       return
-    
-    print("\nALL AMMO TEST")
+
+    sink.message("\nALL AMMO TEST")
     # Fire the weapon until the magazine and reserves are empty.
-    remaining_ammo = True
-    while (remaining_ammo):
-      # Attempt to fire the weapon
-      shot_fired = weapon.shoot()
-      
-      # If the weapon cannot fire (magazine is empty), attempt to reload
-      if not shot_fired:
-        successful_reload = weapon.reload()
-
-        # If reload was unsuccessful, there is no ammo left to fire
-        if not successful_reload:
-          remaining_ammo = False
-          print("No more ammo left to fire.")
+    # The weapon is reloaded each time the magazine is empty until there is no ammo left to fire.
+    try:
+      if table is None or table.expend_all(weapon) is None:
+        MagazineEngine.expend_all(weapon)
+    except ValueError as error:
+      sink.message(str(error))
+      sink.result(FiringRange.record(weapon, "all_ammo", error=str(error)))
+      weapon.resupply()
+      return
+    sink.message("No more ammo left to fire.")
 
     # Report the status of the weapon after expending all ammo
-    weapon.report()
-    print("Total Initial Ammo: " + str(weapon.magazine_size + (weapon.reserves_size)))
-    print("Extra Shots Fired: " + str(weapon.shots_fired - (weapon.magazine_size + weapon.reserves_size)))
-    print("\nAll ammo test completed.\n")
+    weapon.report(sink)
+    total_ammo = weapon.magazine_size + weapon.reserves_size
+    extra_shots = weapon.shots_fired - total_ammo
+    sink.message("Total Initial Ammo: " + str(total_ammo))
+    sink.message("Extra Shots Fired: " + str(extra_shots))
+    sink.message("\nAll ammo test completed.\n")
+    sink.result(FiringRange.record(weapon, "all_ammo", extra_shots=extra_shots))
+
+    weapon.resupply()
+
+  def record(weapon: Weapon, test: str, extra_shots: int = None, error: str = None):
+    """
+    Returns the result of a test as a dictionary for the sinks: the test, the weapon's configuration, the error that
+    stopped the test (or None), the state of the weapon after the test and its extra shots (None after an error).
+    Every result for the same perks has the same fields, so they line up as rows.
+
+    Parameters:
+    - weapon (Weapon): The weapon after the test.
+    - test (str): The test that was run, "magazine" or "all_ammo".
+    - extra_shots (int): The shots fired beyond the weapon's ammo.
+    - error (str): Why the test couldn't finish, or None if it did.
+    """
+    config = WeaponConfig.from_weapon(weapon)
 
-    weapon.resupply()
\ No newline at end of file
+    return {
+      "test": test,
+      "config": config._asdict(),
+      "error": error,
+      "state": weapon.state(),
+      "extra_shots": extra_shots,
+    }
@@ -0,0 +1,167 @@
+"""
+Runs the tests on many weapons without any prompts, for scripts and automated runs.
+
+Weapon configurations are read from a JSONL or CSV file, or from stdin, and every test result is streamed to a sink
+(see resultSink.py), one JSON line per result by default:
+
+  python headless.py weapons.jsonl --tests magazine all_ammo --sink json --output results.jsonl
+
+A JSONL line is an object with the WeaponConfig fields. Only the magazine size is required, and each perk is either
+a name, a [name, enhanced] pair or an object with "name" and "enhanced":
+
+  {"magazine_size": 12, "reserves_size": 100, "perks": ["TripleTap", ["RewindRounds", true]], "fire_rate": 600}
+
+A CSV file has a header with the same columns. The perks column holds perk names separated by ";", with a "+" after
+the name of an enhanced perk:
+
+  magazine_size,reserves_size,fire_rate,perks
+  12,100,600,TripleTap;RewindRounds+
+
+Perk names are the ones in perks.PERK_TYPES.
+"""
+
+import argparse
+import csv
+import json
+import sys
+
+from weaponConfig import WeaponConfig
+from firingRange import FiringRange
+from magazineEngine import TESTS
+from perks import PERK_TYPES
+from resultSink import SINKS, use_sink
+
+INPUT_FORMATS = ("jsonl", "csv")
+
+
+def parse_perk(perk):
+  """
+  Returns a (perk name, enhanced) pair from a perk in an input record.
+
+  Parameters:
+  - perk: A perk name (with a "+" after it if enhanced), a [name, enhanced] pair or a {"name", "enhanced"} object.
+  """
+  if isinstance(perk, str):
+    name = perk.strip()
+    enhanced = name.endswith("+")
+    name = name.rstrip("+").strip()
+  elif isinstance(perk, dict):
+    name, enhanced = perk["name"], perk.get("enhanced", False)
+  else:
+    name, enhanced = perk
+
+  if name not in PERK_TYPES:
+    raise ValueError(f"Unknown perk '{name}'. Expected one of: {', '.join(PERK_TYPES)}")
+
+  return (name, bool(enhanced))
+
+
+def parse_config(record: dict):
+  """
+  Returns the WeaponConfig described by a record read from the input.
+
+  Parameters:
+  - record (dict): The fields of the configuration. The perks are a list, or a string separated by ";" from CSV.
+  """
+  perks = record.get("perks") or []
+  if isinstance(perks, str):
+    perks = [perk for perk in perks.split(";") if perk.strip()]
+
+  def number(field, default):
+    value = record.get(field)
+    return default if value is None or value == "" else int(value)
+
+  # An empty magazine can't be fired or reloaded, and the engines divide by its size
+  magazine_size = number("magazine_size", None)
+  if magazine_size is not None and magazine_size < 1:
+    raise ValueError("magazine_size must be at least 1.")
+
+  return WeaponConfig(
+    magazine_size=magazine_size,
+    reserves_size=number("reserves_size", -1),
+    fire_rate=number("fire_rate", 0),
+    perks=tuple(parse_perk(perk) for perk in perks),
+  )
+
+
+def read_configs(stream, input_format: str = "jsonl"):
+  """
+  Yields a WeaponConfig for every record in the input, one at a time so the input is never held in memory.
+
+  Parameters:
+  - stream: The file to read from.
+  - input_format (str): "jsonl" or "csv" (default is "jsonl").
+  """
+  if input_format == "csv":
+    records = enumerate(csv.DictReader(stream), start=2)
+  else:
+    records = ((number, json.loads(line)) for number, line in enumerate(stream, start=1) if line.strip())
+
+  for line_number, record in records:
+    try:
+      if record.get("magazine_size") in (None, ""):
+        raise ValueError("Missing magazine_size.")
+      yield parse_config(record)
+    except (ValueError, TypeError, KeyError) as error:
+      raise ValueError(f"Line {line_number}: {error}") from None
+
+
+def run(configs, tests: tuple, sink):
+  """
+  Runs the tests on every configuration and sends the results to the sink.
+  Returns the number of weapons tested.
+
+  Parameters:
+  - configs (iterable): The WeaponConfig of each weapon.
+  - tests (tuple): The tests to run on each weapon, out of "magazine" and "all_ammo".
+  - sink (ResultSink): The sink for the results and messages.
+  """
+  count = 0
+
+  # Output from inside the simulation (like RewindRounds procs) goes to the same sink
+  with use_sink(sink):
+    for config in configs:
+      weapon = config.build()
+      for test in tests:
+        if test == "magazine":
+          FiringRange.mag_test(weapon, sink)
+        else:
+          FiringRange.all_ammo_test(weapon, sink)
+      count += 1
+
+  sink.close()
+  return count
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Run the weapon tests on weapon configurations without any prompts.")
+  parser.add_argument("input", nargs="?", default="-", help="JSONL or CSV file of weapon configurations (default is stdin)")
+  parser.add_argument("--input-format", choices=INPUT_FORMATS, help="format of the input (default is from the file extension, or jsonl)")
+  parser.add_argument("--tests", nargs="+", choices=TESTS, default=list(TESTS), help="tests to run on each weapon (default is both)")
+  parser.add_argument("--sink", choices=list(SINKS), default="json", help="how to write the results (default is json)")
+  parser.add_argument("--output", default="-", help="file to write the results to (default is stdout)")
+  args = parser.parse_args(argv)
+
+  input_format = args.input_format
+  if input_format is None:
+    input_format = "csv" if args.input.lower().endswith(".csv") else "jsonl"
+
+  input_file = sys.stdin if args.input == "-" else open(args.input, newline="")
+  output_file = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+
+  try:
+    run(read_configs(input_file, input_format), tuple(args.tests), SINKS[args.sink](output_file))
+  except ValueError as error:
+    print(f"headless.py: {error}", file=sys.stderr)
+    return 1
+  finally:
+    if input_file is not sys.stdin:
+      input_file.close()
+    if output_file is not sys.stdout:
+      output_file.close()
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,450 @@
+"""
+Instrumentation shows what a weapon did shot by shot, and where the time went.
+
+Weapon.shoot, Weapon.reload and Weapon.resupply call the perk hooks Weapon.compile() builds. Instrumenting a weapon
+swaps those hooks for wrapped ones, so nothing is checked or counted on a weapon that isn't instrumented, and calling
+compile() again puts the plain hooks back. Only the per-shot simulator calls the hooks, MagazineEngine's closed forms
+and skipped cycles don't, so instrument a weapon that is fired round by round.
+
+A PerkProfiler counts the calls and the time spent in each perk class's hooks, along with the number of shots,
+reloads and resupplies.
+
+A TraceRecorder writes every event to a compact binary trace, either kept in memory or written to a file in chunks:
+- A shot, with the shot's index and the magazine before and after the round was fired.
+- A proc, with the perk that procced, the magazine before and after its refund, and whether the refund came from thin
+  air or from reserves.
+- A reload, with the magazine before and after and the rounds loaded from reserves.
+- A reset when the weapon is resupplied.
+
+A trace starts with a header (the magic bytes, the format, and the length of a JSON description of the weapon) followed
+by fixed-width records (see RECORD). TraceReader reads a trace back a chunk at a time, so summarize and replay work on
+traces with millions of events without loading them into memory.
+"""
+
+import io
+import json
+import struct
+import time
+from collections import namedtuple
+
+from weapon import Weapon
+from resultSink import ResultSink, current_sink
+
+# Bump this whenever the layout of the trace changes.
+TRACE_FORMAT = 1
+MAGIC = b"D2TR"
+HEADER = struct.Struct("<4sHI")
+
+# kind, perk index, source, shot index, magazine before, magazine after, rounds moved, reserves after
+RECORD = struct.Struct("<BBBxQiiiq")
+
+# Kinds of events.
+SHOT = 0
+PROC = 1
+RELOAD = 2
+RESET = 3
+KINDS = ("shot", "proc", "reload", "reset")
+
+# Where the rounds of an event came from.
+NO_SOURCE = 0
+THIN_AIR = 1
+RESERVES = 2
+SOURCES = ("none", "thin air", "reserves")
+
+# The perk index of events that don't belong to a perk.
+NO_PERK = 255
+
+TraceEvent = namedtuple("TraceEvent", ("kind", "perk", "source", "shot", "magazine_before", "magazine_after", "rounds", "reserves"))
+
+
+class PerkProfiler():
+  """
+  Counts the calls and time spent in the hooks of each perk class.
+
+  Attributes:
+  - perks (dict): [calls, seconds] for each (perk class name, event) pair.
+  - shots (int): The number of rounds fired.
+  - reloads (int): The number of reloads.
+  - resupplies (int): The number of times the weapon was resupplied.
+  - wall (float): The seconds spent in PerkProfiler.fire, to compare the time in the perks against.
+  """
+  def __init__(self):
+    """
+    Initializes a new, empty instance of the PerkProfiler class.
+    """
+    self.perks = {}
+    self.shots = 0
+    self.reloads = 0
+    self.resupplies = 0
+    self.wall = 0.0
+
+  def wrap(self, perk, event: str, hook):
+    """
+    Returns the hook wrapped to count its calls and time.
+
+    Parameters:
+    - perk (Perk): The perk the hook belongs to.
+    - event (str): The event the hook handles, "shot", "reload" or "reset".
+    - hook: The perk's method for the event.
+    """
+    entry = self.perks.setdefault((perk.__class__.__name__, event), [0, 0.0])
+    clock = time.perf_counter
+
+    if event == "reset":
+      def timed():
+        start = clock()
+        hook()
+        entry[1] += clock() - start
+        entry[0] += 1
+    else:
+      def timed(weapon):
+        start = clock()
+        hook(weapon)
+        entry[1] += clock() - start
+        entry[0] += 1
+
+    return timed
+
+  def count(self, weapon: Weapon, event: str):
+    """
+    Returns a hook that counts the weapon's shots, reloads or resupplies.
+    """
+    if event == "shot":
+      def shot(weapon):
+        self.shots += 1
+      return shot
+
+    if event == "reload":
+      def reload(weapon):
+        self.reloads += 1
+      return reload
+
+    def reset():
+      self.resupplies += 1
+    return reset
+
+  def fire(self, weapon: Weapon, test: str = "magazine"):
+    """
+    Fires an instrumented weapon round by round, timing the whole test, and returns the shots fired.
+
+    Parameters:
+    - weapon (Weapon): The weapon to fire.
+    - test (str): "magazine" to empty the magazine or "all_ammo" to reload until out of ammo (default is "magazine").
+    """
+    start = time.perf_counter()
+
+    while weapon.shoot():
+      pass
+    if test == "all_ammo":
+      while weapon.reload():
+        while weapon.shoot():
+          pass
+
+    self.wall += time.perf_counter() - start
+    return weapon.shots_fired
+
+  def summary(self):
+    """
+    Returns a dictionary with the counts and, for each perk class and event, the calls, total seconds and average
+    microseconds per call.
+    """
+    return {
+      "shots": self.shots,
+      "reloads": self.reloads,
+      "resupplies": self.resupplies,
+      "wall": self.wall,
+      "perks": {
+        f"{name}.{event}": {"calls": calls, "seconds": seconds, "us_per_call": seconds / calls * 1e6 if calls else 0.0}
+        for (name, event), (calls, seconds) in sorted(self.perks.items())
+      },
+    }
+
+  def report(self, sink: ResultSink = None):
+    """
+    Shows the summary on the sink (or the current sink) and returns it.
+    """
+    sink = sink or current_sink()
+    summary = self.summary()
+
+    sink.message(f"Shots: {summary['shots']} | Reloads: {summary['reloads']} | Resupplies: {summary['resupplies']}")
+    for name, entry in summary["perks"].items():
+      share = f" ({entry['seconds'] / self.wall:.0%} of the test)" if self.wall else ""
+      sink.message(f"{name}: {entry['calls']} calls, {entry['seconds'] * 1000:.2f} ms, {entry['us_per_call']:.3f} us per call{share}")
+    sink.result({"profile": summary})
+
+    return summary
+
+
+class TraceRecorder():
+  """
+  Records the events of a weapon into a binary trace.
+
+  Attributes:
+  - stream: The file the trace is written to, or a BytesIO when it is kept in memory.
+  - buffer (bytearray): The records not written to the stream yet.
+  - chunk_records (int): The number of records buffered before they are written out.
+  - events (int): The number of events recorded.
+  """
+  def __init__(self, path: str = None, chunk_records: int = 65536):
+    """
+    Initializes a new instance of the TraceRecorder class.
+
+    Parameters:
+    - path (str): The file to write the trace to (default is None, keep it in memory, see getvalue).
+    - chunk_records (int): The number of records buffered before they are written out (default is 65536).
+    """
+    self.stream = open(path, "wb") if path is not None else io.BytesIO()
+    self.buffer = bytearray()
+    self.chunk_records = chunk_records
+    self.events = 0
+    self._started = False
+    self._magazine = 0
+
+  def start(self, weapon: Weapon):
+    """
+    Writes the trace's header describing the weapon. Called once, when the first weapon is instrumented.
+    """
+    if self._started:
+      return
+
+    description = json.dumps({
+      "magazine_size": weapon.magazine_size,
+      "reserves_size": weapon.reserves_size,
+      "fire_rate": weapon.fire_rate,
+      "perks": [[perk.__class__.__name__, perk.enhanced] for perk in weapon.perks],
+    }).encode()
+
+    self.stream.write(HEADER.pack(MAGIC, TRACE_FORMAT, len(description)) + description)
+    self._started = True
+    self._magazine = weapon.magazine
+
+  def record(self, kind: int, perk: int, source: int, shot: int, before: int, after: int, rounds: int, reserves: int):
+    """
+    Adds an event to the trace.
+    """
+    self.buffer += RECORD.pack(kind, perk, source, shot, before, after, rounds, reserves)
+    self.events += 1
+    self._magazine = after
+
+    if len(self.buffer) >= self.chunk_records * RECORD.size:
+      self.flush()
+
+  def wrap(self, weapon: Weapon, index: int, perk, event: str, hook):
+    """
+    Returns the hook wrapped to record any proc it causes. Only shot and reload hooks can proc.
+
+    Parameters:
+    - weapon (Weapon): The weapon the perk is on.
+    - index (int): The position of the perk on the weapon.
+    - perk (Perk): The perk the hook belongs to.
+    - event (str): The event the hook handles, "shot", "reload" or "reset".
+    - hook: The perk's method for the event.
+    """
+    if event == "reset" or not hasattr(perk, "procs"):
+      return hook
+
+    source = RESERVES if perk.refunds_from_reserves else THIN_AIR
+
+    def recorded(weapon):
+      procs = perk.procs
+      before = weapon.magazine
+      hook(weapon)
+      if perk.procs != procs:
+        self.record(PROC, index, source, weapon.shots_fired, before, weapon.magazine, weapon.magazine - before, weapon.reserves)
+
+    return recorded
+
+  def event(self, weapon: Weapon, event: str):
+    """
+    Returns a hook that records the weapon's shots, reloads or resupplies. It runs before the perks' hooks.
+    """
+    if event == "shot":
+      def shot(weapon):
+        self.record(SHOT, NO_PERK, NO_SOURCE, weapon.shots_fired, weapon.magazine + 1, weapon.magazine, 1, weapon.reserves)
+      return shot
+
+    if event == "reload":
+      def reload(weapon):
+        before = self._magazine
+        self.record(RELOAD, NO_PERK, RESERVES, weapon.shots_fired, before, weapon.magazine, weapon.magazine - before, weapon.reserves)
+      return reload
+
+    def reset():
+      self.record(RESET, NO_PERK, NO_SOURCE, weapon.shots_fired, self._magazine, weapon.magazine, 0, weapon.reserves)
+    return reset
+
+  def flush(self):
+    """
+    Writes the buffered records to the stream.
+    """
+    if self.buffer:
+      self.stream.write(self.buffer)
+      self.buffer = bytearray()
+
+  def getvalue(self):
+    """
+    Returns the whole trace as bytes, when it is kept in memory.
+    """
+    self.flush()
+    return self.stream.getvalue()
+
+  def close(self):
+    """
+    Writes any buffered records and closes the trace file. A trace kept in memory stays readable with getvalue.
+    """
+    self.flush()
+    if not isinstance(self.stream, io.BytesIO):
+      self.stream.close()
+
+
+def instrument(weapon: Weapon, profiler: PerkProfiler = None, recorder: TraceRecorder = None):
+  """
+  Replaces the weapon's hooks with instrumented ones. Weapon.compile() puts the plain hooks back.
+  The profiler only times the perks themselves, the time spent recording a trace isn't counted.
+
+  Parameters:
+  - weapon (Weapon): The weapon to instrument.
+  - profiler (PerkProfiler): The profiler to count calls and time with (default is None, no profiling).
+  - recorder (TraceRecorder): The recorder to trace events with (default is None, no trace).
+  """
+  # Start from the plain hooks, so the perks are bound to the weapon's current configuration
+  weapon.compile()
+
+  if recorder is not None:
+    recorder.start(weapon)
+
+  hooks = {"shot": [], "reload": [], "reset": []}
+
+  # The weapon's own events are counted and recorded before any perk runs
+  for event, event_hooks in hooks.items():
+    if profiler is not None:
+      event_hooks.append(profiler.count(weapon, event))
+    if recorder is not None:
+      event_hooks.append(recorder.event(weapon, event))
+
+  methods = {"shot": "shot_trigger", "reload": "reload_trigger", "reset": "reset"}
+  for index, perk in enumerate(weapon.perks):
+    for event in perk.events:
+      hook = getattr(perk, methods[event])
+      if profiler is not None:
+        hook = profiler.wrap(perk, event, hook)
+      if recorder is not None:
+        hook = recorder.wrap(weapon, index, perk, event, hook)
+      hooks[event].append(hook)
+
+  weapon.shot_hooks = tuple(hooks["shot"])
+  weapon.reload_hooks = tuple(hooks["reload"])
+  weapon.reset_hooks = tuple(hooks["reset"])
+
+  return weapon
+
+
+class TraceReader():
+  """
+  Reads a trace written by a TraceRecorder, a chunk of records at a time.
+
+  Attributes:
+  - description (dict): The weapon the trace was recorded from, with its magazine size, reserves size, fire rate and
+    perks as [name, enhanced] pairs.
+  """
+  def __init__(self, source, chunk_records: int = 65536):
+    """
+    Initializes a new instance of the TraceReader class and reads the trace's header.
+
+    Parameters:
+    - source: The path of a trace file, or the bytes of a trace kept in memory.
+    - chunk_records (int): The number of records read at a time (default is 65536).
+    """
+    self.stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else open(source, "rb")
+    self.chunk_records = chunk_records
+
+    magic, trace_format, length = HEADER.unpack(self.stream.read(HEADER.size))
+    if magic != MAGIC:
+      raise ValueError("Not a weapon trace.")
+    if trace_format != TRACE_FORMAT:
+      raise ValueError(f"Trace format {trace_format} can't be read, expected format {TRACE_FORMAT}.")
+
+    self.description = json.loads(self.stream.read(length))
+    self._start = self.stream.tell()
+
+  def __iter__(self):
+    """
+    Yields every event in the trace as a TraceEvent, from the start.
+    """
+    for record in self.records():
+      yield TraceEvent._make(record)
+
+  def records(self):
+    """
+    Yields every event in the trace as a plain tuple in the order of TraceEvent's fields, from the start.
+    Faster than iterating over the reader when going through millions of events.
+    """
+    self.stream.seek(self._start)
+    chunk_size = self.chunk_records * RECORD.size
+
+    while True:
+      chunk = self.stream.read(chunk_size)
+      if not chunk:
+        return
+      yield from RECORD.iter_unpack(chunk)
+
+  def perk_name(self, index: int):
+    """
+    Returns the name of the perk at a position on the weapon, with a "+" if it is enhanced.
+    """
+    name, enhanced = self.description["perks"][index]
+    return name + ("+" if enhanced else "")
+
+  def summarize(self):
+    """
+    Returns a dictionary with the number of each kind of event, the rounds refunded by each perk and where they came
+    from, and the rounds loaded by reloads. Reads the trace once without keeping any events.
+    """
+    kinds = [0] * len(KINDS)
+    procs = {}
+    refunds = {}
+    loaded = 0
+    largest_magazine = 0
+
+    for kind, perk, source, shot, before, after, rounds, reserves in self.records():
+      kinds[kind] += 1
+      if after > largest_magazine:
+        largest_magazine = after
+
+      if kind == PROC:
+        procs[perk] = procs.get(perk, 0) + 1
+        refunds[perk, source] = refunds.get((perk, source), 0) + rounds
+      elif kind == RELOAD:
+        loaded += rounds
+
+    summary = {name + "s": count for name, count in zip(KINDS, kinds)}
+    summary["loaded"] = loaded
+    summary["largest_magazine"] = largest_magazine
+    summary["perks"] = {
+      self.perk_name(perk): {"procs": count, "thin_air": refunds.get((perk, THIN_AIR), 0), "reserves": refunds.get((perk, RESERVES), 0)}
+      for perk, count in sorted(procs.items())
+    }
+
+    return summary
+
+  def replay(self, sink: ResultSink = None):
+    """
+    Shows every event in the trace as a line of text on the sink (or the current sink), one at a time.
+    """
+    sink = sink or current_sink()
+    if not sink.verbose:
+      return
+
+    for event in self:
+      if event.kind == SHOT:
+        sink.message(f"Shot {event.shot}: magazine {event.magazine_before} -> {event.magazine_after}")
+      elif event.kind == PROC:
+        sink.message(f"  {self.perk_name(event.perk)} proc: +{event.rounds} from {SOURCES[event.source]}, "
+                     f"magazine {event.magazine_before} -> {event.magazine_after}, reserves {event.reserves}")
+      elif event.kind == RELOAD:
+        sink.message(f"Reload: +{event.rounds} from reserves, magazine {event.magazine_before} -> {event.magazine_after}, reserves {event.reserves}")
+      else:
+        sink.message(f"Resupply: magazine {event.magazine_after}, reserves {event.reserves}")
+
+  def close(self):
+    self.stream.close()
@@ -0,0 +1,262 @@
+"""
+InverseSolver answers the reverse question: the smallest magazine or reserves that fires at least a target number of
+shots, like "what's the smallest magazine that gives 100 shots with TripleTap and FourthTimesTheCharm?".
+
+With TripleTap and FourthTimesTheCharm, adding a round to the magazine or reserves never takes a shot away, and the
+same holds for RewindRounds' reserves, so the shots fired only go up with the size. That lets the solver search
+instead of trying every size: it doubles the size until the target is reached, then bisects between the last two
+sizes, running about 2 * log2(answer) tests. Each test goes through MagazineEngine, so
+TripleTap and FourthTimesTheCharm are worked out in closed form and RewindRounds skips repeated magazines.
+
+That doesn't hold for the magazine of perks that read the weapon or refund from reserves, like RewindRounds. Its
+refunds depend on the magazine size and are capped by the reserves, so the shots can drop by a lot as the magazine
+grows: with 40 reserves, a magazine of 10 fires 50 shots and a magazine of 11 only 28. Bisection can land on a size
+far above the smallest one, so with these perks min_magazine scans every magazine from 1 up instead. Every round in
+the magazine is fired, so a magazine of `target` rounds always reaches the target and the scan runs at most `target`
+tests. Pass `exhaustive=False` to bisect anyway.
+
+Weapons that never run out of ammo fire unlimited shots, so they reach any target. RewindRounds with infinite
+reserves never runs out even with a one round magazine, so rather than presenting 1 as the smallest magazine, the
+solution is marked `any_size` and the report says that every size reaches the target. Pass finite reserves to find
+a real minimum.
+
+  python inverseSolver.py magazine 100 --perks TripleTap FourthTimesTheCharm
+  python inverseSolver.py reserves 500 --magazine 12 --fire-rate 600 --perks RewindRounds+
+"""
+
+import argparse
+import sys
+
+from weaponConfig import WeaponConfig
+from magazineEngine import TESTS, run_test
+from resultSink import SINKS, ResultSink, current_sink
+from headless import parse_perk
+from perks import PERK_TYPES
+
+# The number of shots a weapon that never runs out of ammo fires.
+UNLIMITED = float("inf")
+
+
+class InverseSolver():
+  """
+  A class that holds the methods for finding the smallest magazine or reserves that fire a target number of shots.
+  """
+
+  def shots(config: WeaponConfig, test: str):
+    """
+    Returns the shots fired by a test on a fresh weapon with the configuration, or UNLIMITED if it never runs out.
+
+    Parameters:
+    - config (WeaponConfig): The configuration of the weapon.
+    - test (str): The test to run, "magazine" or "all_ammo".
+    """
+    weapon = config.build()
+    run_test(weapon, test)
+    return UNLIMITED if weapon.shots_fired == -1 else weapon.shots_fired
+
+  def search(shots_at, target: int, low: int, high: int):
+    """
+    Returns the smallest size between `low` and `high` where `shots_at(size)` reaches the target, and the number of
+    sizes tested, assuming the shots only go up with the size. Returns None for the size if even `high` falls short.
+
+    Parameters:
+    - shots_at: A function returning the shots fired at a size.
+    - target (int): The number of shots to reach.
+    - low (int): The smallest size to consider.
+    - high (int): The largest size to consider.
+    """
+    evaluations = 0
+
+    # Double the size until it reaches the target, to find an upper bound close to the answer
+    bound = max(low, 1)
+    while True:
+      evaluations += 1
+      if shots_at(bound) >= target:
+        break
+      if bound >= high:
+        return None, evaluations
+      low = bound + 1
+      bound = min(bound * 2, high)
+
+    # Bisect between the last size that fell short and the bound
+    high = bound
+    while low < high:
+      middle = (low + high) // 2
+      evaluations += 1
+      if shots_at(middle) >= target:
+        high = middle
+      else:
+        low = middle + 1
+
+    return high, evaluations
+
+  def min_magazine(target: int, perks: tuple = (), reserves_size: int = -1, fire_rate: int = 0, test: str = "magazine",
+                   max_magazine: int = 1000000, exhaustive: bool = None):
+    """
+    Returns the solution (see solution) for the smallest magazine size that fires at least `target` shots,
+    or None if no magazine up to `max_magazine` does.
+
+    Parameters:
+    - target (int): The number of shots to reach.
+    - perks (tuple): The perks on the weapon as (perk name, enhanced) pairs.
+    - reserves_size (int): The size of the reserves (default is -1, infinite).
+    - fire_rate (int): The fire rate in rounds per minute (default is 0).
+    - test (str): The test to count shots with, "magazine" or "all_ammo" (default is "magazine").
+    - max_magazine (int): The largest magazine size to consider (default is 1000000).
+    - exhaustive (bool): Whether to scan every magazine from 1 up instead of bisecting. Defaults to None, which scans
+      when a perk reads the weapon or refunds from reserves, since their shots can drop as the magazine grows.
+    """
+    if test not in TESTS:
+      raise ValueError(f"Unknown test '{test}'. Expected one of: {', '.join(TESTS)}")
+
+    if exhaustive is None:
+      perk_types = [PERK_TYPES[name] for name, enhanced in perks]
+      exhaustive = any(perk_type.reads_weapon or perk_type.refunds_from_reserves for perk_type in perk_types)
+
+    def shots_at(magazine_size):
+      return InverseSolver.shots(WeaponConfig(magazine_size, reserves_size, fire_rate, tuple(perks)), test)
+
+    if exhaustive:
+      # Every round in the magazine is fired, so a magazine of `target` rounds is as far as the scan needs to go
+      magazine_size, evaluations = None, 0
+      for size in range(1, min(max(target, 1), max_magazine) + 1):
+        evaluations += 1
+        if shots_at(size) >= target:
+          magazine_size = size
+          break
+    else:
+      magazine_size, evaluations = InverseSolver.search(shots_at, target, 1, max_magazine)
+
+    if magazine_size is None:
+      return None
+
+    config = WeaponConfig(magazine_size, reserves_size, fire_rate, tuple(perks))
+    return InverseSolver.solution(config, test, target, "magazine_size", evaluations)
+
+  def min_reserves(target: int, magazine_size: int, perks: tuple = (), fire_rate: int = 0, max_reserves: int = 10000000):
+    """
+    Returns the solution (see solution) for the smallest reserves that fire at least `target` shots when expending all
+    ammo, or None if no reserves up to `max_reserves` do.
+
+    Parameters:
+    - target (int): The number of shots to reach.
+    - magazine_size (int): The size of the magazine.
+    - perks (tuple): The perks on the weapon as (perk name, enhanced) pairs.
+    - fire_rate (int): The fire rate in rounds per minute (default is 0).
+    - max_reserves (int): The largest reserves to consider (default is 10000000).
+    """
+    def shots_at(reserves_size):
+      return InverseSolver.shots(WeaponConfig(magazine_size, reserves_size, fire_rate, tuple(perks)), "all_ammo")
+
+    # No reserves at all may already be enough
+    if shots_at(0) >= target:
+      reserves_size, evaluations = 0, 1
+    else:
+      reserves_size, evaluations = InverseSolver.search(shots_at, target, 1, max_reserves)
+      evaluations += 1
+      if reserves_size is None:
+        return None
+
+    config = WeaponConfig(magazine_size, reserves_size, fire_rate, tuple(perks))
+    return InverseSolver.solution(config, "all_ammo", target, "reserves_size", evaluations)
+
+  def solution(config: WeaponConfig, test: str, target: int, solved_for: str, evaluations: int):
+    """
+    Returns a dictionary describing a solution: the field solved for, the target, the matching configuration, the
+    test, the number of tests run to find it, and the state and snapshot of a weapon with the configuration after the
+    test. The test runs once here and report() restores the snapshot instead of running it again.
+
+    When the weapon never runs out of ammo at the smallest size considered (a magazine of 1 or no reserves), every
+    size reaches the target, so `any_size` is True and the size in the configuration is not a minimum.
+    """
+    weapon = config.build()
+    run_test(weapon, test)
+    never_empties = weapon.shots_fired == -1
+
+    # Sizes only add shots, so a weapon that never empties at the smallest size never empties at any size
+    smallest = 1 if solved_for == "magazine_size" else 0
+
+    return {
+      "solved_for": solved_for,
+      "target": target,
+      "config": config._asdict(),
+      "test": test,
+      "evaluations": evaluations,
+      "never_empties": never_empties,
+      "any_size": never_empties and getattr(config, solved_for) == smallest,
+      "state": weapon.state(),
+      "snapshot": list(weapon.snapshot()),
+    }
+
+  def report(solution: dict, sink: ResultSink = None):
+    """
+    Shows a solution on the sink (or the current sink), with the same breakdown as Weapon.report(), and returns it.
+
+    Parameters:
+    - solution (dict): The solution from min_magazine or min_reserves, or None if there wasn't one.
+    - sink (ResultSink): The sink to show the solution on (default is the current sink).
+    """
+    sink = sink or current_sink()
+
+    if solution is None:
+      sink.message("No configuration in the searched range reaches the target.")
+      sink.result({"solution": None})
+      return None
+
+    config = WeaponConfig(**solution["config"])
+    label = "magazine size" if solution["solved_for"] == "magazine_size" else "reserves"
+    if solution["any_size"]:
+      sink.message(f"\nAny {label} fires at least {solution['target']} shots: this weapon never runs out of ammo.")
+      if solution["solved_for"] == "magazine_size" and config.reserves_size < 0:
+        sink.message("Pass finite reserves (--reserves) to find the smallest magazine size.")
+    else:
+      sink.message(f"\nSmallest {label} for at least {solution['target']} shots: {solution['config'][solution['solved_for']]}")
+    sink.message(f"Found after {solution['evaluations']} tests.\n")
+
+    if solution["never_empties"]:
+      sink.message("This weapon never runs out of ammo.")
+    else:
+      # Restore the tested state on a fresh weapon so the breakdown comes from the weapon's own report
+      weapon = config.build()
+      weapon.restore(tuple(solution["snapshot"]))
+      weapon.report(sink)
+
+    sink.result(solution)
+    return solution
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Find the smallest magazine or reserves that fire a target number of shots.")
+  parser.add_argument("solve_for", choices=("magazine", "reserves"), help="what to find the smallest size of")
+  parser.add_argument("target", type=int, help="number of shots to reach")
+  parser.add_argument("--perks", nargs="*", default=[], help="perk names, with a '+' after enhanced perks")
+  parser.add_argument("--magazine", type=int, help="magazine size (required when solving for reserves)")
+  parser.add_argument("--reserves", type=int, default=-1, help="reserves size when solving for the magazine (default is -1, infinite)")
+  parser.add_argument("--fire-rate", type=int, default=0, help="fire rate in rounds per minute (default is 0)")
+  parser.add_argument("--test", choices=TESTS, default="magazine", help="test to count shots with when solving for the magazine")
+  parser.add_argument("--exhaustive", action=argparse.BooleanOptionalAction, default=None,
+                      help="scan every magazine instead of bisecting (default is to scan only for perks that read the weapon or refund from reserves)")
+  parser.add_argument("--sink", choices=list(SINKS), default="text", help="how to write the solution (default is text)")
+  args = parser.parse_args(argv)
+
+  try:
+    perks = tuple(parse_perk(perk) for perk in args.perks)
+  except ValueError as error:
+    parser.error(str(error))
+
+  if args.solve_for == "magazine":
+    solution = InverseSolver.min_magazine(args.target, perks, args.reserves, args.fire_rate, args.test, exhaustive=args.exhaustive)
+  else:
+    if args.magazine is None:
+      parser.error("--magazine is required when solving for reserves")
+    solution = InverseSolver.min_reserves(args.target, args.magazine, perks, args.fire_rate)
+
+  sink = SINKS[args.sink]()
+  InverseSolver.report(solution, sink)
+  sink.close()
+
+  return 0 if solution is not None else 1
+
+
+if __name__ == '__main__':
+  sys.exit(main())
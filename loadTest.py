@@ -0,0 +1,178 @@
+"""
+Load tests the calculator service (see calculatorService.py) with concurrent clients on localhost.
+
+Each client keeps one connection open and sends requests one after another, picking a random weapon from a pool of
+`--distinct` configurations each time. A small pool means many identical requests, which shows off the response cache
+and request coalescing, a large pool means most requests have to be simulated.
+
+By default the service is started in a subprocess on a free port and stopped afterwards, pass --port to test a service
+that is already running.
+
+  python loadTest.py --clients 32 --requests 50 --distinct 100
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+
+PERK_CHOICES = ("TripleTap", "TripleTap+", "FourthTimesTheCharm", "FourthTimesTheCharm+", "RewindRounds", "RewindRounds+", "Perk")
+
+
+def random_weapons(count: int, seed: int = 0):
+  """
+  Returns a list of random weapon requests for the service.
+
+  Parameters:
+  - count (int): The number of weapons.
+  - seed (int): The seed for the random weapons (default is 0).
+  """
+  rng = random.Random(seed)
+  weapons = []
+
+  for index in range(count):
+    perks = [rng.choice(PERK_CHOICES), rng.choice(PERK_CHOICES)]
+    # Weapons that never empty are answered instantly with an error, so leave them out of the pool
+    if perks[0].rstrip("+") == perks[1].rstrip("+") == "FourthTimesTheCharm":
+      perks[1] = "Perk"
+
+    weapons.append({
+      "magazine_size": rng.randint(1, 300),
+      "reserves_size": rng.choice((-1, rng.randint(0, 10000))),
+      "fire_rate": rng.choice((0, 300, 600, 900)),
+      "perks": perks,
+    })
+
+  return weapons
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, method: str, path: str, body: dict = None):
+  """
+  Sends a request on an open connection and returns the status and decoded JSON response.
+  """
+  payload = json.dumps(body).encode() if body is not None else b""
+  writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+               f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload)
+  await writer.drain()
+
+  status = int((await reader.readline()).split()[1])
+  length = 0
+  while True:
+    line = await reader.readline()
+    if line in (b"\r\n", b"\n", b""):
+      break
+    name, _, value = line.decode("latin-1").partition(":")
+    if name.strip().lower() == "content-length":
+      length = int(value)
+
+  return status, json.loads(await reader.readexactly(length))
+
+
+async def client(host: str, port: int, weapons: list, requests: int, seed: int, latencies: list, errors: list):
+  """
+  Sends `requests` requests for random weapons over one connection, recording the latency of each.
+  """
+  rng = random.Random(seed)
+  reader, writer = await asyncio.open_connection(host, port)
+
+  try:
+    for index in range(requests):
+      path = rng.choice(("/mag", "/all-ammo"))
+      start = time.perf_counter()
+      status, response = await request(reader, writer, "POST", path, rng.choice(weapons))
+      latencies.append(time.perf_counter() - start)
+      if status != 200:
+        errors.append(response.get("error"))
+  finally:
+    writer.close()
+
+
+def percentile(values: list, percent: float):
+  """
+  Returns the value that `percent` percent of the sorted values are less than or equal to.
+  """
+  values = sorted(values)
+  return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+
+async def run(host: str, port: int, clients: int, requests: int, distinct: int, seed: int = 0):
+  """
+  Runs the load test and returns a dictionary with the latencies and the service's counters.
+  """
+  weapons = random_weapons(distinct, seed)
+  latencies = []
+  errors = []
+
+  start = time.perf_counter()
+  await asyncio.gather(*(client(host, port, weapons, requests, seed + index + 1, latencies, errors) for index in range(clients)))
+  wall = time.perf_counter() - start
+
+  reader, writer = await asyncio.open_connection(host, port)
+  status, health = await request(reader, writer, "GET", "/health")
+  writer.close()
+
+  return {
+    "requests": len(latencies),
+    "errors": len(errors),
+    "wall": wall,
+    "requests_per_sec": len(latencies) / wall,
+    "p50_ms": percentile(latencies, 50) * 1000,
+    "p99_ms": percentile(latencies, 99) * 1000,
+    "max_ms": max(latencies) * 1000,
+    "service": health,
+  }
+
+
+def start_service(workers: int):
+  """
+  Starts the service in a subprocess on a free port and returns the process and the port.
+  """
+  script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calculatorService.py")
+  process = subprocess.Popen([sys.executable, script, "--port", "0", "--workers", str(workers)],
+                             stdout=subprocess.PIPE, text=True)
+  line = process.stdout.readline()
+  if not line.startswith("Listening on "):
+    process.kill()
+    raise RuntimeError("The service didn't start.")
+
+  return process, int(line.rsplit(":", 1)[1])
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Load test the calculator service on localhost.")
+  parser.add_argument("--clients", type=int, default=16, help="concurrent clients (default is 16)")
+  parser.add_argument("--requests", type=int, default=50, help="requests per client (default is 50)")
+  parser.add_argument("--distinct", type=int, default=100, help="distinct weapons requested (default is 100)")
+  parser.add_argument("--workers", type=int, default=2, help="worker processes for a service started here (default is 2)")
+  parser.add_argument("--port", type=int, help="port of a service that is already running (default is to start one)")
+  parser.add_argument("--seed", type=int, default=0, help="seed for the random requests (default is 0)")
+  args = parser.parse_args(argv)
+
+  process = None
+  port = args.port
+  if port is None:
+    process, port = start_service(args.workers)
+
+  try:
+    result = asyncio.run(run("127.0.0.1", port, args.clients, args.requests, args.distinct, args.seed))
+  finally:
+    if process is not None:
+      process.terminate()
+      process.wait()
+
+  print(f"{result['requests']} requests from {args.clients} clients in {result['wall']:.2f} s "
+        f"({result['requests_per_sec']:,.0f} requests/sec), {result['errors']} errors")
+  print(f"Latency p50: {result['p50_ms']:.2f} ms | p99: {result['p99_ms']:.2f} ms | max: {result['max_ms']:.2f} ms")
+  service = result["service"]
+  print(f"Service: {service['simulations']} simulations, {service['coalesced']} coalesced, {service['cache_hits']} cache hits")
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,364 @@
+"""
+LoadoutOptimizer finds the best rolls of a weapon archetype: the perks (including enhanced versions) and magazine and
+reserves sizes that fire the most shots from a magazine, from all ammo, or during a damage phase.
+
+The search is a branch and bound over every combination of perks (the branches) and every magazine and reserves size
+under each (the candidates). Before anything is simulated, each candidate gets an upper bound on the shots it can fire,
+worked out from the most rounds its perks can refund per shot:
+- A fixed-ratio perk refunds at most `refund_amount / trigger_count` rounds per shot from thin air (a).
+- RewindRounds refunds at most its percentage of the hits since its last proc, rounded up, and needs at least its
+  activation threshold of hits per proc, so at most `percentage + 1 / threshold` rounds per shot (b). Every round it
+  refunds comes out of reserves.
+A magazine runs dry once the shots fired equal the rounds it started with plus the rounds refunded, so it fires at most
+`magazine / (1 - a - b)` shots, and never more than `(magazine + reserves) / (1 - a)` with finite reserves. Expending all
+ammo fires at most `(magazine + reserves) / (1 - a)` shots, and a damage phase can't fire more than its fire rate allows
+in its length. Perks whose refunds can't be bounded (or add up to a round per shot) get no bound, so they are always
+simulated.
+
+Candidates are simulated best bound first, in batches spread over a pool of worker processes. After each batch the K-th
+best score so far is the bar: a candidate whose bound can't beat it is never simulated, and since the bounds only go down
+from there, the search stops at the first one. Rolls that can't give different results (the same perks in another
+order, or an enhanced flag that doesn't change the ammo) are only simulated once, and the first of them is listed.
+
+Ties are broken by the order of the candidates, so the result is the same as simulating every roll and sorting them.
+
+  python loadoutOptimizer.py --magazines 10-60 --reserves 60 120 --objective all_ammo --top 5
+"""
+
+import argparse
+import heapq
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+from weaponConfig import WeaponConfig
+from magazineEngine import run_test
+from dpsPhase import DpsPhase
+from perk import Perk
+from perks import PERK_TYPES
+from resultCache import canonical_key
+from resultSink import SINKS, ResultSink, current_sink, use_sink
+
+OBJECTIVES = ("magazine", "all_ammo", "dps_window")
+
+# The score of a weapon that never runs out of ammo.
+UNLIMITED = float("inf")
+
+
+def max_refund_rate(perk):
+  """
+  Returns the most rounds the perk can refund per shot fired, and whether they come from reserves.
+  Returns None for the rate if the perk's refunds can't be bounded.
+
+  Parameters:
+  - perk (Perk): A perk bound to a weapon (see Perk.bind).
+  """
+  if perk.__class__ is Perk:
+    return 0, False
+
+  # Fixed-ratio refund perks, like TripleTap and FourthTimesTheCharm
+  if getattr(perk, "trigger_count", None) is not None:
+    return perk.refund_amount / perk.trigger_count, False
+
+  # Perks compiled from a spec (see perkSpec.py) describe their refunds, RewindRounds is one of them by hand
+  spec = getattr(perk, "spec", None)
+  fixed = spec.refund_amount if spec is not None else 0
+  percentage = getattr(perk, "percentage_refund", None)
+  if percentage is None:
+    return None, False
+
+  if spec is not None and spec.trigger == "every":
+    rate = (fixed + math.ceil(percentage * spec.trigger_count)) / spec.trigger_count
+  elif hasattr(perk, "activation_threshold"):
+    # Rounding up adds at most one round per proc
+    rate = percentage + (fixed + 1) / perk.activation_threshold
+  else:
+    return None, False
+
+  return rate, perk.refunds_from_reserves
+
+
+def upper_bound(config: WeaponConfig, objective: str, duration: float = 0):
+  """
+  Returns an upper bound on the score of a configuration, UNLIMITED if it can't be bounded.
+
+  Parameters:
+  - config (WeaponConfig): The configuration of the weapon.
+  - objective (str): "magazine", "all_ammo" or "dps_window".
+  - duration (float): The length of the damage phase in seconds, for "dps_window".
+  """
+  weapon = config.build()
+  thin_air = 0
+  from_reserves = 0
+
+  for perk in weapon.perks:
+    rate, reserves = max_refund_rate(perk)
+    if rate is None:
+      return UNLIMITED
+    if reserves:
+      from_reserves += rate
+    else:
+      thin_air += rate
+
+  # Rounds from reserves can't add up to more than the reserves, which limits every objective with finite reserves
+  bound = UNLIMITED
+  if config.reserves_size != -1 and thin_air < 1:
+    bound = (config.magazine_size + config.reserves_size) / (1 - thin_air)
+
+  if objective == "magazine" and thin_air + from_reserves < 1:
+    bound = min(bound, config.magazine_size / (1 - thin_air - from_reserves))
+  elif objective == "dps_window":
+    # Shots are fired at the fire rate from time 0, so no more fit in the phase than this
+    bound = min(bound, math.floor(duration * config.fire_rate / 60) + 1)
+
+  return bound
+
+
+def evaluate(config: WeaponConfig, objective: str, duration: float = 0, reload_time: float = 0):
+  """
+  Returns the score of a configuration: the shots fired by the test, or UNLIMITED if it never runs out of ammo.
+
+  Parameters:
+  - config (WeaponConfig): The configuration of the weapon.
+  - objective (str): "magazine", "all_ammo" or "dps_window".
+  - duration (float): The length of the damage phase in seconds, for "dps_window".
+  - reload_time (float): The time a reload takes in seconds, for "dps_window".
+  """
+  weapon = config.build()
+
+  if objective == "dps_window":
+    with use_sink(ResultSink()):
+      return DpsPhase.run(weapon, duration, reload_time)["shots_fired"]
+
+  run_test(weapon, objective)
+  return UNLIMITED if weapon.shots_fired == -1 else weapon.shots_fired
+
+
+def evaluate_batch(configs: list, objective: str, duration: float = 0, reload_time: float = 0):
+  """
+  Returns the score of every configuration in a batch. This is the function run by the workers.
+  """
+  return [evaluate(config, objective, duration, reload_time) for config in configs]
+
+
+class LoadoutOptimizer():
+  """
+  A class that holds the methods for searching the rolls of a weapon for the ones that fire the most shots.
+  """
+
+  def candidates(magazine_sizes, reserves_sizes, fire_rate: int = 0, perk_pool=None, slots: int = 2, enhanced: bool = True):
+    """
+    Returns the branches of the search: a list of (perks, configurations) pairs, with every magazine and reserves size
+    for each combination of different perks.
+
+    Parameters:
+    - magazine_sizes (iterable): The magazine sizes the weapon can roll with.
+    - reserves_sizes (iterable): The reserves sizes the weapon can roll with (-1 for infinite reserves).
+    - fire_rate (int): The fire rate of the weapon in rounds per minute (default is 0).
+    - perk_pool (iterable): The names of the perks the weapon can roll with (default is every perk in PERK_TYPES).
+    - slots (int): The number of perks on the weapon (default is 2).
+    - enhanced (bool): Whether to include the enhanced version of each perk as well (default is True).
+    """
+    perk_pool = list(PERK_TYPES) if perk_pool is None else list(perk_pool)
+    options = list(product(perk_pool, (False, True) if enhanced else (False,)))
+    sizes = list(product(magazine_sizes, reserves_sizes))
+
+    # A weapon can't roll the same perk twice, only the placeholder for no perk can repeat
+    combos = [perks for perks in product(options, repeat=slots)
+              if len({name for name, enhanced in perks if name != "Perk"}) == len([name for name, enhanced in perks if name != "Perk"])]
+
+    return [(perks, [WeaponConfig(magazine_size, reserves_size, fire_rate, perks) for magazine_size, reserves_size in sizes])
+            for perks in combos]
+
+  def search(magazine_sizes, reserves_sizes, fire_rate: int = 0, objective: str = "magazine", top: int = 10,
+             perk_pool=None, slots: int = 2, enhanced: bool = True, duration: float = 30, reload_time: float = 2,
+             workers: int = None, batch_size: int = 64):
+    """
+    Returns a dictionary with the `top` best rolls in order (see solution), and how many candidates were considered,
+    simulated and pruned.
+
+    Parameters:
+    - magazine_sizes (iterable): The magazine sizes the weapon can roll with.
+    - reserves_sizes (iterable): The reserves sizes the weapon can roll with (-1 for infinite reserves).
+    - fire_rate (int): The fire rate of the weapon in rounds per minute (default is 0).
+    - objective (str): What to maximize, "magazine", "all_ammo" or "dps_window" (default is "magazine").
+    - top (int): The number of rolls to return (default is 10).
+    - perk_pool (iterable): The names of the perks the weapon can roll with (default is every perk in PERK_TYPES).
+    - slots (int): The number of perks on the weapon (default is 2).
+    - enhanced (bool): Whether to include the enhanced version of each perk as well (default is True).
+    - duration (float): The length of the damage phase in seconds, for "dps_window" (default is 30).
+    - reload_time (float): The time a reload takes in seconds, for "dps_window" (default is 2).
+    - workers (int): The number of worker processes, 1 to search in this process (default is one per CPU).
+    - batch_size (int): The number of candidates sent to a worker at a time (default is 64).
+    """
+    if objective not in OBJECTIVES:
+      raise ValueError(f"Unknown objective '{objective}'. Expected one of: {', '.join(OBJECTIVES)}")
+    if objective == "all_ammo" and -1 in reserves_sizes:
+      raise ValueError("A weapon with infinite reserves never runs out of ammo, expending all ammo needs finite reserves.")
+    if objective == "dps_window" and fire_rate <= 0:
+      raise ValueError("The dps_window objective needs a fire rate above 0.")
+    if min(magazine_sizes, default=1) < 1:
+      raise ValueError("Magazine sizes must be at least 1.")
+
+    # Bound every distinct roll, then search them best bound first
+    queue = []
+    seen = set()
+    count = 0
+    for perks, configs in LoadoutOptimizer.candidates(magazine_sizes, reserves_sizes, fire_rate, perk_pool, slots, enhanced):
+      for index, config in enumerate(configs, start=count):
+        # Rolls that can't give different results are only simulated once
+        if objective != "dps_window":
+          key = canonical_key(config, objective)
+          if key in seen:
+            continue
+          seen.add(key)
+        queue.append((upper_bound(config, objective, duration), index, config))
+      count += len(configs)
+    queue.sort(key=lambda candidate: (-candidate[0], candidate[1]))
+
+    # The best scores so far, as a heap of (score, -index, config) with the K-th best at the top
+    best = []
+    evaluated = 0
+
+    def can_win(bound, index):
+      if len(best) < top:
+        return True
+      score, negative_index, config = best[0]
+      return bound > score or (bound == score and index < -negative_index)
+
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    try:
+      position = 0
+      while position < len(queue):
+        # Take the next candidates that can still make the top K, a batch per worker
+        batches = []
+        while position < len(queue) and len(batches) < workers:
+          batch = []
+          while position < len(queue) and len(batch) < batch_size:
+            bound, index, config = queue[position]
+            # Bounds only go down from here, so once one can't beat the K-th best score, nothing after it can either
+            if len(best) == top and bound < best[0][0]:
+              position = len(queue)
+              break
+            position += 1
+            if can_win(bound, index):
+              batch.append(queue[position - 1])
+          if batch:
+            batches.append(batch)
+
+        if pool is None:
+          results = [evaluate_batch([config for _, _, config in batch], objective, duration, reload_time) for batch in batches]
+        else:
+          futures = [pool.submit(evaluate_batch, [config for _, _, config in batch], objective, duration, reload_time)
+                     for batch in batches]
+          results = [future.result() for future in futures]
+
+        for batch, scores in zip(batches, results):
+          evaluated += len(batch)
+          for (bound, index, config), score in zip(batch, scores):
+            entry = (score, -index, config)
+            if len(best) < top:
+              heapq.heappush(best, entry)
+            elif entry[:2] > best[0][:2]:
+              heapq.heapreplace(best, entry)
+    finally:
+      if pool is not None:
+        pool.shutdown()
+
+    ranked = sorted(best, key=lambda entry: (-entry[0], -entry[1]))
+    return {
+      "objective": objective,
+      "candidates": count,
+      "distinct": len(queue),
+      "evaluated": evaluated,
+      "pruned": len(queue) - evaluated,
+      "results": [LoadoutOptimizer.solution(rank, config, score) for rank, (score, _, config) in enumerate(ranked, start=1)],
+    }
+
+  def solution(rank: int, config: WeaponConfig, score: float):
+    """
+    Returns a dictionary describing a ranked roll. Weapons that never run out of ammo are listed with -1 shots.
+    """
+    return {
+      "rank": rank,
+      "shots": -1 if score == UNLIMITED else score,
+      "config": config._asdict(),
+    }
+
+  def report(result: dict, sink: ResultSink = None):
+    """
+    Shows the ranked rolls on the sink (or the current sink), sends each as a result, and returns the search result.
+    """
+    sink = sink or current_sink()
+
+    if sink.verbose:
+      sink.message(f"\nBest rolls for {result['objective']}: {result['evaluated']} of {result['distinct']} distinct rolls "
+                   f"simulated, {result['pruned']} pruned ({result['candidates']} candidates)\n")
+      for solution in result["results"]:
+        config = solution["config"]
+        perks = " + ".join(name + ("+" if enhanced else "") for name, enhanced in config["perks"]) or "No perks"
+        shots = "never runs out" if solution["shots"] == -1 else f"{solution['shots']} shots"
+        reserves = "infinite" if config["reserves_size"] == -1 else config["reserves_size"]
+        sink.message(f"{solution['rank']:>3}. {shots} | Magazine: {config['magazine_size']} | Reserves: {reserves} | {perks}")
+
+    for solution in result["results"]:
+      sink.result(solution)
+
+    return result
+
+
+def parse_sizes(values):
+  """
+  Returns the sizes in a list of command line values, each a size (-1 for infinite reserves) or an inclusive range
+  like "10-60".
+  """
+  sizes = []
+  for value in values:
+    low, separator, high = value.partition("-")
+    if separator and low:
+      sizes.extend(range(int(low), int(high) + 1))
+    else:
+      sizes.append(int(value))
+  return sizes
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Find the best perk and magazine rolls for a weapon.")
+  parser.add_argument("--magazines", nargs="+", required=True, help="magazine sizes, or ranges like 10-60")
+  parser.add_argument("--reserves", nargs="+", default=["-1"], help="reserves sizes, or ranges (default is -1, infinite)")
+  parser.add_argument("--fire-rate", type=int, default=0, help="fire rate in rounds per minute (default is 0)")
+  parser.add_argument("--objective", choices=OBJECTIVES, default="magazine", help="what to maximize (default is magazine)")
+  parser.add_argument("--top", type=int, default=10, help="number of rolls to list (default is 10)")
+  parser.add_argument("--perks", nargs="+", help="perk pool (default is every perk)")
+  parser.add_argument("--slots", type=int, default=2, help="perks on the weapon (default is 2)")
+  parser.add_argument("--no-enhanced", action="store_true", help="leave out enhanced perks")
+  parser.add_argument("--duration", type=float, default=30, help="damage phase length in seconds (default is 30)")
+  parser.add_argument("--reload-time", type=float, default=2, help="reload time in seconds (default is 2)")
+  parser.add_argument("--workers", type=int, help="worker processes (default is one per CPU)")
+  parser.add_argument("--sink", choices=list(SINKS), default="text", help="how to write the rolls (default is text)")
+  args = parser.parse_args(argv)
+
+  for name in args.perks or ():
+    if name not in PERK_TYPES:
+      parser.error(f"unknown perk '{name}', expected one of: {', '.join(PERK_TYPES)}")
+
+  try:
+    result = LoadoutOptimizer.search(parse_sizes(args.magazines), parse_sizes(args.reserves), args.fire_rate, args.objective, args.top,
+                                     args.perks, args.slots, not args.no_enhanced, args.duration, args.reload_time,
+                                     args.workers)
+  except ValueError as error:
+    parser.error(str(error))
+
+  sink = SINKS[args.sink]()
+  LoadoutOptimizer.report(result, sink)
+  sink.close()
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+LookupTable answers the magazine and all ammo tests from a precomputed table instead of simulating them.
+
+The menu in main.py only allows magazines up to 300 rounds and two perks, which makes the space small once it is
+reduced to what can change the results. For TripleTap and FourthTimesTheCharm (and no perk):
+- Neither the enhanced flag nor the fire rate changes the rounds they refund, and neither does their order.
+- Their counters only depend on the number of shots fired, so a fresh weapon's perks end with `shots // trigger_count`
+  procs and a counter of `shots % trigger_count`.
+- Expending all ammo is the same as emptying one magazine holding the magazine plus the reserves (see MagazineEngine),
+  with `ceil(reserves / magazine_size)` reloads.
+So the shots fired by emptying a pool of rounds is all the table needs to store, for each pair of these perks and each
+pool size up to the largest magazine plus the largest reserves. With the default ranges (300 rounds, 10000 reserves)
+that is 6 pairs of 10301 integers.
+
+RewindRounds isn't in the table. Its refunds depend on the reserves left and on the fire rate, so it would need an
+entry for every magazine, reserves and fire rate (hundreds of millions of entries per test). Weapons with it, weapons
+outside the table's ranges, and weapons that aren't freshly resupplied go to the live simulator.
+
+The table is a file of packed little-endian 32 bit integers after a header (the magic bytes, the format, and the length
+of a JSON description of the ranges, pairs and perk versions). It is opened with `mmap`, so only the pages that are
+looked up are ever read, and each lookup is one `struct.unpack_from` at a computed offset. A table built with other
+perk versions is refused, since its results may be out of date.
+
+  python lookupTable.py build
+"""
+
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from itertools import combinations_with_replacement
+
+from weapon import Weapon
+from magazineEngine import MagazineEngine
+from perks import PERK_TYPES
+from resultCache import perk_versions
+
+# Bump this whenever the layout of the table changes.
+TABLE_FORMAT = 1
+MAGIC = b"D2LT"
+HEADER = struct.Struct("<4sHI")
+ENTRY = struct.Struct("<i")
+
+# The shots stored for a pool of rounds the perks never let run out.
+NEVER_EMPTIES = -1
+
+# The table main.py opens at startup, next to this file.
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lookupTable.bin")
+
+
+def table_perks():
+  """
+  Returns the names of the fixed-ratio refund perks that can go in the table, sorted.
+  """
+  return sorted(name for name, perk_type in PERK_TYPES.items() if getattr(perk_type, "trigger_count", None) is not None)
+
+
+def combo_key(perks):
+  """
+  Returns the key of a combination of perks in the table, or None if a perk can't go in the table.
+  Placeholder perks are left out and the rest are sorted, since their order can't change the results.
+
+  Parameters:
+  - perks (iterable): The perks' class names.
+  """
+  allowed = table_perks()
+  names = []
+
+  for name in perks:
+    if name == "Perk":
+      continue
+    if name not in allowed:
+      return None
+    names.append(name)
+
+  return tuple(sorted(names))
+
+
+def build(path: str = DEFAULT_PATH, max_magazine: int = 300, max_reserves: int = 10000, perks_per_weapon: int = 2):
+  """
+  Precomputes the table and writes it to a file. Returns the number of entries written.
+
+  Parameters:
+  - path (str): The file to write the table to (default is lookupTable.bin next to this file).
+  - max_magazine (int): The largest magazine size in the table (default is 300).
+  - max_reserves (int): The largest reserves in the table (default is 10000).
+  - perks_per_weapon (int): The number of perks on a weapon (default is 2).
+  """
+  max_pool = max_magazine + max_reserves
+  combos = set()
+  for size in range(perks_per_weapon + 1):
+    for names in combinations_with_replacement(table_perks(), size):
+      combos.add(combo_key(names))
+  combos = sorted(combos)
+
+  description = json.dumps({
+    "versions": perk_versions(table_perks()),
+    "max_magazine": max_magazine,
+    "max_reserves": max_reserves,
+    "combos": [list(combo) for combo in combos],
+  }).encode()
+
+  entries = 0
+  with open(path, "wb") as file:
+    file.write(HEADER.pack(MAGIC, TABLE_FORMAT, len(description)) + description)
+
+    for combo in combos:
+      perks = [PERK_TYPES[name]() for name in combo]
+      values = [0]
+
+      for pool in range(1, max_pool + 1):
+        try:
+          values.append(MagazineEngine.shots_until_empty(pool, perks))
+        except ValueError:
+          values.append(NEVER_EMPTIES)
+
+      file.write(struct.pack(f"<{len(values)}i", *values))
+      entries += len(values)
+
+  return entries
+
+
+class LookupTable():
+  """
+  A precomputed table of results, opened with mmap.
+
+  Attributes:
+  - max_magazine (int): The largest magazine size in the table.
+  - max_reserves (int): The largest reserves in the table.
+  - combos (dict): The position of each combination of perks in the table, by combo_key.
+  - hits (int): The number of tests answered from the table.
+  - misses (int): The number of tests left to the live simulator.
+  """
+  def __init__(self, path: str = DEFAULT_PATH):
+    """
+    Opens a table. Raises a ValueError if the file isn't a table, or was built with other perk versions.
+
+    Parameters:
+    - path (str): The file the table was built to (default is lookupTable.bin next to this file).
+    """
+    with open(path, "rb") as file:
+      self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, table_format, length = HEADER.unpack_from(self.map, 0)
+    if magic != MAGIC or table_format != TABLE_FORMAT:
+      self.map.close()
+      raise ValueError(f"{path} is not a lookup table in format {TABLE_FORMAT}. Rebuild it with `python lookupTable.py build`.")
+
+    # Only the perks the table was built with matter, registering another perk leaves it valid
+    description = json.loads(self.map[HEADER.size:HEADER.size + length])
+    built_with = json.loads(description["versions"])[1]
+    if description["versions"] != perk_versions(built_with):
+      self.map.close()
+      raise ValueError(f"{path} was built with other perk versions. Rebuild it with `python lookupTable.py build`.")
+
+    self.max_magazine = description["max_magazine"]
+    self.max_reserves = description["max_reserves"]
+    self.combos = {tuple(combo): index for index, combo in enumerate(description["combos"])}
+    self.hits = 0
+    self.misses = 0
+    self._start = HEADER.size + length
+    self._row = self.max_magazine + self.max_reserves + 1
+
+  def open(path: str = DEFAULT_PATH):
+    """
+    Returns the table at the path, or None if there is no table there or it is out of date.
+    """
+    try:
+      return LookupTable(path)
+    except (OSError, ValueError):
+      return None
+
+  def shots(self, combo: int, pool: int):
+    """
+    Returns the shots stored for emptying a pool of rounds with a combination of perks.
+
+    Parameters:
+    - combo (int): The position of the combination of perks in the table.
+    - pool (int): The number of rounds in the pool.
+    """
+    return ENTRY.unpack_from(self.map, self._start + (combo * self._row + pool) * ENTRY.size)[0]
+
+  def _entry(self, weapon: Weapon, all_ammo: bool):
+    """
+    Returns the position of the weapon's perks in the table, or None if the table can't answer for the weapon.
+    """
+    if weapon.magazine_size < 1 or weapon.magazine_size > self.max_magazine:
+      return None
+    if all_ammo and (weapon.reserves_size < 0 or weapon.reserves_size > self.max_reserves):
+      return None
+
+    # Only a freshly resupplied weapon starts from the state the table was built from
+    if weapon.magazine != weapon.magazine_size or weapon.reserves != weapon.reserves_size or weapon.shots_fired != 0 or weapon.reloads != 0:
+      return None
+
+    for perk in weapon.perks:
+      for field in perk.counter_fields + perk.total_fields:
+        if getattr(perk, field) != 0:
+          return None
+
+    return self.combos.get(combo_key(perk.__class__.__name__ for perk in weapon.perks))
+
+  def _apply(self, weapon: Weapon, shots: int):
+    """
+    Puts the weapon and its perks in their state after firing `shots` rounds. Raises a ValueError if they never run out.
+    """
+    if shots == NEVER_EMPTIES:
+      raise ValueError("The perks on this weapon refund rounds at least as fast as they are used, the magazine never empties.")
+
+    MagazineEngine.apply_shots(weapon, MagazineEngine.closed_form_perks(weapon), shots)
+    weapon.magazine = 0
+
+  def fire_magazine(self, weapon: Weapon):
+    """
+    Empties the weapon's magazine from the table, the same as MagazineEngine.fire_magazine.
+    Returns the number of shots fired, or None without touching the weapon if the table can't answer for it.
+    """
+    combo = self._entry(weapon, False)
+    if combo is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    shots = self.shots(combo, weapon.magazine_size)
+    self._apply(weapon, shots)
+
+    return shots
+
+  def expend_all(self, weapon: Weapon):
+    """
+    Expends all of the weapon's ammo from the table, the same as MagazineEngine.expend_all.
+    Returns the number of shots fired, or None without touching the weapon if the table can't answer for it.
+    """
+    combo = self._entry(weapon, True)
+    if combo is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    shots = self.shots(combo, weapon.magazine_size + weapon.reserves_size)
+    reloads = math.ceil(weapon.reserves_size / weapon.magazine_size)
+    self._apply(weapon, shots)
+    weapon.reserves = 0
+    weapon.reloads = reloads
+
+    return shots
+
+  def close(self):
+    self.map.close()
+
+
+if __name__ == '__main__':
+  if sys.argv[1:] != ["build"]:
+    print("Usage: python lookupTable.py build")
+    sys.exit(1)
+
+  entries = build()
+  print(f"Wrote {entries} entries ({os.path.getsize(DEFAULT_PATH):,} bytes) to {DEFAULT_PATH}")
@@ -0,0 +1,342 @@
+"""
+MagazineEngine computes the result of emptying a weapon without firing it round by round.
+
+Perks like TripleTap and FourthTimesTheCharm are fixed-ratio refund perks: every `trigger_count` hits they refund
+`refund_amount` rounds from thin air. Their counters only ever depend on the number of shots fired, so after s shots
+a perk with counter c has refunded:
+
+  refund_amount * floor((c + s) / trigger_count)
+
+and the magazine holds `magazine - s + refunds(s)`. Because a shot can only ever lower the magazine by one, the first
+s where that value reaches 0 is exactly the number of shots the simulator would fire.
+
+The refunds repeat every L = lcm(trigger counts) shots, adding the same G rounds each period, so every period drains
+D = L - G rounds from the magazine. For each offset r inside the first period the magazine is empty after
+ceil(level(r) / D) whole periods, which gives the answer after checking L offsets (12 for TripleTap + FourthTimesTheCharm)
+no matter how large the magazine is. If D <= 0 the weapon never empties unless it does so inside the first period.
+
+Thin air refunds never touch reserves, and reloads only ever happen on an empty magazine, so expending all ammo is the
+same as emptying a single magazine holding the magazine plus the reserves. The number of reloads only depends on how
+many times a full magazine can be drawn from reserves.
+
+Any other perk (like RewindRounds, which depends on the magazine and reserves) has no closed form here. A single
+RewindRounds, alone or with fixed-ratio refund perks, is fired one proc at a time by RewindEngine (see rewindEngine.py),
+and anything else falls back to the per-shot simulator. When expending all ammo, the engine fingerprints the weapon and
+its perks' counters after every reload. Once a fingerprint repeats, every magazine from then on repeats the same cycle,
+so whole cycles are skipped by adding up their totals, and only the last few magazines are fired. Skipped cycles
+don't show the messages their procs would (like RewindRounds' counter and refund lines), so when the current sink is
+verbose every magazine is fired and the output is the same as the simulator's.
+"""
+
+import math
+
+from weapon import Weapon
+from perk import Perk
+from rewindEngine import RewindEngine
+from resultSink import ResultSink, current_sink, use_sink
+
+# The tests that can be run on a weapon without printing, see run_test.
+TESTS = ("magazine", "all_ammo")
+
+
+class MagazineEngine():
+  """
+  A class that holds the methods for emptying weapons analytically, falling back to the simulator when needed.
+  """
+
+  def closed_form_perks(weapon: Weapon):
+    """
+    Returns the list of fixed-ratio refund perks on the weapon, or None if a perk on the weapon has no closed form.
+    Placeholder perks have no effect on the weapon and are left out.
+
+    Parameters:
+    - weapon (Weapon): The weapon to check.
+    """
+    closed_form_perks = []
+
+    for perk in weapon.perks:
+      # Placeholder perks do nothing when fired or reloaded
+      if perk.__class__ is Perk:
+        continue
+
+      # Any perk that isn't a fixed-ratio refund perk has to be simulated
+      if getattr(perk, "trigger_count", None) is None:
+        return None
+
+      closed_form_perks.append(perk)
+
+    return closed_form_perks
+
+  def shots_until_empty(magazine: int, perks: list):
+    """
+    Returns the number of shots fired before a magazine holding `magazine` rounds is empty.
+    Raises a ValueError if the perks refund rounds at least as fast as the weapon uses them.
+
+    Parameters:
+    - magazine (int): The number of rounds currently in the magazine.
+    - perks (list): The fixed-ratio refund perks on the weapon, with their current counters.
+    """
+    # Length of one period of refunds and the rounds refunded during it
+    period = 1
+    for perk in perks:
+      period = math.lcm(period, perk.trigger_count)
+
+    period_refund = sum(perk.refund_amount * (period // perk.trigger_count) for perk in perks)
+    period_drain = period - period_refund
+
+    shots = None
+    for offset in range(period):
+      # Rounds left in the magazine after firing `offset` shots
+      level = magazine - offset
+      for perk in perks:
+        level += perk.refund_amount * ((perk.counter + offset) // perk.trigger_count)
+
+      # Skip ahead the number of whole periods needed to empty the magazine from this offset
+      if level <= 0:
+        candidate = offset
+      elif period_drain > 0:
+        candidate = math.ceil(level / period_drain) * period + offset
+      else:
+        continue
+
+      if shots is None or candidate < shots:
+        shots = candidate
+
+    if shots is None:
+      raise ValueError("The perks on this weapon refund rounds at least as fast as they are used, the magazine never empties.")
+
+    return shots
+
+  def apply_shots(weapon: Weapon, perks: list, shots: int):
+    """
+    Advances the weapon and its fixed-ratio refund perks as if `shots` rounds were fired in a row.
+
+    Parameters:
+    - weapon (Weapon): The weapon to update.
+    - perks (list): The fixed-ratio refund perks on the weapon.
+    - shots (int): The number of shots fired.
+    """
+    weapon.shots_fired += shots
+
+    for perk in perks:
+      hits = perk.counter + shots
+      perk.procs += hits // perk.trigger_count
+      perk.counter = hits % perk.trigger_count
+
+  def fingerprint(weapon: Weapon):
+    """
+    Returns a tuple of everything that decides how the weapon behaves from now on, apart from its reserves.
+
+    Parameters:
+    - weapon (Weapon): The weapon to fingerprint.
+    """
+    fingerprint = [weapon.magazine]
+
+    for perk in weapon.perks:
+      for field in perk.counter_fields:
+        fingerprint.append(getattr(perk, field))
+
+    return tuple(fingerprint)
+
+  def totals(weapon: Weapon):
+    """
+    Returns a list of the weapon's running totals, used to measure how much a cycle of magazines adds up to.
+    The reserves are counted down, so they are included as the number of rounds drawn from them.
+
+    Parameters:
+    - weapon (Weapon): The weapon to read the totals from.
+    """
+    totals = [weapon.shots_fired, weapon.reloads, -weapon.reserves]
+
+    for perk in weapon.perks:
+      for field in perk.total_fields:
+        totals.append(getattr(perk, field))
+
+    return totals
+
+  def skip_cycles(weapon: Weapon, cycle: list, cycles: int):
+    """
+    Advances the weapon's running totals as if the given cycle of magazines was fired `cycles` times.
+
+    Parameters:
+    - weapon (Weapon): The weapon to advance.
+    - cycle (list): How much each of the weapon's totals changes during one cycle, in the order of `totals`.
+    - cycles (int): The number of cycles to skip.
+    """
+    cycle = iter(cycle)
+    weapon.shots_fired += next(cycle) * cycles
+    weapon.reloads += next(cycle) * cycles
+    weapon.reserves -= next(cycle) * cycles
+
+    for perk in weapon.perks:
+      for field in perk.total_fields:
+        setattr(perk, field, getattr(perk, field) + next(cycle) * cycles)
+
+  def fire_magazine(weapon: Weapon):
+    """
+    Fires the weapon until its magazine is empty, the same as calling `weapon.shoot()` until it returns False.
+    Returns the number of shots fired.
+
+    Parameters:
+    - weapon (Weapon): The weapon to fire.
+    """
+    perks = MagazineEngine.closed_form_perks(weapon)
+
+    # Fall back to firing proc by proc, or round by round, if a perk has no closed form
+    if perks is None:
+      shots = RewindEngine.fire_magazine(weapon)
+      if shots is not None:
+        return shots
+
+      shots_fired = weapon.shots_fired
+
+      # Reserves never change on a weapon with infinite reserves, so a repeated fingerprint means it never empties
+      if weapon.reserves_size == -1:
+        seen = set()
+        while weapon.shoot():
+          fingerprint = MagazineEngine.fingerprint(weapon)
+          if fingerprint in seen:
+            raise ValueError("The perks on this weapon refund rounds at least as fast as they are used, the magazine never empties.")
+          seen.add(fingerprint)
+        return weapon.shots_fired - shots_fired
+
+      while weapon.shoot():
+        pass
+      return weapon.shots_fired - shots_fired
+
+    shots = MagazineEngine.shots_until_empty(weapon.magazine, perks)
+    MagazineEngine.apply_shots(weapon, perks, shots)
+    weapon.magazine = 0
+
+    return shots
+
+  def expend_all(weapon: Weapon):
+    """
+    Fires and reloads the weapon until both the magazine and reserves are empty.
+    This is the same as firing the weapon and reloading it every time the magazine is empty until a reload fails.
+    Returns the number of shots fired.
+
+    Parameters:
+    - weapon (Weapon): The weapon to fire.
+    """
+    perks = MagazineEngine.closed_form_perks(weapon)
+
+    # Fall back to firing magazine by magazine if a perk has no closed form
+    if perks is None or weapon.reserves <= 0:
+      shots_fired = weapon.shots_fired
+
+      # Skipping cycles would drop the messages of their procs, so a sink that shows them gets every magazine
+      skip = not current_sink().verbose
+
+      # The totals after each reload, by the fingerprint of the weapon at that point
+      seen = {}
+      while True:
+        MagazineEngine.fire_magazine(weapon)
+        if not weapon.reload():
+          break
+        if not skip:
+          continue
+
+        fingerprint = MagazineEngine.fingerprint(weapon)
+        totals = MagazineEngine.totals(weapon)
+
+        if fingerprint in seen:
+          # The same cycle of magazines repeats from here, each time drawing the same rounds from reserves
+          cycle = [total - previous for total, previous in zip(totals, seen[fingerprint])]
+          drawn = cycle[2]
+
+          # Every draw during a cycle is met in full as long as a cycle starts with enough reserves for all of it,
+          # so whole cycles can be skipped while that holds and the rest is simulated
+          cycles = weapon.reserves // drawn
+          if cycles > 0:
+            MagazineEngine.skip_cycles(weapon, cycle, cycles)
+          seen.clear()
+        else:
+          seen[fingerprint] = totals
+
+      return weapon.shots_fired - shots_fired
+
+    # Every reload draws a full magazine from reserves, except for the last one
+    reloads = math.ceil(weapon.reserves / weapon.magazine_size)
+
+    shots = MagazineEngine.shots_until_empty(weapon.magazine + weapon.reserves, perks)
+    MagazineEngine.apply_shots(weapon, perks, shots)
+    weapon.magazine = 0
+    weapon.reserves = 0
+    weapon.reloads += reloads
+
+    return shots
+
+
+def run_test(weapon: Weapon, test: str):
+  """
+  Runs a test on the weapon with all output sent to a silent sink, leaving the weapon in its state after the test.
+  A weapon that never runs out of ammo is left with -1 shots fired.
+
+  Parameters:
+  - weapon (Weapon): The weapon to test.
+  - test (str): The test to run, "magazine" to empty the magazine or "all_ammo" to expend all ammo.
+  """
+  if test not in TESTS:
+    raise ValueError(f"Unknown test '{test}'. Expected one of: {', '.join(TESTS)}")
+
+  try:
+    with use_sink(ResultSink()):
+      if test == "magazine":
+        MagazineEngine.fire_magazine(weapon)
+      else:
+        MagazineEngine.expend_all(weapon)
+  except ValueError:
+    weapon.shots_fired = -1
+
+
+def verify(max_magazine_size: int = 300, reserves_sizes: tuple = (0, 1, 7, 60, 250)):
+  """
+  Checks the engine against the per-shot simulator for every magazine size up to `max_magazine_size`
+  and every pairing of TripleTap, FourthTimesTheCharm and no perk that eventually runs out of ammo.
+  Returns a list of the configurations where the two disagree.
+
+  Parameters:
+  - max_magazine_size (int): The largest magazine size to check.
+  - reserves_sizes (tuple): The reserves sizes to check the all ammo results with.
+  """
+  from perks import TripleTap, FourthTimesTheCharm
+
+  perk_types = [Perk, TripleTap, FourthTimesTheCharm]
+  mismatches = []
+
+  for first in perk_types:
+    for second in perk_types:
+      # Skip pairs that refund a round for every shot, the simulator would never finish
+      ratio = sum(getattr(perk, "refund_amount", 0) / getattr(perk, "trigger_count", 1) for perk in (first, second))
+      if ratio >= 1:
+        continue
+
+      for magazine_size in range(1, max_magazine_size + 1):
+        for reserves_size in reserves_sizes:
+          simulated = Weapon(magazine_size=magazine_size, reserves_size=reserves_size, perks=[first(), second()])
+          engine = Weapon(magazine_size=magazine_size, reserves_size=reserves_size, perks=[first(), second()])
+
+          # Magazine test
+          while simulated.shoot():
+            pass
+          MagazineEngine.fire_magazine(engine)
+          if simulated.state() != engine.state():
+            mismatches.append(("magazine", first.__name__, second.__name__, magazine_size, reserves_size))
+
+          # All ammo test, continuing from the empty magazine
+          while simulated.reload():
+            while simulated.shoot():
+              pass
+          MagazineEngine.expend_all(engine)
+          if simulated.state() != engine.state():
+            mismatches.append(("all ammo", first.__name__, second.__name__, magazine_size, reserves_size))
+
+  return mismatches
+
+
+if __name__ == '__main__':
+  mismatches = verify()
+  print("Mismatches: " + str(len(mismatches)))
+  for mismatch in mismatches:
+    print(mismatch)
@@ -2,13 +2,20 @@ from typing import Optional
 
 from weapon import Weapon
 from firingRange import FiringRange
+from lookupTable import LookupTable
+from speculation import Speculator
 from perks import TripleTap, FourthTimesTheCharm, RewindRounds
 from perk import Perk
 
 
 def main():
+  # Open the precomputed results if they have been built (python lookupTable.py build), otherwise simulate everything.
+  # The tests on each weapon are worked out in the background while the menu is up (see speculation.py).
+  table = Speculator(LookupTable.open())
+
   # Get the user to define a weapon configuration.
   current_weapon = define_weapon()
+  table.start(current_weapon)
   
   # Main Loop for running tests on the weapon.
   while True:
@@ -24,16 +31,17 @@ def main():
     # Handle exit case
     if test_type == '5':
       print("Exiting the test.")
+      table.close()
       break
 
     # Handle creation of new weapon configuration
     if test_type == '4':
       print("Creating a new weapon configuration.")
       current_weapon = define_weapon()  # Allow user to define a new weapon
-      pass
+      table.start(current_weapon)  # Drop the work left for the last weapon
 
     # Run the selected test(s)
-    run_test(current_weapon, test_type)
+    run_test(current_weapon, test_type, table)
     
 
 
@@ -44,7 +52,7 @@ def define_weapon():
 
   # Get basic weapon parameters.
   magazine_size = get_valid_int_input("Enter magazine size: ", min_value=1, max_value=300)
-  reserves_size = get_valid_int_input("Enter reserves size (enter -1 for infinite reserves): ", min_value=-1, max_value=10000)
+  reserves_size = get_valid_int_input("Enter reserves size (enter -1 for infinite reserves): ", min_value=-1, max_value=10000000)
 
   # Get perks from user.
   perks = []
@@ -82,21 +90,21 @@ def return_perk(selection: str, is_enhanced: bool):
       # No perk selected
       return Perk()
 
-def run_test(weapon, test_type):
+def run_test(weapon, test_type, table: Optional[LookupTable] = None):
   """
-  Runs the user specified test.
+  Runs the user specified test, reading the result from the table (a LookupTable or Speculator) when it has one for the weapon.
   """
   match test_type:
     case '1':
       # Run Magazine Test
-      FiringRange.mag_test(weapon)
+      FiringRange.mag_test(weapon, table=table)
     case '2':
       # All ammo test
-      FiringRange.all_ammo_test(weapon)
+      FiringRange.all_ammo_test(weapon, table=table)
     case '3':
       # Both Tests
-      FiringRange.mag_test(weapon)
-      FiringRange.all_ammo_test(weapon)
+      FiringRange.mag_test(weapon, table=table)
+      FiringRange.all_ammo_test(weapon, table=table)
 
 def get_valid_text_input(prompt: str, valid_options: list):
   """
@@ -0,0 +1,176 @@
+"""
+MonteCarlo runs the magazine and all ammo tests with imperfect aim.
+
+Every shot hits with a given probability, and a hit is a precision hit with another probability. TripleTap and
+FourthTimesTheCharm only count precision hits and lose their counter on anything else, and RewindRounds only counts
+hits (see Weapon.shoot). Each trial fires a fresh weapon with its own sequence of random shots.
+
+Statistics are gathered as the trials run, so memory doesn't grow with the number of trials: the mean and variance
+with Welford's method, and percentiles from a count of how often each shot total came up (shot totals are whole numbers
+within a small range, so the count stays small however many trials are run).
+
+Random numbers come from Python's `random.Random`, seeded so a run can be reproduced exactly. NumPy isn't a dependency
+of this project, so shots are drawn one at a time rather than in vectorized blocks.
+"""
+
+import math
+import random
+
+from weaponConfig import WeaponConfig
+from magazineEngine import TESTS
+from resultSink import ResultSink, use_sink
+
+class RunningStats():
+  """
+  Statistics for a stream of whole numbers, updated one value at a time.
+
+  Attributes:
+  - count (int): The number of values added.
+  - mean (float): The mean of the values.
+  - m2 (float): The sum of squared differences from the mean, used for the variance.
+  - histogram (dict): How many times each value was added.
+  """
+  def __init__(self):
+    """
+    Initializes a new, empty instance of the RunningStats class.
+    """
+    self.count = 0
+    self.mean = 0.0
+    self.m2 = 0.0
+    self.histogram = {}
+
+  def add(self, value: int):
+    """
+    Adds a value to the statistics.
+    """
+    self.count += 1
+    delta = value - self.mean
+    self.mean += delta / self.count
+    self.m2 += delta * (value - self.mean)
+    self.histogram[value] = self.histogram.get(value, 0) + 1
+
+  def merge(self, other):
+    """
+    Adds all the values from another RunningStats, as if they had been added here.
+    """
+    if other.count == 0:
+      return
+
+    count = self.count + other.count
+    delta = other.mean - self.mean
+    self.m2 += other.m2 + delta * delta * self.count * other.count / count
+    self.mean += delta * other.count / count
+    self.count = count
+
+    for value, times in other.histogram.items():
+      self.histogram[value] = self.histogram.get(value, 0) + times
+
+  def variance(self):
+    """
+    Returns the sample variance of the values.
+    """
+    return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+  def confidence_interval(self, z: float = 1.96):
+    """
+    Returns the (low, high) confidence interval of the mean, 95% by default.
+
+    Parameters:
+    - z (float): The number of standard errors on either side of the mean (default is 1.96).
+    """
+    error = z * math.sqrt(self.variance() / self.count) if self.count else 0.0
+    return (self.mean - error, self.mean + error)
+
+  def percentile(self, percent: float):
+    """
+    Returns the smallest value that at least `percent` percent of the values are less than or equal to.
+    """
+    if self.count == 0:
+      return None
+
+    needed = max(1, math.ceil(self.count * percent / 100))
+    seen = 0
+    for value in sorted(self.histogram):
+      seen += self.histogram[value]
+      if seen >= needed:
+        return value
+
+  def summary(self):
+    """
+    Returns a dictionary with the mean, standard deviation, 95% confidence interval of the mean, and percentiles.
+    """
+    low, high = self.confidence_interval()
+
+    return {
+      "mean": self.mean,
+      "stdev": math.sqrt(self.variance()),
+      "ci95": [low, high],
+      "min": min(self.histogram) if self.histogram else None,
+      "p5": self.percentile(5),
+      "p50": self.percentile(50),
+      "p95": self.percentile(95),
+      "max": max(self.histogram) if self.histogram else None,
+    }
+
+
+class MonteCarlo():
+  """
+  A class that holds the methods for running the tests with a chance of missing shots.
+  """
+
+  def run(config: WeaponConfig, trials: int, hit_rate: float = 1.0, precision_rate: float = 1.0, seed: int = 0,
+          test: str = "magazine", max_shots: int = 10000000):
+    """
+    Runs a test on fresh weapons with the given configuration `trials` times.
+    Returns a dictionary with statistics for the shots fired and reloads per trial, and the procs of each perk.
+
+    Parameters:
+    - config (WeaponConfig): The configuration of the weapon.
+    - trials (int): The number of trials to run.
+    - hit_rate (float): The chance that a shot hits (default is 1.0).
+    - precision_rate (float): The chance that a hit is a precision hit (default is 1.0).
+    - seed (int): The seed for the random shots (default is 0). The same seed always gives the same results.
+    - test (str): The test to run, "magazine" or "all_ammo" (default is "magazine").
+    - max_shots (int): The most shots a single trial may fire before it is treated as never running out of ammo.
+    """
+    if test not in TESTS:
+      raise ValueError(f"Unknown test '{test}'. Expected one of: {', '.join(TESTS)}")
+
+    rng = random.Random(seed)
+    rand = rng.random
+    precise = hit_rate * precision_rate
+
+    weapon = config.build()
+    shots = RunningStats()
+    reloads = RunningStats()
+    procs = [RunningStats() for perk in weapon.perks]
+
+    with use_sink(ResultSink()):
+      for trial in range(trials):
+        weapon.resupply()
+
+        # One random number decides each shot: below the precision chance is a precision hit, below the hit chance a hit
+        while True:
+          roll = rand()
+          if not weapon.shoot(roll < hit_rate, roll < precise):
+            if test == "magazine" or not weapon.reload():
+              break
+
+          if weapon.shots_fired > max_shots:
+            raise ValueError("A trial fired more than " + str(max_shots) + " shots without running out of ammo.")
+
+        shots.add(weapon.shots_fired)
+        reloads.add(weapon.reloads)
+        for stats, perk in zip(procs, weapon.perks):
+          stats.add(getattr(perk, "procs", 0))
+
+    return {
+      "trials": trials,
+      "hit_rate": hit_rate,
+      "precision_rate": precision_rate,
+      "seed": seed,
+      "test": test,
+      "shots_fired": shots.summary(),
+      "reloads": reloads.summary(),
+      "procs": {perk.__class__.__name__: stats.summary() for perk, stats in zip(weapon.perks, procs)},
+    }
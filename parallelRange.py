@@ -0,0 +1,150 @@
+"""
+The parallel range runs the magazine and all ammo tests over a grid of weapon configurations on a process pool.
+
+FiringRange works on a single mutable Weapon, and perk instances carry their own state, so nothing can be shared
+between workers. Workers are only ever sent WeaponConfig tuples and build a fresh Weapon with fresh perks for every
+configuration they run.
+
+The grid is split into numbered chunks. Chunks finish in whatever order the pool gets to them, but they are handed
+back in chunk order, so a run always produces the same sequence of results no matter how many workers are used.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from weaponConfig import WeaponConfig
+from magazineEngine import TESTS, run_test
+
+def run_config(config: WeaponConfig, test: str):
+  """
+  Runs a single test on a fresh weapon built from the configuration, with printing silenced.
+  Returns the weapon's state after the test, in the same shape as Weapon.report().
+  A weapon that never runs out of ammo is reported with -1 shots fired.
+
+  Parameters:
+  - config (WeaponConfig): The configuration of the weapon to test.
+  - test (str): The test to run, "magazine" or "all_ammo".
+  """
+  weapon = config.build()
+  run_test(weapon, test)
+
+  return weapon.state()
+
+
+def run_chunk(chunk_index: int, configs: list, tests: tuple):
+  """
+  Runs every test on every configuration in a chunk. This is the function run by the workers.
+  Returns the chunk index and a list of (config, test, state) results, in the order of the configurations.
+
+  Parameters:
+  - chunk_index (int): The position of the chunk in the grid.
+  - configs (list): The configurations in the chunk.
+  - tests (tuple): The tests to run on each configuration.
+  """
+  results = []
+
+  for config in configs:
+    for test in tests:
+      results.append((config, test, run_config(config, test)))
+
+  return chunk_index, results
+
+
+def chunk_grid(configs, chunk_size: int):
+  """
+  Splits the configurations into numbered chunks of at most `chunk_size` configurations.
+  Yields (chunk index, list of configurations) pairs.
+
+  Parameters:
+  - configs (iterable): The configurations to split.
+  - chunk_size (int): The largest number of configurations in a chunk.
+  """
+  chunk = []
+  chunk_index = 0
+
+  for config in configs:
+    chunk.append(config)
+    if len(chunk) == chunk_size:
+      yield chunk_index, chunk
+      chunk = []
+      chunk_index += 1
+
+  if chunk:
+    yield chunk_index, chunk
+
+
+def run_grid(configs, tests: tuple = TESTS, workers: int = None, chunk_size: int = 64, cache=None):
+  """
+  Runs the tests over every configuration on a pool of worker processes.
+  Yields the results of each chunk as a list of (config, test, state) tuples, in the same order as the configurations,
+  as soon as that chunk and every chunk before it have finished.
+
+  Parameters:
+  - configs (iterable): The configurations to test.
+  - tests (tuple): The tests to run on each configuration.
+  - workers (int): The number of worker processes. Defaults to the number of CPUs.
+  - chunk_size (int): The number of configurations sent to a worker at a time.
+  - cache (ResultCache): A cache to take results from and store new results in (default is None, no cache).
+    Chunks that are fully cached are never sent to the pool.
+  """
+  for test in tests:
+    if test not in TESTS:
+      raise ValueError(f"Unknown test '{test}'. Expected one of: {', '.join(TESTS)}")
+
+  tests = tuple(tests)
+  workers = workers or os.cpu_count() or 1
+
+  with ProcessPoolExecutor(max_workers=workers) as pool:
+    # Keep a few chunks queued per worker, so the grid doesn't have to be held in memory all at once
+    pending = {}
+    next_chunk = 0
+    chunks = chunk_grid(configs, chunk_size)
+
+    def submit_chunks():
+      while len(pending) < workers * 4:
+        chunk = next(chunks, None)
+        if chunk is None:
+          return
+        chunk_index, chunk_configs = chunk
+
+        # Skip the pool entirely for chunks that have already been run
+        if cache is not None:
+          cached = [(config, test, cache.get(config, test)) for config in chunk_configs for test in tests]
+          if all(state is not None for config, test, state in cached):
+            pending[chunk_index] = cached
+            continue
+
+        pending[chunk_index] = pool.submit(run_chunk, chunk_index, chunk_configs, tests)
+
+    submit_chunks()
+    while pending:
+      # Hand back chunks in order, later chunks keep running in the pool while waiting on this one
+      results = pending.pop(next_chunk)
+      if not isinstance(results, list):
+        chunk_index, results = results.result()
+
+        if cache is not None:
+          for config, test, state in results:
+            cache.put(config, test, state)
+          cache.flush()
+
+      yield results
+      next_chunk += 1
+
+      submit_chunks()
+
+
+def merge_chunks(chunks):
+  """
+  Merges chunks of results from run_chunk into a single list in grid order, no matter what order they arrive in.
+  Returns a list of (config, test, state) tuples.
+
+  Parameters:
+  - chunks (iterable): (chunk index, results) pairs as returned by run_chunk.
+  """
+  merged = []
+
+  for chunk_index, results in sorted(chunks, key=lambda chunk: chunk[0]):
+    merged.extend(results)
+
+  return merged
@@ -5,6 +5,37 @@ class  Perk():
   Parent class for perks or modifiers that can be applied to a weapon.
   This class provides a template for defining perks that can modify the behavior of a weapon when firing or reloading.
   """
+  __slots__ = ("enhanced",)
+
+  # Bump the version whenever a change to a perk changes its results, so cached results for it are thrown out.
+  version = 1
+
+  # Whether the perk's effect depends on the weapon's state when it triggers (like an empty magazine).
+  # Perks that don't can be applied in any order without changing the results.
+  reads_weapon = False
+
+  # Whether the enhanced version of the perk changes how much ammo it refunds, and whether the perk uses the fire rate.
+  enhanced_affects_ammo = False
+  uses_fire_rate = False
+
+  # Whether the rounds the perk refunds come out of reserves, instead of from thin air.
+  refunds_from_reserves = False
+
+  # The events the perk handles, out of "shot", "reload" and "reset". Weapons only call a perk for these events.
+  events = ()
+
+  # The attributes that make up the perk's state while firing, and the attributes that only ever add up totals.
+  # Two weapons whose perks have the same counters behave the same from then on.
+  counter_fields = ()
+  total_fields = ()
+
+  # Seconds allowed between hits before the perk's counter resets (when enhanced, and when not), and seconds the perk
+  # stays inactive after a proc. None when the perk has no such limit. Only used by the time simulation in dpsPhase.py,
+  # the shot by shot simulation assumes every hit lands inside the window.
+  hit_window = None
+  enhanced_hit_window = None
+  cooldown = None
+
   def __init__(self, enhanced: bool = False):
     """
     Initializes a new instance of the Perk class.
@@ -14,6 +45,13 @@ class  Perk():
     self.enhanced = enhanced  # Indicates if the perk is enhanced.
     pass
 
+  def bind(self, weapon):
+    """
+    Called when the perk's weapon is compiled. Perks can work out anything that only depends on the weapon's
+    configuration here, instead of on every shot.
+    """
+    pass
+
   def shot_trigger(self, weapon):
     pass
 
@@ -23,5 +61,15 @@ class  Perk():
   def reset(self):
     pass
 
-  def report(self):
-    pass
\ No newline at end of file
+  def state(self):
+    """
+    Returns a dictionary with the current state of the perk without printing anything.
+    Placeholder perks have no state to report.
+    """
+    return None
+
+  def report(self, sink=None):
+    """
+    Shows the perk's state on the sink (or the current sink) and returns it. Placeholder perks have nothing to show.
+    """
+    return self.state()
\ No newline at end of file
@@ -0,0 +1,388 @@
+"""
+PerkSpec describes a refund perk with data instead of code, and compile_perk turns it into a Perk class.
+
+TripleTap and FourthTimesTheCharm only differ by two numbers, and RewindRounds is the same idea with a different
+trigger. A spec covers all three:
+- What counts towards the perk: precision hits (TripleTap, FourthTimesTheCharm) or any hit (RewindRounds), and whether
+  anything else resets the counter.
+- When it procs: every `trigger_count` counted hits, or when the magazine empties with enough hits counted
+  (`activation_threshold` of the magazine size, rounded down, at least 1).
+- What it refunds: `refund_amount` rounds, plus `refund_percentage` of the counted hits rounded up (a different
+  percentage when enhanced), from thin air or from reserves, optionally capped at the magazine size.
+- A cooldown after each proc, shot by shot approximated by ignoring the next `fire_rate // 60` shots (see RewindRounds).
+- Whether a reload resets the counter, and the hit windows used by dpsPhase.py.
+
+The compiled class fills in the same class attributes as the handwritten perks, so every fast path picks it up
+without knowing about specs:
+- A perk that refunds a fixed amount from thin air every N precision hits (or hits) with no cooldown gets
+  `trigger_count` and `refund_amount`, which is all MagazineEngine needs for its closed form (and batchSweep and
+  lookupTable for theirs).
+- Every other perk gets `counter_fields` and `total_fields`, which is all MagazineEngine needs to fingerprint the
+  weapon and skip repeating magazines, and WeaponBatch needs to store it in columns.
+
+The trigger itself is compiled once per spec: the choices a spec makes are settled when the class is built, so a
+shot only runs the code its spec needs.
+
+Adding a new refund perk takes one spec and a call to register:
+
+  register(PerkSpec("Overflow", trigger_count=5, refund_amount=3, source="reserves", cap_at_magazine=True))
+
+SPECS holds the specs of the handwritten perks, and verify checks their compiled versions give the same results.
+"""
+
+import math
+import random
+import re
+from operator import attrgetter
+from typing import NamedTuple, Optional
+
+from perk import Perk
+from perks import PERK_TYPES
+from resultSink import current_sink
+
+class PerkSpec(NamedTuple):
+  """
+  A declarative description of a refund perk.
+
+  Attributes:
+  - name (str): The name of the perk class, used in reports and PERK_TYPES.
+  - counts (str): What counts towards the perk, "precision" hits or any "hit" (default is "precision").
+  - reset_on_miss (bool): Whether a shot that doesn't count resets the counter (default is True).
+  - trigger (str): "every" to proc every `trigger_count` counted hits, or "empty" to proc when the magazine empties
+    with at least the activation threshold counted (default is "every").
+  - trigger_count (int): The counted hits per proc, for "every" triggers.
+  - activation_threshold (float): The fraction of the magazine size that has to be counted, for "empty" triggers.
+  - refund_amount (int): The rounds refunded per proc.
+  - refund_percentage (float): The fraction of counted hits refunded per proc on top of the refund amount, rounded up.
+  - enhanced_refund_percentage (float): The fraction refunded when enhanced (default is None, same as refund_percentage).
+  - source (str): Where refunds come from, "thin_air" or "reserves" (default is "thin_air").
+  - cap_at_magazine (bool): Whether a single refund is capped at the magazine size (default is False).
+  - cooldown (float): Seconds the perk is inactive after a proc (default is None, no cooldown).
+  - reset_on_reload (bool): Whether a reload resets the counter (default is False).
+  - hit_window (float): Seconds allowed between counted hits, for dpsPhase.py (default is None).
+  - enhanced_hit_window (float): Seconds allowed between counted hits when enhanced (default is None).
+  - label (str): The name shown in reports (default is None, the name split into words).
+  - version (int): The version of the perk, bump it when a change to the spec changes its results (default is 1).
+  """
+  name: str
+  counts: str = "precision"
+  reset_on_miss: bool = True
+  trigger: str = "every"
+  trigger_count: int = 0
+  activation_threshold: float = 0.0
+  refund_amount: int = 0
+  refund_percentage: float = 0.0
+  enhanced_refund_percentage: Optional[float] = None
+  source: str = "thin_air"
+  cap_at_magazine: bool = False
+  cooldown: Optional[float] = None
+  reset_on_reload: bool = False
+  hit_window: Optional[float] = None
+  enhanced_hit_window: Optional[float] = None
+  label: Optional[str] = None
+  version: int = 1
+
+
+# The specs of the handwritten perks in perks/.
+SPECS = {
+  "TripleTap": PerkSpec("TripleTap", trigger_count=3, refund_amount=1, hit_window=2.0, enhanced_hit_window=3.0,
+                        label="Triple Tap"),
+  "FourthTimesTheCharm": PerkSpec("FourthTimesTheCharm", trigger_count=4, refund_amount=2, hit_window=2.0,
+                                  enhanced_hit_window=3.0, label="Fourth Times The Charm"),
+  "RewindRounds": PerkSpec("RewindRounds", counts="hit", reset_on_miss=False, trigger="empty", activation_threshold=0.2875,
+                           refund_percentage=0.6, enhanced_refund_percentage=0.7, source="reserves", cap_at_magazine=True,
+                           cooldown=1.0, reset_on_reload=True, label="Rewind Rounds"),
+}
+
+
+def check_spec(spec: PerkSpec):
+  """
+  Raises a ValueError if the spec doesn't describe a perk that can be compiled.
+  """
+  if spec.counts not in ("precision", "hit"):
+    raise ValueError(f"{spec.name}: counts must be 'precision' or 'hit', not '{spec.counts}'.")
+  if spec.trigger not in ("every", "empty"):
+    raise ValueError(f"{spec.name}: trigger must be 'every' or 'empty', not '{spec.trigger}'.")
+  if spec.trigger == "every" and spec.trigger_count < 1:
+    raise ValueError(f"{spec.name}: an 'every' trigger needs a trigger_count of at least 1.")
+  if spec.source not in ("thin_air", "reserves"):
+    raise ValueError(f"{spec.name}: source must be 'thin_air' or 'reserves', not '{spec.source}'.")
+  if spec.refund_amount < 0 or spec.refund_percentage < 0:
+    raise ValueError(f"{spec.name}: refunds can't be negative.")
+
+
+def has_closed_form(spec: PerkSpec):
+  """
+  Returns True if MagazineEngine can work out the perk in closed form: a fixed refund from thin air every N counted
+  hits, with no cooldown or reload reset, and with precision hits counted (every shot is assumed to be one).
+  """
+  return (spec.trigger == "every" and spec.source == "thin_air" and spec.refund_percentage == 0
+          and (spec.enhanced_refund_percentage or 0) == 0 and not spec.cap_at_magazine and spec.cooldown is None
+          and not spec.reset_on_reload)
+
+
+def compile_perk(spec: PerkSpec):
+  """
+  Returns a new Perk subclass that behaves as the spec describes.
+
+  Parameters:
+  - spec (PerkSpec): The spec of the perk.
+  """
+  check_spec(spec)
+
+  closed_form = has_closed_form(spec)
+  from_reserves = spec.source == "reserves"
+  label = spec.label or re.sub(r"(?<=[a-z])(?=[A-Z])", " ", spec.name)
+  counted = attrgetter("precision_hit" if spec.counts == "precision" else "hit")
+  reset_on_miss = spec.reset_on_miss
+  refund_amount = spec.refund_amount
+  trigger_count = spec.trigger_count
+  enhanced_percentage = spec.refund_percentage if spec.enhanced_refund_percentage is None else spec.enhanced_refund_percentage
+
+  counter_fields = ("counter",) + (("disabled_shots",) if spec.cooldown is not None else ())
+  # A closed form perk's refunds follow from its procs, any other perk keeps a running total
+  total_fields = ("procs",) if closed_form else ("procs", "refunded")
+  slots = counter_fields + total_fields + ("percentage_refund", "activation_threshold", "inactive_shots")
+
+  def give(weapon, amount):
+    """
+    Adds a refund to the magazine, limited by the reserves and the magazine size where the spec says so.
+    Returns the rounds actually refunded.
+    """
+    finite_reserves = from_reserves and weapon.reserves_size != -1
+    if finite_reserves:
+      amount = min(amount, weapon.reserves)
+    if spec.cap_at_magazine:
+      amount = min(amount, weapon.magazine_size)
+
+    weapon.magazine += amount
+    if finite_reserves:
+      weapon.reserves -= amount
+
+    return amount
+
+  def proc(self, weapon):
+    """
+    Refunds rounds for the counted hits and starts the cooldown.
+    """
+    amount = refund_amount
+    if self.percentage_refund:
+      amount += math.ceil(self.counter * self.percentage_refund)
+
+    amount = give(weapon, amount)
+    if not closed_form:
+      self.refunded += amount
+    self.procs += 1
+    self.counter = 0
+    if spec.cooldown is not None:
+      self.disabled_shots = self.inactive_shots
+
+  if closed_form:
+    # The same trigger as the handwritten TripleTap and FourthTimesTheCharm
+    def shot_trigger(self, weapon):
+      if not counted(weapon):
+        if reset_on_miss:
+          self.counter = 0
+        return
+
+      self.counter += 1
+      if self.counter == trigger_count:
+        weapon.magazine += refund_amount
+        self.counter = 0
+        self.procs += 1
+
+  elif spec.trigger == "every":
+    def shot_trigger(self, weapon):
+      if spec.cooldown is not None and self.disabled_shots > 0:
+        self.disabled_shots -= 1
+        return
+
+      if not counted(weapon):
+        if reset_on_miss:
+          self.counter = 0
+        return
+
+      self.counter += 1
+      if self.counter == trigger_count:
+        proc(self, weapon)
+
+  else:
+    def shot_trigger(self, weapon):
+      if spec.cooldown is not None and self.disabled_shots > 0:
+        self.disabled_shots -= 1
+        return
+
+      # A shot that doesn't count can still empty the magazine
+      if counted(weapon):
+        self.counter += 1
+      elif reset_on_miss:
+        self.counter = 0
+
+      if weapon.magazine == 0 and self.counter >= self.activation_threshold:
+        proc(self, weapon)
+
+  def __init__(self, enhanced: bool = False):
+    Perk.__init__(self, enhanced)
+    for field in counter_fields + total_fields:
+      setattr(self, field, 0)
+    self.percentage_refund = enhanced_percentage if enhanced else spec.refund_percentage
+
+    # Worked out from the weapon when it is compiled, see bind
+    self.activation_threshold = 1
+    self.inactive_shots = 0
+
+  def bind(self, weapon):
+    if spec.trigger == "empty":
+      self.activation_threshold = max(1, math.floor(weapon.magazine_size * spec.activation_threshold))
+    if spec.cooldown is not None:
+      self.inactive_shots = weapon.fire_rate // 60
+
+  def reload_trigger(self, weapon):
+    self.counter = 0
+    if spec.cooldown is not None:
+      self.disabled_shots = 0
+
+  def reset(self):
+    for field in counter_fields + total_fields:
+      setattr(self, field, 0)
+
+  def state(self):
+    state = {
+      "procs": self.procs,
+      "refunded": self.procs * refund_amount if closed_form else self.refunded,
+      "counter": self.counter,
+    }
+    if spec.cooldown is not None:
+      state["disabled_shots"] = self.disabled_shots
+
+    return state
+
+  def report(self, sink=None):
+    sink = sink or current_sink()
+    state = self.state()
+
+    sink.message(f"{label} Procs: {state['procs']}")
+    sink.message(f"{label} Refunded: {state['refunded']}")
+    sink.message(f"{label} Counter: {state['counter']}")
+    if "disabled_shots" in state:
+      sink.message(f"{label} Disabled Shots: {state['disabled_shots']}")
+
+    return state
+
+  events = ("shot", "reset") + (("reload",) if spec.reset_on_reload else ())
+
+  namespace = {
+    "__doc__": f"{label}, compiled from {spec!r}.",
+    "__slots__": slots,
+    "spec": spec,
+    "version": spec.version,
+    "reads_weapon": spec.trigger == "empty" or from_reserves or spec.cap_at_magazine,
+    "enhanced_affects_ammo": enhanced_percentage != spec.refund_percentage,
+    "uses_fire_rate": spec.cooldown is not None,
+    "refunds_from_reserves": from_reserves,
+    "events": events,
+    "counter_fields": counter_fields,
+    "total_fields": total_fields,
+    "hit_window": spec.hit_window,
+    "enhanced_hit_window": spec.enhanced_hit_window,
+    "cooldown": spec.cooldown,
+    "__init__": __init__,
+    "bind": bind,
+    "shot_trigger": shot_trigger,
+    "reload_trigger": reload_trigger,
+    "reset": reset,
+    "state": state,
+    "report": report,
+  }
+
+  # Only perks with a closed form advertise one, MagazineEngine looks for these to decide
+  if closed_form:
+    namespace["trigger_count"] = trigger_count
+    namespace["refund_amount"] = refund_amount
+
+  return type(spec.name, (Perk,), namespace)
+
+
+def register(spec: PerkSpec):
+  """
+  Compiles a spec and adds the perk to PERK_TYPES, so it can be used in WeaponConfig and everything built on it.
+  Returns the compiled class. Raises a ValueError if a perk with the same name is already registered.
+  """
+  if spec.name in PERK_TYPES:
+    raise ValueError(f"A perk named {spec.name} is already registered.")
+
+  perk_type = compile_perk(spec)
+  PERK_TYPES[spec.name] = perk_type
+
+  return perk_type
+
+
+def verify(max_magazine_size: int = 60, reserves_sizes: tuple = (-1, 0, 7, 60, 250), fire_rates: tuple = (0, 600, 900),
+           random_trials: int = 2):
+  """
+  Checks the compiled versions of the handwritten perks against the handwritten ones, alone and paired with every
+  handwritten perk, with every shot a precision hit and with random misses. Returns a list of the configurations where
+  they disagree.
+  """
+  from weapon import Weapon
+  from magazineEngine import run_test
+  from resultSink import ResultSink, use_sink
+
+  compiled = {name: compile_perk(spec) for name, spec in SPECS.items()}
+  partners = [Perk] + [PERK_TYPES[name] for name in SPECS]
+  rng = random.Random(0)
+  mismatches = []
+
+  def fire(weapon, rolls, limit):
+    # Fires round by round with the given hits, reloading until out of ammo or past the limit
+    with use_sink(ResultSink()):
+      for shot in range(limit):
+        hit, precision_hit = rolls[shot % len(rolls)]
+        if not weapon.shoot(hit, precision_hit) and not weapon.reload():
+          return
+
+  for name, compiled_type in compiled.items():
+    handwritten_type = PERK_TYPES[name]
+
+    for partner in partners:
+      for enhanced in (False, True):
+        for magazine_size in range(1, max_magazine_size + 1):
+          for reserves_size in reserves_sizes:
+            for fire_rate in fire_rates:
+              def build(perk_type):
+                return Weapon(magazine_size=magazine_size, fire_rate=fire_rate, reserves_size=reserves_size,
+                              perks=[perk_type(enhanced=enhanced), partner()])
+
+              # Every shot a precision hit, through MagazineEngine's fast paths
+              # (all ammo never ends with infinite reserves, and neither does a magazine where a second RewindRounds
+              # keeps counting hits the first one refunds)
+              tests = ("magazine", "all_ammo")
+              if reserves_size == -1:
+                tests = () if partner is handwritten_type is PERK_TYPES["RewindRounds"] else ("magazine",)
+              for test in tests:
+                expected, actual = build(handwritten_type), build(compiled_type)
+                run_test(expected, test)
+                run_test(actual, test)
+                # Weapons that never empty only have to agree on that, the rest is wherever the engine noticed
+                if expected.shots_fired == actual.shots_fired == -1:
+                  continue
+                if expected.state() != actual.state():
+                  mismatches.append((test, name, partner.__name__, enhanced, magazine_size, reserves_size, fire_rate))
+
+              # Random misses and body shots, round by round
+              for trial in range(random_trials):
+                rolls = [(rng.random() < 0.9, rng.random() < 0.7) for roll in range(97)]
+                expected, actual = build(handwritten_type), build(compiled_type)
+                fire(expected, rolls, 500)
+                fire(actual, rolls, 500)
+                if expected.state() != actual.state():
+                  mismatches.append(("random", name, partner.__name__, enhanced, magazine_size, reserves_size, fire_rate))
+
+  return mismatches
+
+
+if __name__ == '__main__':
+  mismatches = verify()
+  print("Mismatches: " + str(len(mismatches)))
+  for mismatch in mismatches:
+    print(mismatch)
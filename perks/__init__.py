@@ -1,3 +1,14 @@
 from .fourthTimes import FourthTimesTheCharm
 from .tripleTap import TripleTap
-from .rewindRounds import RewindRounds
\ No newline at end of file
+from .rewindRounds import RewindRounds
+
+from perk import Perk
+
+# Perk classes by name, matching the names used in Weapon.report().
+# The base Perk class is the placeholder used when no perk is selected.
+PERK_TYPES = {
+  "Perk": Perk,
+  "TripleTap": TripleTap,
+  "FourthTimesTheCharm": FourthTimesTheCharm,
+  "RewindRounds": RewindRounds,
+}
\ No newline at end of file
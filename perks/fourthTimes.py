@@ -1,5 +1,3 @@
-from perk import Perk
-
 """
 FourthTimesTheCharm is a perk that refunds two rounds to the magazine for every four precision hits.
 
@@ -12,9 +10,13 @@ When this perk triggers, two rounds will be added to the magazine from thin air
 ENHANCED:
 When enhanced, the window for landing precision hits increased from 2 to 3 seconds.
 
-For the sake of testing, it will be assumed that every hit is a precision hit and that the timing of the hits all fall within the required window.
+For the sake of testing, it will be assumed that the timing of the hits all fall within the required window.
+Any shot that isn't a precision hit resets the counter. Unless told otherwise, every shot is a precision hit.
 """
 
+from perk import Perk
+from resultSink import current_sink
+
 class FourthTimesTheCharm(Perk):
   """
   FourthTimesTheCharm is a perk that refunds two rounds to the magazine for every four precision hits.
@@ -23,10 +25,30 @@ class FourthTimesTheCharm(Perk):
   - counter (int): Tracks the number of precision hits landed in sequence.
   - procs (int): Counts the number of times the perk has successfully triggered and refunded two rounds to the magazine.
   """
-  def __init__(self, **kwargs):
+  __slots__ = ("counter", "procs")
+
+  version = 1
+
+  events = ("shot", "reset")
+  counter_fields = ("counter",)
+  total_fields = ("procs",)
+
+  # Precision hits needed for a proc, and rounds refunded from thin air per proc.
+  trigger_count = 4
+  refund_amount = 2
+
+  # Seconds allowed between precision hits, 2 seconds or 3 when enhanced.
+  hit_window = 2.0
+  enhanced_hit_window = 3.0
+
+  def __init__(self, enhanced: bool = False):
     """
     Initializes a new instance of the FourthTimesTheCharm perk.
+
+    Parameters:
+    - enhanced (bool): Indicates whether this perk is in its enhanced state. Default is False.
     """
+    super().__init__(enhanced)
     self.counter = 0  # Counter for tracking precision hits
     self.procs = 0  # Number of times the perk has triggered
   
@@ -35,13 +57,18 @@ class FourthTimesTheCharm(Perk):
     Increment internal counter and check if the perk should proc.
     This method is called when a shot is fired from the weapon.
     """
+    # Anything but a precision hit breaks the chain
+    if not weapon.precision_hit:
+      self.counter = 0
+      return
+
     # Increment the counter for each hit
     self.counter += 1
     
     # Proc the perk if the counter reaches 4 and reset the counter
-    if self.counter == 4:
+    if self.counter == self.trigger_count:
       # Refund two rounds to the magazine and reset the counter
-      weapon.magazine += 2
+      weapon.magazine += self.refund_amount
       self.counter = 0
 
       # Record the proc
@@ -54,19 +81,28 @@ class FourthTimesTheCharm(Perk):
     self.counter = 0
     self.procs = 0
 
-  def report(self):
+  def state(self):
     """
-    Report the number of times the perk has triggered and refunded rounds.
-    This method can be used to display the performance of the perk.
+    Returns an object containing the current state of the perk without printing anything.
     """
-    print("Fourth Times The Charm Procs: " + str(self.procs))
-    print("Fourth Times The Charm Refunded: " + str(self.procs * 2))  # Each proc refunds 2 rounds
-    print("Fourth Times The Charm Counter: " + str(self.counter))  # Show current counter for debugging purposes
-
-    report = {
+    state = {
       "procs": self.procs,  # Number of times the perk has triggered
-      "refunded": self.procs * 2,  # Total rounds refunded (2 rounds per proc)
+      "refunded": self.procs * self.refund_amount,  # Total rounds refunded (2 rounds per proc)
       "counter": self.counter  # Current counter for precision hits
     }
 
+    return state
+
+  def report(self, sink=None):
+    """
+    Report the number of times the perk has triggered and refunded rounds.
+    This method can be used to display the performance of the perk on the sink (or the current sink).
+    """
+    report = self.state()
+    sink = sink or current_sink()
+
+    sink.message("Fourth Times The Charm Procs: " + str(report["procs"]))
+    sink.message("Fourth Times The Charm Refunded: " + str(report["refunded"]))  # Each proc refunds 2 rounds
+    sink.message("Fourth Times The Charm Counter: " + str(report["counter"]))  # Show current counter for debugging purposes
+
     return report
\ No newline at end of file
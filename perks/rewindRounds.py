@@ -1,6 +1,3 @@
-from perk import Perk
-import math
-
 """
 RewindRounds is a perk that refunds rounds to the magazine from reserves for every hit landed while the perk is active.
 It has somewhat nasty conditions tied into it.
@@ -37,6 +34,10 @@ Refills 70% of hits instead of 60%.
 For Adaptive Burst Fire Linear Fusion Rifles this is 16.33% instead of 14%.
 """
 
+from perk import Perk
+from resultSink import current_sink
+import math
+
 class RewindRounds(Perk):
   """
   RewindRounds is a perk that refunds rounds to the magazine from reserves based on the number of hits landed while the perk is active.
@@ -47,7 +48,27 @@ class RewindRounds(Perk):
   - refunded (int): Total rounds refunded to the magazine from reserves.
   - percentage_refund (float): The percentage of hits refunded to the magazine. This is 60% by default, or 70% if enhanced.
   - disabled_shots (int): The number of shots fired during the perk's inactive period (used for subsequent procs). This is calculated based on the weapon's RPM divided by 60 to get shots per second.
+  - activation_threshold (int): The hits needed before the magazine reaches 0 for a refund, worked out from the weapon's magazine size.
+  - inactive_shots (int): The shots fired while the perk is inactive after a proc, worked out from the weapon's fire rate.
   """
+  __slots__ = ("counter", "procs", "refunded", "percentage_refund", "disabled_shots", "activation_threshold", "inactive_shots")
+
+  version = 1
+
+  # The refund depends on the magazine being empty, the enhanced refund percentage and the fire rate.
+  reads_weapon = True
+  enhanced_affects_ammo = True
+  uses_fire_rate = True
+  refunds_from_reserves = True
+
+  events = ("shot", "reload", "reset")
+  counter_fields = ("counter", "disabled_shots")
+  total_fields = ("procs", "refunded")
+
+  # The perk is inactive for about a second after a proc. The shot by shot simulation approximates this with
+  # disabled shots, the time simulation in dpsPhase.py uses the cooldown directly.
+  cooldown = 1.0
+
   def __init__(self, enhanced: bool = False):
     """
     Initializes a new instance of the RewindRounds perk.
@@ -62,6 +83,18 @@ class RewindRounds(Perk):
     self.percentage_refund = 0.7 if enhanced else 0.6
     self.disabled_shots = 0 # Number of shots fired during the perk's inactive period (used for subsequent procs)
 
+    # Worked out from the weapon when it is compiled, see bind
+    self.activation_threshold = 1
+    self.inactive_shots = 0
+
+  def bind(self, weapon):
+    """
+    Works out the activation threshold and the number of shots fired while the perk is inactive for the weapon.
+    Both only depend on the weapon's magazine size and fire rate.
+    """
+    self.activation_threshold = max(1, math.floor(weapon.magazine_size * 0.2875))
+    self.inactive_shots = math.floor(weapon.fire_rate // 60)
+
   def shot_trigger(self, weapon):
     """
     Check the conditionals for the perk and increment the counter.
@@ -73,30 +106,34 @@ class RewindRounds(Perk):
       self.disabled_shots -= 1
       return
 
-    # Increment the hits
-    self.counter += 1
+    # Increment the hits, a missed shot can still empty the magazine
+    if weapon.hit:
+      self.counter += 1
 
     # If the magazine is empty check the condition for refund
     if (weapon.magazine == 0):
-      # Calculate the activation threshold based on the magazine size
-      activation_threshold = max(1, math.floor(weapon.magazine_size * 0.2875))
+      # Check if the counter exceeds the activation threshold (based on the magazine size)
+      if (self.counter >= self.activation_threshold):
+        # Only build the debug lines when the sink shows them
+        sink = current_sink()
+        if sink.verbose:
+          sink.message("Counter: " + str(self.counter) + " | Activation Threshold: " + str(self.activation_threshold))
 
-      # Check if the counter exceeds the activation threshold
-      if (self.counter >= activation_threshold):
-        print("Counter: " + str(self.counter) + " | Activation Threshold: " + str(activation_threshold))
         # Calculate potential refund based on the current counter
         potential_refund = math.ceil(self.counter * self.percentage_refund)
 
-        # Calculate actual refund based on resereves
-        actual_refund = min(potential_refund, weapon.reserves)
+        # Calculate actual refund based on resereves, weapons with infinite reserves (-1) are never short
+        actual_refund = potential_refund if weapon.reserves_size == -1 else min(potential_refund, weapon.reserves)
 
         # Ensure magazine size limit for refund
         refund = min(actual_refund, weapon.magazine_size)
-        print("Refund: ", refund)
+        if sink.verbose:
+          sink.message("Refund:  " + str(refund))
 
         # Update the magazine and reserves
         weapon.magazine += refund
-        weapon.reserves -= refund
+        if weapon.reserves_size != -1:
+          weapon.reserves -= refund
 
         # Update the refunded count
         self.refunded += refund
@@ -104,10 +141,10 @@ class RewindRounds(Perk):
 
         # Reset the counter after proc and set up for next calculation
         self.counter = 0
-        self.disabled_shots = math.floor(weapon.fire_rate // 60)
+        self.disabled_shots = self.inactive_shots
 
 
-  def reload_trigger(self):
+  def reload_trigger(self, weapon):
     """
     Trigger effects when the weapon is reloaded.
     Rewind rounds is reset by a reload.
@@ -126,22 +163,30 @@ class RewindRounds(Perk):
     self.disabled_shots = 0
 
 
-  def report(self):
+  def state(self):
     """
-    Reports the current state of the RewindRounds perk.
-    This function prints out the stats for the perk and returns a dictionary with the current state.
+    Returns a dictionary with the current state of the RewindRounds perk without printing anything.
     """
-
-    print("Rewind Rounds Procs: " + str(self.procs))
-    print("Rewind Rounds Refunded: " + str(self.refunded))
-    print("Rewind Rounds Counter: " + str(self.counter))
-    print("Rewind Rounds Disabled Shots: " + str(self.disabled_shots))
-    
-    report = {
+    state = {
       "procs": self.procs,  # Number of times the perk has triggered
       "refunded": self.refunded,  # Total rounds refunded to the magazine from reserves
       "counter": self.counter,  # Current counter for hits landed
       "disabled_shots": self.disabled_shots  # Remaining disabled shots (shots fired during the perk's inactive period)
     }
 
-    
\ No newline at end of file
+    return state
+
+  def report(self, sink=None):
+    """
+    Reports the current state of the RewindRounds perk.
+    This function shows the stats for the perk on the sink (or the current sink) and returns a dictionary with the current state.
+    """
+    report = self.state()
+    sink = sink or current_sink()
+
+    sink.message("Rewind Rounds Procs: " + str(report["procs"]))
+    sink.message("Rewind Rounds Refunded: " + str(report["refunded"]))
+    sink.message("Rewind Rounds Counter: " + str(report["counter"]))
+    sink.message("Rewind Rounds Disabled Shots: " + str(report["disabled_shots"]))
+
+    return report
\ No newline at end of file
@@ -1,5 +1,3 @@
-from perk import Perk
-
 """
 TripleTap is a perk that refunds one round to the magazine for every three precision hits.
 
@@ -12,9 +10,13 @@ When this perk triggers a round will be added to the magazine from thin air (mea
 ENHANCED:
 When enhanced, the window for landing precision hits increased from 2 to 3 seconds.
 
-For the sake of testing it will be assumed that every hit is a precision hit and that the timing of the hits all fall within the required window.
+For the sake of testing it will be assumed that the timing of the hits all fall within the required window.
+Any shot that isn't a precision hit resets the counter. Unless told otherwise, every shot is a precision hit.
 """
 
+from perk import Perk
+from resultSink import current_sink
+
 class TripleTap(Perk):
   """
   TripleTap is a perk that refunds one round to the magazine for every three precision hits.
@@ -23,10 +25,30 @@ class TripleTap(Perk):
   - counter (int): Tracks the number of precision hits landed in sequence.
   - procs (int): Counts the number of times the perk has successfully triggered and refunded a round to the magazine.
   """
-  def __init__(self, **kwargs):
+  __slots__ = ("counter", "procs")
+
+  version = 1
+
+  events = ("shot", "reset")
+  counter_fields = ("counter",)
+  total_fields = ("procs",)
+
+  # Precision hits needed for a proc, and rounds refunded from thin air per proc.
+  trigger_count = 3
+  refund_amount = 1
+
+  # Seconds allowed between precision hits, 2 seconds or 3 when enhanced.
+  hit_window = 2.0
+  enhanced_hit_window = 3.0
+
+  def __init__(self, enhanced: bool = False):
     """
     Initializes a new instance of the TripleTap perk.
+
+    Parameters:
+    - enhanced (bool): Indicates whether this perk is in its enhanced state. Default is False.
     """
+    super().__init__(enhanced)
     self.counter = 0
     self.procs = 0
 
@@ -35,13 +57,18 @@ class TripleTap(Perk):
     Increment internal counter and check if the perk should proc.
     This method is called when a shot is fired from the weapon.
     """
+    # Anything but a precision hit breaks the chain
+    if not weapon.precision_hit:
+      self.counter = 0
+      return
+
     # Increment the counter for each hit
     self.counter += 1
     
     # Proc the perk if the counter reaches 3 and reset the counter
-    if self.counter == 3:
+    if self.counter == self.trigger_count:
       # Refund one round to the magazine and reset the counter
-      weapon.magazine += 1
+      weapon.magazine += self.refund_amount
       self.counter = 0
 
       # Record the proc
@@ -54,20 +81,29 @@ class TripleTap(Perk):
     self.counter = 0
     self.procs = 0
 
-  def report(self):
+  def state(self):
     """
-    Reports the current state of the TripleTap perk.
-    This method prints out the number of times the perk has procced, and returns an object containing the report.
+    Returns an object containing the current state of the TripleTap perk without printing anything.
     """
-    print("Triple Tap Procs: " + str(self.procs))
-    print("Triple Tap Ammo Refunded: " + str(self.procs))
-    print("Triple Tap Counter: " + str(self.counter))
-
-    report = {
+    state = {
       "procs": self.procs,  # Number of times the perk has triggered
       "counter": self.counter,  # Current counter for precision hits
-      "refunded": self.procs  # Number of rounds refunded (same as procs since each proc refunds one round)
+      "refunded": self.procs * self.refund_amount  # Number of rounds refunded (same as procs since each proc refunds one round)
     }
 
+    return state
+
+  def report(self, sink=None):
+    """
+    Reports the current state of the TripleTap perk.
+    This method shows the number of times the perk has procced on the sink (or the current sink), and returns an object containing the report.
+    """
+    report = self.state()
+    sink = sink or current_sink()
+
+    sink.message("Triple Tap Procs: " + str(report["procs"]))
+    sink.message("Triple Tap Ammo Refunded: " + str(report["refunded"]))
+    sink.message("Triple Tap Counter: " + str(report["counter"]))
+
     return report
 
@@ -0,0 +1,494 @@
+"""
+ReloadPlanner finds when to reload during a damage phase to get the most shots out of it.
+
+FiringRange and DpsPhase only reload once the magazine is empty, but that isn't always best. A reload resets
+RewindRounds' counter, reloading a few rounds early can leave enough time for another magazine before the phase ends,
+and perks that refund from thin air keep a magazine going for longer the more of it is fired. The timing is DpsPhase's:
+- Shots are fired at the weapon's fire rate, and a shot only counts if it is fired before the phase ends.
+- A reload starts as the last shot is fired and takes the given reload time, the next shot is fired as it finishes
+  (or once the fire rate allows it, if the reload is quicker than that).
+- TripleTap and FourthTimesTheCharm lose their counter when the gap to the next hit is longer than their window.
+The perks themselves are the shot by shot simulation's, so RewindRounds' inactive second is its disabled shots.
+
+Between two reloads there is nothing to decide: the weapon fires until it is empty or the phase ends. So a schedule is
+only the number of shots fired before each reload, and from a reload on, the shots still to come only depend on the
+weapon's state (its magazine, reserves and perk counters, but not its totals) and the time left. The planner works
+these out once per (state, time left) and reuses them, the same memoization as WhatIf.explore but keyed on the compact
+state, so schedules that reach the same state at the same time share their whole future. What a magazine does from a
+state doesn't depend on the time at all, so each distinct state is only fired once, recording the state a reload would
+leave after each shot.
+
+Most reloads are never searched: the latest are tried first, and a reload is skipped when the shots that fit in the time
+left, or the most shots the weapon could fire from there with no time limit, can't beat the best so far. Reserves that
+reloads can't use up before the phase ends don't tell states apart either.
+
+Times are kept as whole ticks (the fire rate, reload time and phase length all divide into them exactly), so states at
+the same time always hash the same.
+
+  python reloadPlanner.py --magazine 40 --reserves 400 --fire-rate 900 --perks RewindRounds+ TripleTap --reload-time 2.1
+"""
+
+import argparse
+import math
+import sys
+import time
+from fractions import Fraction
+from operator import itemgetter
+
+from weapon import Weapon
+from weaponConfig import WeaponConfig
+from dpsPhase import DpsPhase
+from resultSink import SINKS, ResultSink, use_sink
+from headless import parse_perk
+
+class ReloadPlanner():
+  """
+  Plans the reloads of a weapon over a damage phase.
+
+  Attributes:
+  - weapon (Weapon): The weapon. It is back in the state it was given in after every method.
+  - root (tuple): The snapshot the phase starts from.
+  - unit (Fraction): The length of a tick in seconds.
+  - interval (int): The ticks between two shots.
+  - reload_ticks (int): The ticks a reload takes.
+  - duration (int): The ticks in the phase.
+  - shot_lapses (list): The perks whose window is shorter than the gap between shots.
+  - reload_lapses (list): The perks whose window is shorter than a reload.
+  - bounded (bool): Whether the weapon is sure to run dry, so the most shots from each state are limited (see most).
+  - reloads_draw (bool): Whether reloads are the only thing that takes rounds from the weapon's finite reserves.
+  - key: Returns the key of the state in a snapshot: the magazine, reserves and every perk's counters. Totals like the
+    shots fired are left out, they don't change what the weapon does next.
+  - most_shots (dict): The most shots from each state without a time limit, by state.
+  - runs (dict): What firing from each state does, by state (see _run).
+  - fired (int): The shots and reloads applied to the weapon while planning.
+  """
+  def __init__(self, weapon: Weapon, duration: float, reload_time: float):
+    """
+    Initializes a new instance of the ReloadPlanner class, starting the phase from the weapon's current state.
+
+    Parameters:
+    - weapon (Weapon): The weapon. Its fire rate is in rounds per minute and must be above 0.
+    - duration (float): The length of the damage phase in seconds.
+    - reload_time (float): The time a reload takes in seconds, above 0.
+    """
+    if weapon.fire_rate <= 0:
+      raise ValueError("The weapon needs a fire rate above 0 to be simulated over time.")
+    if reload_time <= 0:
+      raise ValueError("The reload time must be above 0.")
+
+    self.weapon = weapon
+    self.root = weapon.snapshot()
+
+    # str() keeps the decimal the user typed, 0.1 instead of its nearest binary fraction
+    interval = Fraction(60, weapon.fire_rate)
+    reload_time = Fraction(str(reload_time))
+    duration = Fraction(str(duration))
+
+    windows = []
+    for perk in weapon.perks:
+      window = perk.enhanced_hit_window if perk.enhanced else perk.hit_window
+      if "shot" in perk.events and window is not None:
+        windows.append((perk, Fraction(str(window))))
+
+    self.unit = Fraction(1, math.lcm(interval.denominator, reload_time.denominator, duration.denominator))
+    self.interval = int(interval / self.unit)
+    self.reload_ticks = int(reload_time / self.unit)
+    self.duration = int(duration / self.unit)
+
+    # A hit landing exactly as a window closes still counts, like in DpsPhase
+    self.shot_lapses = [perk for perk, window in windows if interval > window]
+    self.reload_lapses = [perk for perk, window in windows if reload_time > window]
+
+    # Without the time limit, the most shots a weapon can fire from a state only depend on the state. They are worked
+    # out when the weapon is sure to run dry: its reserves are finite, and the perks refunding from thin air refund
+    # fewer rounds than the shots it takes (so no state comes round again)
+    self.bounded = weapon.reserves_size != -1
+    ratio = 0
+    for perk in weapon.perks:
+      if "shot" not in perk.events or perk.refunds_from_reserves:
+        continue
+      if getattr(perk, "trigger_count", None) is None:
+        self.bounded = False
+        break
+      ratio += perk.refund_amount / perk.trigger_count
+    if ratio >= 1:
+      self.bounded = False
+
+    self.reloads_draw = weapon.reserves_size != -1
+    for perk in weapon.perks:
+      if "shot" in perk.events and perk.refunds_from_reserves:
+        self.reloads_draw = False
+
+    # A snapshot starts with the magazine, reserves, shots fired and reloads, then each perk's counters and totals
+    fields = [0, 1]
+    index = 4
+    for perk, names in weapon.perk_fields:
+      fields.extend(index + offset for offset in range(len(perk.counter_fields)))
+      index += len(names)
+    self.key = itemgetter(*fields)
+
+    self.runs = {}
+    self.most_shots = {}
+    self.fired = 0
+
+  def fits(self, remaining: int):
+    """
+    Returns the number of shots that can be fired in `remaining` ticks, the first one right away.
+    """
+    return max(0, -(-remaining // self.interval))
+
+  def offset(self, shots: int):
+    """
+    Returns the ticks from the first of `shots` shots until the next shot after a reload started after them. The reload
+    starts as the last of them is fired, and the next shot waits for the fire rate as well as the reload.
+    """
+    if shots == 0:
+      return self.reload_ticks
+
+    return (shots - 1) * self.interval + max(self.reload_ticks, self.interval)
+
+  def most(self, key: tuple, snapshot: tuple):
+    """
+    Returns the most shots the weapon could fire from a state with the given key however it is reloaded, if there was
+    no time limit. None if the weapon isn't sure to run dry.
+
+    Parameters:
+    - key (tuple): The key of the state.
+    - snapshot (tuple): A snapshot of the state, to fire from if it hasn't been fired from yet.
+    """
+    if not self.bounded:
+      return None
+
+    most = self.most_shots.get(key)
+    if most is not None:
+      return most
+
+    if key not in self.runs:
+      self.weapon.restore(snapshot)
+    length, reloads = self._run(key)
+
+    most = length
+    for shots, offset, child, child_snapshot in reloads:
+      most = max(most, shots + self.most(child, child_snapshot))
+
+    self.most_shots[key] = most
+    return most
+
+  def situation(self, key: tuple, remaining: int):
+    """
+    Returns the key of a state with `remaining` ticks left for the planner to remember it by. When only reloads take
+    rounds from reserves, each takes at most a magazine, so reserves beyond a magazine for every reload that fits in the
+    time make no difference and are left out.
+    """
+    if self.reloads_draw and key[1] > self.weapon.magazine_size * (remaining // self.reload_ticks + 1):
+      key = (key[0], self.weapon.magazine_size * (remaining // self.reload_ticks + 1)) + key[2:]
+
+    return key, remaining
+
+  def shoot(self, shots: int):
+    """
+    Fires a round, after `shots` rounds since the last reload. Returns False if the magazine is empty.
+    """
+    if self.weapon.magazine == 0:
+      return False
+
+    # The first shot after a reload had its gap applied by the reload
+    if shots > 0:
+      for perk in self.shot_lapses:
+        perk.counter = 0
+
+    self.fired += 1
+    return self.weapon.shoot()
+
+  def reload(self):
+    """
+    Reloads the weapon. Returns False if the magazine is full or there is nothing to reload from.
+    """
+    if self.weapon.magazine >= self.weapon.magazine_size:
+      return False
+
+    for perk in self.reload_lapses:
+      perk.counter = 0
+
+    self.fired += 1
+    return DpsPhase.reload(self.weapon)
+
+  def _run(self, key: tuple):
+    """
+    Fires the weapon from its current state, which has the given key, until it is empty or nothing more would fit in
+    the phase. Returns and remembers the shots fired, and a (shots, ticks, key, snapshot) entry for each number of
+    shots it can be reloaded after: the ticks from the first shot until that reload is done, and the state it leaves.
+    """
+    run = self.runs.get(key)
+    if run is not None:
+      return run
+
+    weapon = self.weapon
+    limit = self.fits(self.duration)
+    reloads = []
+    shots = 0
+
+    while True:
+      if weapon.magazine < weapon.magazine_size:
+        snapshot = weapon.snapshot()
+        if self.reload():
+          child = weapon.snapshot()
+          reloads.append((shots, self.offset(shots), self.key(child), child))
+        weapon.restore(snapshot)
+
+      if shots == limit or not self.shoot(shots):
+        break
+      shots += 1
+
+    run = (shots, reloads)
+    self.runs[key] = run
+
+    return run
+
+  def plan(self, count: bool = False):
+    """
+    Finds the reload schedule that fires the most shots during the phase. Ties go to not reloading, then to later reloads.
+
+    Returns a dictionary with the shots fired, the shots fired reloading only when the magazine is empty, the reloads
+    (the time each starts, the shots fired before it and the rounds left in the magazine), the weapon's state at the
+    end, the distinct (state, time left) pairs searched and the shots and reloads applied while planning.
+
+    With `count`, every reload is searched instead of skipping the ones that can't beat the best found so far, and the
+    result also has the number of schedules there are, the shots and reloads a brute force search through all of them
+    applies (see brute_force), and the speedup over it.
+
+    Parameters:
+    - count (bool): Whether to count the work a brute force search does (default is False).
+    """
+    weapon = self.weapon
+    # The best number of shots from each situation (see situation), the shots before the next reload (None to never
+    # reload), and with `count` the number of schedules from there and the shots and reloads brute force applies
+
+    memo = {}
+    # The time a reload takes away from firing
+    extra = self.offset(1) - self.interval
+
+    def best(key, snapshot, remaining):
+      situation = self.situation(key, remaining)
+      known = memo.get(situation)
+      if known is not None:
+        return known
+
+      if key not in self.runs:
+        weapon.restore(snapshot)
+      length, reloads = self._run(key)
+
+      value = min(length, self.fits(remaining))
+      choice = None
+      schedules = 1
+      applied = value
+      # However many shots come before a reload, the shots that fit in the time around it add up to the same number
+      fits = self.fits(remaining - extra)
+
+      # Latest reloads first, they are usually the best and let the bounds skip the rest. Reloads that leave no time for
+      # another shot are never worth it
+      for shots, offset, child, child_snapshot in reversed(reloads):
+        if not count and fits <= value:
+          break
+        left = remaining - offset
+        if left <= 0:
+          continue
+
+        result = memo.get(self.situation(child, left))
+        if result is None:
+          if not count and self.bounded and shots + self.most(child, child_snapshot) <= value:
+            continue
+          result = best(child, child_snapshot, left)
+
+        if count:
+          schedules += result[2]
+          applied += 1 + result[3]
+        if shots + result[0] > value:
+          value = shots + result[0]
+          choice = shots
+
+      result = (value, choice, schedules, applied)
+      memo[situation] = result
+      return result
+
+    # Each reload is a level of recursion. Every reload takes at least one tick, and without the time limit every
+    # reload but the first needs a round fired
+    limit = sys.getrecursionlimit()
+    depth = self.duration // self.reload_ticks + (weapon.magazine + weapon.reserves if self.bounded else 0)
+    sys.setrecursionlimit(max(limit, 2 * depth + 100))
+    self.fired = 0
+    try:
+      weapon.restore(self.root)
+      with use_sink(ResultSink()):
+        root = self.key(self.root)
+        value, choice, schedules, applied = best(root, self.root, self.duration)
+
+        # Follow the best choice from each state to recover the schedule
+        schedule = []
+        key, remaining = root, self.duration
+        while True:
+          choice = memo[self.situation(key, remaining)][1]
+          if choice is None:
+            break
+          schedule.append(choice)
+          shots, offset, key, snapshot = next(entry for entry in self.runs[key][1] if entry[0] == choice)
+          remaining -= offset
+
+        fired = self.fired
+        baseline = self.replay(None)[0]
+        shots, reloads, state = self.replay(schedule)
+    finally:
+      sys.setrecursionlimit(limit)
+      weapon.restore(self.root)
+
+    result = {
+      "duration": float(self.duration * self.unit),
+      "shots_fired": shots,
+      "empty_reload_shots": baseline,
+      "reloads": reloads,
+      "state": state,
+      "states": len(memo),
+      "applied": fired,
+    }
+    if count:
+      result["schedules"] = schedules
+      result["brute_force_applied"] = applied
+      result["speedup"] = applied / max(fired, 1)
+
+    return result
+
+  def replay(self, schedule: list):
+    """
+    Plays out a schedule from the start of the phase shot by shot. Returns the shots fired, the reloads as
+    dictionaries, and the weapon's state at the end. The weapon is put back in the root state afterwards.
+
+    Parameters:
+    - schedule (list): The shots fired before each reload, or None to reload only when the magazine is empty.
+    """
+    weapon = self.weapon
+    weapon.restore(self.root)
+    plan = iter(schedule or ())
+    reloads = []
+    remaining = self.duration
+    shots_fired = 0
+
+    with use_sink(ResultSink()):
+      while True:
+        target = None if schedule is None else next(plan, None)
+        shots = 0
+        while shots < self.fits(remaining) and (target is None or shots < target) and self.shoot(shots):
+          shots += 1
+        shots_fired += shots
+
+        # Without a schedule only an empty magazine is reloaded, with one the schedule says when
+        if (weapon.magazine > 0) if schedule is None else (target is None):
+          break
+
+        left = remaining - self.offset(shots)
+        if left <= 0:
+          break
+        reloads.append({
+          "time": float((self.duration - remaining + max(shots - 1, 0) * self.interval) * self.unit),
+          "shot": shots_fired,
+          "magazine": weapon.magazine,
+        })
+        if not self.reload():
+          reloads.pop()
+          break
+        remaining = left
+
+    state = weapon.state()
+    weapon.restore(self.root)
+
+    return shots_fired, reloads, state
+
+  def brute_force(self):
+    """
+    Tries every reload schedule shot by shot, without remembering anything, and returns the most shots fired and the
+    number of shots and reloads it applied. Only feasible for short phases, it is here to check and time plan against.
+    """
+    weapon = self.weapon
+
+    def search(shots, remaining):
+      best = 0
+      applied = 0
+      while True:
+        left = remaining - self.offset(shots)
+        if left > 0:
+          snapshot = weapon.snapshot()
+          if self.reload():
+            value, tried = search(0, left)
+            applied += 1 + tried
+            best = max(best, shots + value)
+          weapon.restore(snapshot)
+
+        if shots >= self.fits(remaining) or not self.shoot(shots):
+          return max(best, shots), applied + shots
+        shots += 1
+
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, self.duration // max(self.reload_ticks, 1) + 100))
+    try:
+      weapon.restore(self.root)
+      with use_sink(ResultSink()):
+        return search(0, self.duration)
+    finally:
+      sys.setrecursionlimit(limit)
+      weapon.restore(self.root)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Find the reload schedule that fires the most shots in a damage phase.")
+  parser.add_argument("--magazine", type=int, required=True, help="magazine size")
+  parser.add_argument("--reserves", type=int, default=-1, help="reserves size (default is -1, infinite)")
+  parser.add_argument("--fire-rate", type=int, required=True, help="fire rate in rounds per minute")
+  parser.add_argument("--perks", nargs="*", default=[], help="perk names, with a '+' after enhanced perks")
+  parser.add_argument("--duration", type=float, default=60.0, help="length of the damage phase in seconds (default is 60)")
+  parser.add_argument("--reload-time", type=float, default=2.0, help="seconds a reload takes (default is 2)")
+  parser.add_argument("--count", action="store_true", help="search every reload and count the work brute force would do")
+  parser.add_argument("--brute-force", action="store_true", help="also time a search through every schedule (short phases only)")
+  parser.add_argument("--sink", choices=list(SINKS), default="text", help="how to write the result (default is text)")
+  args = parser.parse_args(argv)
+
+  try:
+    perks = tuple(parse_perk(perk) for perk in args.perks)
+  except ValueError as error:
+    parser.error(str(error))
+  if args.magazine < 1:
+    parser.error("--magazine must be at least 1")
+  if args.fire_rate < 1:
+    parser.error("--fire-rate must be at least 1")
+  if args.reload_time <= 0:
+    parser.error("--reload-time must be above 0")
+
+  planner = ReloadPlanner(WeaponConfig(args.magazine, args.reserves, args.fire_rate, perks).build(), args.duration, args.reload_time)
+  start = time.perf_counter()
+  result = planner.plan(args.count)
+  result["seconds"] = time.perf_counter() - start
+
+  sink = SINKS[args.sink]()
+  sink.message(f"\nBest reload schedule for a {args.duration:g} second phase: {result['shots_fired']} shots "
+               f"({result['empty_reload_shots']} reloading only when empty)")
+  for reload in result["reloads"]:
+    sink.message(f"  Reload at {reload['time']:.2f}s after shot {reload['shot']}, {reload['magazine']} rounds left")
+  sink.message(f"{result['states']} states searched in {result['seconds']:.3f}s, {result['applied']} shots and reloads applied")
+  if args.count:
+    sink.message(f"Out of {result['schedules']} schedules, brute force would apply {result['brute_force_applied']} shots and "
+                 f"reloads, {result['speedup']:.1f}x more")
+
+  if args.brute_force:
+    start = time.perf_counter()
+    best, applied = planner.brute_force()
+    result["brute_force_seconds"] = time.perf_counter() - start
+    sink.message(f"Brute force: {best} shots in {result['brute_force_seconds']:.3f}s, "
+                 f"{result['brute_force_seconds'] / result['seconds']:.1f}x slower")
+
+  sink.message("")
+  sink.result(result)
+  sink.close()
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+ResultCache memoizes the results of the magazine and all ammo tests by weapon configuration.
+
+Results are stored under a canonical key, so configurations that can't give different results share one entry:
+- Perks that don't read the weapon's state (TripleTap, FourthTimesTheCharm, no perk) are sorted, since the order they
+  are applied in can't change anything. Once RewindRounds shares the weapon with another perk, the order is kept.
+- The enhanced flag is dropped for perks whose enhanced version refunds the same ammo.
+- The fire rate is dropped unless a perk uses it.
+The reports of two configurations with the same key are equal, so a cached report can be returned for either.
+
+The cache keeps a bounded number of recent results in memory, least recently used first out, and can optionally keep
+every result in an SQLite database so they survive between runs. Every key includes the versions of its perks, so a
+result is only ever returned for the perk versions it was simulated with. The database remembers the version of each
+perk it has stored results for, and when one changes only the results with that perk are thrown out. Registering a new
+perk (see perkSpec.register) leaves every stored result in place.
+"""
+
+import json
+import sqlite3
+from collections import OrderedDict
+
+from weaponConfig import WeaponConfig
+from magazineEngine import TESTS, run_test
+from perks import PERK_TYPES
+from perk import Perk
+
+# Bump this whenever the format of the stored results changes.
+CACHE_FORMAT = 1
+
+
+def canonical_key(config: WeaponConfig, test: str):
+  """
+  Returns the canonical cache key for running a test on a weapon configuration.
+
+  Parameters:
+  - config (WeaponConfig): The configuration of the weapon.
+  - test (str): The test being run, "magazine" or "all_ammo".
+  """
+  perk_types = [PERK_TYPES[name] for name, enhanced in config.perks]
+
+  # Drop the enhanced flag where it can't change the results
+  perks = [(name, enhanced and perk_type.enhanced_affects_ammo, perk_type.version)
+           for (name, enhanced), perk_type in zip(config.perks, perk_types)]
+
+  # The order of the perks only matters when a perk that reads the weapon's state shares it with another real perk
+  active_perks = [perk_type for perk_type in perk_types if perk_type is not Perk]
+  if len(active_perks) <= 1 or not any(perk_type.reads_weapon for perk_type in active_perks):
+    perks.sort()
+
+  fire_rate = config.fire_rate if any(perk_type.uses_fire_rate for perk_type in perk_types) else 0
+
+  return json.dumps([test, config.magazine_size, config.reserves_size, fire_rate, perks])
+
+
+def perk_versions(names):
+  """
+  Returns a signature of the cache format and the versions of the named perks, used to invalidate stored results.
+  Perks that aren't registered get a version of None, so registering one later changes the signature too.
+
+  Parameters:
+  - names (iterable): The names of the perks the results depend on.
+  """
+  versions = {name: getattr(PERK_TYPES.get(name), "version", None) for name in sorted(set(names))}
+  return json.dumps([CACHE_FORMAT, versions])
+
+
+class ResultCache():
+  """
+  A cache of test results keyed on canonical weapon configurations.
+
+  Attributes:
+  - max_entries (int): The largest number of results kept in memory.
+  - entries (OrderedDict): The results in memory, as JSON text, from least to most recently used.
+  - connection (sqlite3.Connection): The connection to the database of stored results, or None without one.
+  - hits (int): The number of results returned from the cache.
+  - misses (int): The number of results that had to be simulated.
+  """
+  def __init__(self, max_entries: int = 4096, path: str = None):
+    """
+    Initializes a new instance of the ResultCache class.
+
+    Parameters:
+    - max_entries (int): The largest number of results kept in memory (default is 4096).
+    - path (str): The path of an SQLite database to store results in between runs (default is None, memory only).
+    """
+    self.max_entries = max_entries
+    self.entries = OrderedDict()
+    self.connection = None
+    self.hits = 0
+    self.misses = 0
+
+    if path is not None:
+      self.connection = sqlite3.connect(path)
+      self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+      self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT)")
+
+      # Throw out every stored result if the format has changed since they were stored
+      row = self.connection.execute("SELECT value FROM meta WHERE name = 'format'").fetchone()
+      if row is None or row[0] != str(CACHE_FORMAT):
+        self.connection.execute("DELETE FROM results")
+        self.connection.execute("DELETE FROM meta")
+        self.connection.execute("INSERT INTO meta VALUES ('format', ?)", (str(CACHE_FORMAT),))
+
+      # Throw out the results of the registered perks whose version has changed, keys mention perks as [name, ...]
+      row = self.connection.execute("SELECT value FROM meta WHERE name = 'versions'").fetchone()
+      versions = json.loads(row[0]) if row is not None else {}
+      for name, perk_type in PERK_TYPES.items():
+        if name in versions and versions[name] != perk_type.version:
+          self.connection.execute("DELETE FROM results WHERE instr(key, ?) > 0", ("[" + json.dumps(name) + ", ",))
+        versions[name] = perk_type.version
+      self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('versions', ?)", (json.dumps(versions),))
+
+      self.connection.commit()
+
+  def get(self, config: WeaponConfig, test: str):
+    """
+    Returns the cached report for running a test on a configuration, or None if it isn't cached.
+
+    Parameters:
+    - config (WeaponConfig): The configuration of the weapon.
+    - test (str): The test, "magazine" or "all_ammo".
+    """
+    key = canonical_key(config, test)
+    result = self.entries.get(key)
+
+    if result is not None:
+      self.entries.move_to_end(key)
+    elif self.connection is not None:
+      row = self.connection.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+      if row is not None:
+        result = row[0]
+        self._remember(key, result)
+
+    if result is None:
+      return None
+
+    return json.loads(result)
+
+  def put(self, config: WeaponConfig, test: str, report: dict):
+    """
+    Stores the report for running a test on a configuration.
+    Results are written to the database on the next flush.
+
+    Parameters:
+    - config (WeaponConfig): The configuration of the weapon.
+    - test (str): The test, "magazine" or "all_ammo".
+    - report (dict): The report of the weapon after the test, as returned by Weapon.state().
+    """
+    key = canonical_key(config, test)
+    result = json.dumps(report)
+    self._remember(key, result)
+
+    if self.connection is not None:
+      self.connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?)", (key, result))
+
+  def run(self, config: WeaponConfig, test: str):
+    """
+    Returns the report for running a test on a configuration, simulating it only if it isn't cached.
+
+    Parameters:
+    - config (WeaponConfig): The configuration of the weapon.
+    - test (str): The test, "magazine" or "all_ammo".
+    """
+    if test not in TESTS:
+      raise ValueError(f"Unknown test '{test}'. Expected one of: {', '.join(TESTS)}")
+
+    report = self.get(config, test)
+    if report is not None:
+      self.hits += 1
+      return report
+
+    self.misses += 1
+    weapon = config.build()
+    run_test(weapon, test)
+    report = weapon.state()
+    self.put(config, test, report)
+    self.flush()
+
+    return report
+
+  def mag_test(self, config: WeaponConfig):
+    """
+    Returns the report of the magazine test for a configuration.
+    """
+    return self.run(config, "magazine")
+
+  def all_ammo_test(self, config: WeaponConfig):
+    """
+    Returns the report of the all ammo test for a configuration.
+    """
+    return self.run(config, "all_ammo")
+
+  def clear(self):
+    """
+    Removes every result from memory and from the database.
+    """
+    self.entries.clear()
+
+    if self.connection is not None:
+      self.connection.execute("DELETE FROM results")
+      self.connection.commit()
+
+  def flush(self):
+    """
+    Writes any stored results to the database, if there is one.
+    """
+    if self.connection is not None:
+      self.connection.commit()
+
+  def close(self):
+    """
+    Writes any stored results and closes the database, if there is one.
+    """
+    if self.connection is not None:
+      self.connection.commit()
+      self.connection.close()
+      self.connection = None
+
+  def _remember(self, key: str, result: str):
+    """
+    Keeps a result in memory, dropping the least recently used result if the cache is full.
+    """
+    self.entries[key] = result
+    self.entries.move_to_end(key)
+
+    while len(self.entries) > self.max_entries:
+      self.entries.popitem(last=False)
@@ -0,0 +1,198 @@
+"""
+Result sinks decide where the output of the tests goes.
+
+Everything that used to print (Weapon.report, the perks' reports, FiringRange and RewindRounds on each proc) writes to a
+sink instead. A sink takes two kinds of output:
+- Messages, the human readable lines the interactive calculator has always printed.
+- Results, one dictionary per finished test, for anything that wants to read the results back.
+
+Each sink keeps the output it is made for and drops the rest:
+- ResultSink drops everything, for runs that only want the returned values.
+- TextSink prints messages and drops results, which is what main.py has always shown.
+- JsonSink writes every result as one line of JSON and drops messages.
+- CsvSink writes every result as a row of CSV and drops messages.
+
+Code in a hot loop checks `sink.verbose` before building a message, so a sink that drops messages never pays for the
+string formatting. Code that isn't handed a sink uses the current sink, which is a TextSink on stdout unless changed
+with use_sink.
+"""
+
+import contextlib
+import csv
+import json
+import sys
+
+class ResultSink():
+  """
+  A sink that drops all output. Also the parent class of the other sinks.
+
+  Attributes:
+  - stream: The file the sink writes to, or None to write to whatever sys.stdout is at the time.
+  """
+  # Whether the sink shows messages. Messages are only worth formatting when this is True.
+  verbose = False
+
+  def __init__(self, stream=None):
+    """
+    Initializes a new instance of the sink.
+
+    Parameters:
+    - stream: The file to write to (default is None, sys.stdout).
+    """
+    self.stream = stream
+
+  def message(self, text: str):
+    """
+    Shows a human readable line of output.
+    """
+    pass
+
+  def result(self, record: dict):
+    """
+    Records the result of a finished test.
+    """
+    pass
+
+  def close(self):
+    """
+    Finishes writing any output.
+    """
+    pass
+
+
+class TextSink(ResultSink):
+  """
+  A sink that prints messages, the same as the interactive calculator.
+  """
+  verbose = True
+
+  def message(self, text: str):
+    print(text, file=self.stream)
+
+
+class JsonSink(ResultSink):
+  """
+  A sink that writes each result as one line of JSON.
+  """
+  def result(self, record: dict):
+    stream = self.stream if self.stream is not None else sys.stdout
+    stream.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+  def close(self):
+    stream = self.stream if self.stream is not None else sys.stdout
+    stream.flush()
+
+
+class CsvSink(ResultSink):
+  """
+  A sink that writes each result as a row of CSV. Nested dictionaries are flattened into columns named with dots
+  (like "state.reserves"), and lists are written as JSON.
+
+  Perks are written by slot rather than by name, the same as batchSweep.SweepTable, so weapons with different perks
+  share one header: "state.perk0_name", "state.perk0_procs" and so on for each of PERK_COLUMNS. The header is taken from
+  the first result, with at least `perk_slots` slots, and a later result with a column that isn't in it raises a
+  ValueError instead of losing the value.
+
+  Attributes:
+  - perk_slots (int): The fewest perk slots the header has columns for.
+  - writer (csv.DictWriter): The writer for the rows, created with the header on the first result.
+  """
+  def __init__(self, stream=None, perk_slots: int = 4):
+    super().__init__(stream)
+    self.perk_slots = perk_slots
+    self.writer = None
+
+  def result(self, record: dict):
+    row = flatten(record, perk_slots=self.perk_slots)
+
+    if self.writer is None:
+      stream = self.stream if self.stream is not None else sys.stdout
+      self.writer = csv.DictWriter(stream, fieldnames=list(row), restval="", lineterminator="\n")
+      self.writer.writeheader()
+
+    unknown = [name for name in row if name not in self.writer.fieldnames]
+    if unknown:
+      raise ValueError(f"The result has columns that aren't in the CSV header: {', '.join(unknown)}. "
+                       f"Results with more than {self.perk_slots} perks need a CsvSink with more perk_slots.")
+
+    self.writer.writerow(row)
+
+  def close(self):
+    stream = self.stream if self.stream is not None else sys.stdout
+    stream.flush()
+
+
+# Sinks by the names used on the command line, see headless.py.
+SINKS = {
+  "silent": ResultSink,
+  "text": TextSink,
+  "json": JsonSink,
+  "csv": CsvSink,
+}
+
+
+# The columns of each perk slot in a CSV row, the name of the perk followed by the fields of Perk.state().
+PERK_COLUMNS = ("name", "procs", "refunded", "counter", "disabled_shots")
+
+
+def flatten(record: dict, prefix: str = "", perk_slots: int = None):
+  """
+  Returns a flat dictionary with a dotted key for every value inside the nested dictionary.
+  Lists are turned into JSON and None into an empty string.
+
+  Parameters:
+  - record (dict): The dictionary to flatten.
+  - prefix (str): The start of every key (default is none).
+  - perk_slots (int): If given, a "perks" dictionary of perk states (see Weapon.state) is written as PERK_COLUMNS for
+    each perk slot, like "perk0_procs", with at least this many slots, instead of by perk name (default is None).
+  """
+  flat = {}
+
+  for key, value in record.items():
+    name = prefix + str(key)
+    if perk_slots is not None and key == "perks" and isinstance(value, dict):
+      perks = list(value.items())
+      perks += [("", None)] * (perk_slots - len(perks))
+      for slot, (perk_name, perk_state) in enumerate(perks):
+        fields = {"name": perk_name, **(perk_state or {})}
+        for field in fields:
+          if field not in PERK_COLUMNS:
+            raise ValueError(f"The {perk_name} state has a field '{field}' with no CSV column.")
+        for field in PERK_COLUMNS:
+          flat[f"{prefix}perk{slot}_{field}"] = fields.get(field, "")
+    elif isinstance(value, dict):
+      flat.update(flatten(value, name + ".", perk_slots))
+    elif isinstance(value, (list, tuple)):
+      flat[name] = json.dumps(value)
+    else:
+      flat[name] = "" if value is None else value
+
+  return flat
+
+
+_current = TextSink()
+
+
+def current_sink():
+  """
+  Returns the sink output goes to when no sink is given.
+  """
+  return _current
+
+
+@contextlib.contextmanager
+def use_sink(sink: ResultSink):
+  """
+  Sends all output without a sink of its own to the given sink inside a `with` block.
+
+  Parameters:
+  - sink (ResultSink): The sink to use.
+  """
+  global _current
+  previous = _current
+  _current = sink
+
+  try:
+    yield sink
+  finally:
+    _current = previous
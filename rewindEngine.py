@@ -0,0 +1,181 @@
+"""
+RewindEngine empties a weapon with RewindRounds on it without firing every round, so the work grows with the number of
+times RewindRounds procs instead of the number of shots.
+
+Between two procs RewindRounds only counts hits, and the only other perks it is paired with here are fixed-ratio refund
+perks (TripleTap, FourthTimesTheCharm, or any perk with `trigger_count` and `refund_amount`), whose refunds only depend on
+the number of shots. So the magazine after s more shots is known without firing them, the same way MagazineEngine works
+it out. RewindRounds only does anything on a shot where it sees an empty magazine, which is:
+
+  level(s) = magazine - s + sum of refund_amount * floor((counter + s - later) / trigger_count)
+
+where `later` is 1 for a perk applied after RewindRounds (its refund on shot s comes after RewindRounds has looked) and 0
+for one applied before it. The level only ever drops by one per shot, so the first s where it reaches 0 is found by
+checking one period of the refunds, lcm(trigger counts) offsets, and skipping whole periods, like
+MagazineEngine.shots_until_empty.
+
+The s - 1 shots before that are applied at once: the fixed-ratio perks advance their counters, and RewindRounds uses up
+its disabled shots and counts the rest as hits. Shot s is then fired with Weapon.shoot, so whatever happens on it (a proc
+of ceil(counter * percentage) rounds from reserves capped at the magazine size, a missed threshold, a later perk's
+refund, or the magazine running dry) is the simulator's own code, and its messages are shown the same. Each proc is
+one step of the recurrence: the magazine it refills and the counter it resets decide where the next one lands.
+
+A weapon can keep going forever, proccing from infinite reserves or kept topped up by perks applied after RewindRounds.
+Its state at each step (the magazine, every perk's counters and the reserves) is fingerprinted, and a repeat means it
+never empties.
+
+Weapons with more than one RewindRounds, or any other perk that isn't a fixed-ratio refund perk, are left to the
+simulator: RewindEngine.fire_magazine returns None for them without touching the weapon.
+"""
+
+import math
+
+from weapon import Weapon
+from perk import Perk
+from perks import RewindRounds
+
+class RewindEngine():
+  """
+  A class that holds the methods for emptying weapons with RewindRounds on them one proc at a time.
+  """
+
+  def plan(weapon: Weapon):
+    """
+    Returns the weapon's RewindRounds and its fixed-ratio refund perks as (perk, later) pairs, where `later` is 1 for
+    perks applied after RewindRounds and 0 for perks applied before it. Returns None if the engine can't fire the weapon.
+
+    Parameters:
+    - weapon (Weapon): The weapon to check.
+    """
+    rewind = None
+    fixed = []
+
+    for perk in weapon.perks:
+      # Placeholder perks do nothing when fired or reloaded
+      if perk.__class__ is Perk:
+        continue
+
+      if perk.__class__ is RewindRounds:
+        if rewind is not None:
+          return None
+        rewind = perk
+        continue
+
+      if getattr(perk, "trigger_count", None) is None:
+        return None
+
+      fixed.append((perk, 0 if rewind is None else 1))
+
+    if rewind is None:
+      return None
+
+    return rewind, fixed
+
+  def shots_until_check(magazine: int, fixed: list):
+    """
+    Returns the number of shots until RewindRounds sees an empty magazine, or None if it never does.
+
+    Parameters:
+    - magazine (int): The number of rounds currently in the magazine.
+    - fixed (list): The fixed-ratio refund perks on the weapon as (perk, later) pairs, with their current counters.
+    """
+    period = 1
+    for perk, later in fixed:
+      period = math.lcm(period, perk.trigger_count)
+
+    period_drain = period - sum(perk.refund_amount * (period // perk.trigger_count) for perk, later in fixed)
+
+    shots = None
+    for offset in range(1, period + 1):
+      # The magazine when RewindRounds looks at it on this shot
+      level = magazine - offset
+      for perk, later in fixed:
+        level += perk.refund_amount * ((perk.counter + offset - later) // perk.trigger_count)
+
+      if level <= 0:
+        candidate = offset
+      elif period_drain > 0:
+        candidate = math.ceil(level / period_drain) * period + offset
+      else:
+        continue
+
+      if shots is None or candidate < shots:
+        shots = candidate
+
+    return shots
+
+  def advance(weapon: Weapon, rewind: RewindRounds, fixed: list, shots: int):
+    """
+    Advances the weapon and its perks as if `shots` rounds were fired without RewindRounds seeing an empty magazine.
+
+    Parameters:
+    - weapon (Weapon): The weapon to update.
+    - rewind (RewindRounds): The RewindRounds on the weapon.
+    - fixed (list): The fixed-ratio refund perks on the weapon as (perk, later) pairs.
+    - shots (int): The number of shots fired.
+    """
+    weapon.shots_fired += shots
+    weapon.magazine -= shots
+
+    for perk, later in fixed:
+      hits = perk.counter + shots
+      perk.procs += hits // perk.trigger_count
+      perk.counter = hits % perk.trigger_count
+      weapon.magazine += perk.refund_amount * (hits // perk.trigger_count)
+
+    # The disabled shots are used up first, every shot after them is a hit
+    if rewind.disabled_shots >= shots:
+      rewind.disabled_shots -= shots
+    else:
+      rewind.counter += shots - rewind.disabled_shots
+      rewind.disabled_shots = 0
+
+  def fingerprint(weapon: Weapon):
+    """
+    Returns a tuple of everything that decides how the weapon behaves from now on.
+    """
+    fingerprint = [weapon.magazine, weapon.reserves]
+
+    for perk in weapon.perks:
+      for field in perk.counter_fields:
+        fingerprint.append(getattr(perk, field))
+
+    return tuple(fingerprint)
+
+  def fire_magazine(weapon: Weapon, procs: list = None):
+    """
+    Fires the weapon until its magazine is empty, the same as calling `weapon.shoot()` until it returns False.
+    Returns the number of shots fired, or None without touching the weapon if the engine can't fire it.
+    Raises a ValueError if the magazine never empties.
+
+    Parameters:
+    - weapon (Weapon): The weapon to fire.
+    - procs (list): A list to add the size of each RewindRounds refund to, in order (default is None).
+    """
+    plan = RewindEngine.plan(weapon)
+    if plan is None:
+      return None
+    rewind, fixed = plan
+
+    shots_fired = weapon.shots_fired
+    seen = set()
+
+    while weapon.magazine > 0:
+      shots = RewindEngine.shots_until_check(weapon.magazine, fixed)
+      if shots is None:
+        raise ValueError("The perks on this weapon refund rounds at least as fast as they are used, the magazine never empties.")
+
+      RewindEngine.advance(weapon, rewind, fixed, shots - 1)
+
+      fingerprint = RewindEngine.fingerprint(weapon)
+      if fingerprint in seen:
+        raise ValueError("The perks on this weapon refund rounds at least as fast as they are used, the magazine never empties.")
+      seen.add(fingerprint)
+
+      # The shot where RewindRounds sees an empty magazine is fired for real
+      refunded = rewind.refunded
+      weapon.shoot()
+      if procs is not None and rewind.refunded != refunded:
+        procs.append(rewind.refunded - refunded)
+
+    return weapon.shots_fired - shots_fired
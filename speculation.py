@@ -0,0 +1,259 @@
+"""
+Speculator works out the tests on a weapon in the background while the user is still reading the menu.
+
+As soon as main.py has a weapon, the speculator hands a worker process the magazine and all ammo tests on it, followed by
+the weapons the user is most likely to try next: each perk with its enhanced flag flipped, and the magazine one round
+smaller and larger. The worker sends back a snapshot of each weapon after each test (see Weapon.snapshot) along with the
+messages the test showed (like RewindRounds' procs), and picking a test shows the messages and restores the snapshot
+instead of firing the weapon, so the output is the same as before.
+
+The worker is a separate process rather than a thread: the perks send output to the current sink, which is shared by
+every thread, and a process can be stopped part way through a test. When the user makes a new weapon while the worker
+still has tests left, the worker is stopped and a new one is given the new weapon's tests, so stale work never holds up
+fresh work. Results are kept for the whole session, so coming back to a weapon (or one of its variants) is instant.
+
+Speculator has the same fire_magazine and expend_all methods as LookupTable, so FiringRange takes it as its table. A test
+whose result isn't back yet waits for the worker if the worker has it, and otherwise falls back to the lookup table and
+then the simulator like before.
+
+Results are stored under the canonical key of the weapon (see resultCache.py), so the variants that can't give different
+results, like flipping the enhanced flag of TripleTap, are never run twice.
+"""
+
+import multiprocessing
+
+from weapon import Weapon
+from weaponConfig import WeaponConfig
+from magazineEngine import MagazineEngine
+from resultCache import canonical_key
+from resultSink import ResultSink, current_sink, use_sink
+from perk import Perk
+
+# The message of a weapon that never runs out of ammo, the same as MagazineEngine's.
+NEVER_EMPTIES = "The perks on this weapon refund rounds at least as fast as they are used, the magazine never empties."
+
+
+def tests_for(config: WeaponConfig):
+  """
+  Returns the tests FiringRange runs on a weapon. Weapons with infinite reserves have no all ammo test.
+  """
+  return ("magazine",) if config.reserves_size == -1 else ("magazine", "all_ammo")
+
+
+def variants(config: WeaponConfig, max_magazine: int = 300):
+  """
+  Returns the weapons the user is most likely to try after this one: each perk with its enhanced flag flipped, and the
+  magazine one round smaller and larger.
+
+  Parameters:
+  - config (WeaponConfig): The weapon.
+  - max_magazine (int): The largest magazine size the user can enter (default is 300).
+  """
+  configs = []
+
+  for slot, (name, enhanced) in enumerate(config.perks):
+    if name != Perk.__name__:
+      configs.append(config._replace(perks=config.perks[:slot] + ((name, not enhanced),) + config.perks[slot + 1:]))
+
+  for magazine_size in (config.magazine_size - 1, config.magazine_size + 1):
+    if 1 <= magazine_size <= max_magazine:
+      configs.append(config._replace(magazine_size=magazine_size))
+
+  return configs
+
+
+class MessageLog(ResultSink):
+  """
+  A sink that keeps the messages shown to it, to be shown again later.
+
+  Attributes:
+  - messages (list): The messages, in order.
+  """
+  verbose = True
+
+  def __init__(self, stream=None):
+    super().__init__(stream)
+    self.messages = []
+
+  def message(self, text: str):
+    self.messages.append(text)
+
+
+def work(connection):
+  """
+  The worker process: runs every test in each list of (key, config, test) jobs it is sent, sending back a
+  (key, snapshot, messages) tuple as each one finishes, until it is sent None. A weapon that never runs out of ammo is
+  sent back with -1 shots fired, like magazineEngine.run_test.
+  """
+  while True:
+    jobs = connection.recv()
+    if jobs is None:
+      return
+
+    for key, config, test in jobs:
+      weapon = config.build()
+      log = MessageLog()
+      try:
+        with use_sink(log):
+          if test == "magazine":
+            MagazineEngine.fire_magazine(weapon)
+          else:
+            MagazineEngine.expend_all(weapon)
+      except ValueError:
+        weapon.shots_fired = -1
+
+      connection.send((key, weapon.snapshot(), tuple(log.messages)))
+
+
+class Speculator():
+  """
+  Runs the tests on a weapon and its variants in a worker process, and answers FiringRange from the results.
+
+  Attributes:
+  - table (LookupTable): The table to answer from when there's no result, or None.
+  - results (dict): The perk names, the snapshot and the messages after each test, by canonical key.
+  - pending (dict): The perk names of the tests the worker hasn't sent back yet, by canonical key.
+  - process (multiprocessing.Process): The worker, or None when there isn't one.
+  - connection: The end of the pipe to the worker, or None.
+  - hits (int): The number of tests answered from the results.
+  - misses (int): The number of tests left to the table or the simulator.
+  """
+  def __init__(self, table=None):
+    """
+    Initializes a new instance of the Speculator class. The worker is only started once there is work for it.
+
+    Parameters:
+    - table (LookupTable): A table to answer from when there's no result (default is None).
+    """
+    self.table = table
+    self.results = {}
+    self.pending = {}
+    self.process = None
+    self.connection = None
+    self.hits = 0
+    self.misses = 0
+
+  def start(self, weapon: Weapon):
+    """
+    Starts working out the tests on a weapon and its variants, dropping the work left for the last weapon.
+
+    Parameters:
+    - weapon (Weapon): The weapon the user has just made.
+    """
+    self._collect()
+
+    # Whatever the worker is still doing is for the last weapon
+    if self.pending:
+      self.stop()
+
+    config = WeaponConfig.from_weapon(weapon)
+    jobs = []
+    for variant in [config] + variants(config):
+      for test in tests_for(variant):
+        key = canonical_key(variant, test)
+        if key not in self.results and key not in self.pending:
+          jobs.append((key, variant, test))
+          self.pending[key] = tuple(name for name, enhanced in variant.perks)
+
+    if not jobs:
+      return
+
+    if self.process is None:
+      self.connection, child = multiprocessing.Pipe()
+      # A daemon worker is stopped with the calculator, even in the middle of a test
+      self.process = multiprocessing.Process(target=work, args=(child,), daemon=True)
+      self.process.start()
+      child.close()
+
+    self.connection.send(jobs)
+
+  def _collect(self, key: str = None):
+    """
+    Stores every result the worker has sent back. Given a key the worker still has, waits until it is back.
+    """
+    while self.pending:
+      if not self.connection.poll() and key not in self.pending:
+        return
+      try:
+        done, snapshot, messages = self.connection.recv()
+      except (EOFError, OSError):
+        # The worker is gone, anything it didn't finish is left to the simulator
+        self.stop()
+        return
+
+      self.results[done] = (self.pending.pop(done), snapshot, messages)
+
+  def _answer(self, weapon: Weapon, test: str):
+    """
+    Puts the weapon in its state after a test from the results. Returns the number of shots fired, or None without
+    touching the weapon if there is no result for it. Raises a ValueError if the weapon never runs out of ammo.
+    """
+    config = WeaponConfig.from_weapon(weapon)
+    key = canonical_key(config, test)
+    self._collect(key)
+
+    result = self.results.get(key)
+    # Only a freshly resupplied weapon starts where the worker's did, and the perks have to be in the same order for
+    # the snapshot to line up
+    names = tuple(name for name, enhanced in config.perks)
+    if result is None or result[0] != names or weapon.snapshot() != config.build().snapshot():
+      self.misses += 1
+      return None
+
+    names, snapshot, messages = result
+    self.hits += 1
+
+    sink = current_sink()
+    if sink.verbose:
+      for text in messages:
+        sink.message(text)
+
+    if snapshot[2] == -1:
+      raise ValueError(NEVER_EMPTIES)
+
+    weapon.restore(snapshot)
+
+    return weapon.shots_fired
+
+  def fire_magazine(self, weapon: Weapon):
+    """
+    Empties the weapon's magazine from the results, the same as MagazineEngine.fire_magazine.
+    Returns the number of shots fired, or None without touching the weapon if there is no result for it.
+    """
+    shots = self._answer(weapon, "magazine")
+    if shots is None and self.table is not None:
+      return self.table.fire_magazine(weapon)
+
+    return shots
+
+  def expend_all(self, weapon: Weapon):
+    """
+    Expends all of the weapon's ammo from the results, the same as MagazineEngine.expend_all.
+    Returns the number of shots fired, or None without touching the weapon if there is no result for it.
+    """
+    shots = self._answer(weapon, "all_ammo")
+    if shots is None and self.table is not None:
+      return self.table.expend_all(weapon)
+
+    return shots
+
+  def stop(self):
+    """
+    Stops the worker, dropping the tests it hasn't sent back.
+    """
+    if self.process is not None:
+      self.process.terminate()
+      self.process.join()
+      self.connection.close()
+
+    self.process = None
+    self.connection = None
+    self.pending.clear()
+
+  def close(self):
+    """
+    Stops the worker and closes the table.
+    """
+    self.stop()
+    if self.table is not None:
+      self.table.close()
@@ -1,4 +1,25 @@
+from typing import NamedTuple, Optional
+
 from perk import Perk
+from resultSink import current_sink
+
+class WeaponEvent(NamedTuple):
+  """
+  A shot or reload, as yielded by Weapon.events().
+
+  Attributes:
+  - kind (str): "shot" or "reload".
+  - shot (int): The shots fired so far, including this one.
+  - magazine (int): The rounds in the magazine after the event.
+  - reserves (int): The rounds in reserves after the event.
+  - rounds (int): For a shot, the rounds the perks put back in the magazine on it. For a reload, the rounds loaded.
+  """
+  kind: str
+  shot: int
+  magazine: int
+  reserves: int
+  rounds: int
+
 
 class Weapon ():
   """
@@ -6,29 +27,35 @@ class Weapon ():
 
   Attributes:
     - magazine_size: The size of the weapon's magazine.
-    - fire_rate: The rate of fire of the weapon (rounds per second).
+    - fire_rate: The rate of fire of the weapon (rounds per minute).
     - perks: A list of perks or modifiers that can affect the weapon's performance (e.g., Triple Tap).
     - reserves_size: The size of the reserves for the weapon. If -1, it indicates infinite reserves (primary ammo).
     - magazine: The current number of rounds in the magazine (initialized to magazine_size).
     - shots_fired: The number of shots fired from the magazine (initialized to 0).
     - reloads: The number of times the weapon has been reloaded (initialized to 0).
     - reserves: The current number of rounds in reserves (initialized to reserves_size).
+    - hit, precision_hit: Whether the last shot fired hit, and whether it was a precision hit (both True unless told otherwise).
+    - shot_hooks, reload_hooks, reset_hooks: The perk methods called on each event, built by compile().
+    - perk_fields: The counters and totals of each perk that has any, as (perk, field names) pairs, built by compile().
   """
+  # Weapons are created in bulk by sweeps, so they don't carry a __dict__
+  __slots__ = ("magazine_size", "fire_rate", "perks", "reserves_size", "magazine", "reserves", "shots_fired", "reloads",
+               "hit", "precision_hit", "shot_hooks", "reload_hooks", "reset_hooks", "perk_fields")
   
-  def __init__(self, magazine_size: int = 0, fire_rate: int = 0, reserves_size: int = -1, perks: list[Perk] = []):
+  def __init__(self, magazine_size: int = 0, fire_rate: int = 0, reserves_size: int = -1, perks: Optional[list[Perk]] = None):
     """
     Initializes a new instance of the Weapon class.
 
     Parameters:
     - magazine_size (int): The size of the weapon's magazine (default is 0).
-    - fire_rate (int): The rate of fire of the weapon in rounds per second (default is 0).
+    - fire_rate (int): The rate of fire of the weapon in rounds per minute (default is 0).
     - reserves_size (int): The size of the reserves for the weapon. If -1, it indicates infinite reserves (default is -1).
-    - perks (list): A list of perks or modifiers that can affect the weapon's performance (default is an empty list).
+    - perks (list): A list of perks or modifiers that can affect the weapon's performance (default is a new empty list).
     """
     # Weapon Attributes
     self.magazine_size = magazine_size
     self.fire_rate = fire_rate
-    self.perks = perks
+    self.perks = perks if perks is not None else [] # Never share the default list between weapons
     self.reserves_size = reserves_size # Size of reserves, -1 means the weapon uses primary ammo (inifinte reserves)
 
     # Weapon State
@@ -36,15 +63,74 @@ class Weapon ():
     self.reserves = reserves_size # Initialize with full reserves
     self.shots_fired = 0
     self.reloads = 0
+    self.hit = True
+    self.precision_hit = True
+
+    # Build the perk hooks for this configuration
+    self.compile()
+
+
+  def compile(self):
+    """
+    Builds the lists of perk hooks that are called when the weapon is fired, reloaded or resupplied.
+    Only perks that handle an event are called for it, so placeholder perks cost nothing, and each perk gets a chance
+    to work out anything that only depends on the weapon's configuration once, ahead of time (see Perk.bind).
+    This is called when the weapon is created, and must be called again if its perks or configuration change.
+    """
+    for perk in self.perks:
+      perk.bind(self)
+
+    self.shot_hooks = tuple(perk.shot_trigger for perk in self.perks if "shot" in perk.events)
+    self.reload_hooks = tuple(perk.reload_trigger for perk in self.perks if "reload" in perk.events)
+    self.reset_hooks = tuple(perk.reset for perk in self.perks if "reset" in perk.events)
+    self.perk_fields = tuple((perk, perk.counter_fields + perk.total_fields) for perk in self.perks
+                             if perk.counter_fields or perk.total_fields)
+
+  def snapshot(self):
+    """
+    Returns the state of the weapon and its perks as a tuple of numbers: the magazine, reserves, shots fired and
+    reloads, followed by every perk's counters and totals. Snapshots are immutable and can be compared and hashed,
+    and only make sense for the weapon they were taken from (or one with the same configuration and perks).
+    """
+    state = [self.magazine, self.reserves, self.shots_fired, self.reloads]
+
+    for perk, fields in self.perk_fields:
+      for field in fields:
+        state.append(getattr(perk, field))
+
+    return tuple(state)
+
+  def restore(self, snapshot: tuple):
+    """
+    Puts the weapon and its perks back in the state of a snapshot taken with snapshot().
+
+    Parameters:
+    - snapshot (tuple): The snapshot to restore.
+    """
+    self.magazine, self.reserves, self.shots_fired, self.reloads = snapshot[0], snapshot[1], snapshot[2], snapshot[3]
+
+    index = 4
+    for perk, fields in self.perk_fields:
+      for field in fields:
+        setattr(perk, field, snapshot[index])
+        index += 1
 
 
-  def shoot(self):
+  def shoot(self, hit: bool = True, precision_hit: bool = True):
     """
     Simulate firing a round from the weapon.
     Returns True if a round was successfully fired, False if the magazine is empty.
+
+    Parameters:
+    - hit (bool): Whether the round hits its target (default is True).
+    - precision_hit (bool): Whether the round is a precision hit (default is True). Only counts if the round hits.
     """
     if self.magazine == 0: return False
 
+    # Record how the round landed for the perks to check
+    self.hit = hit
+    self.precision_hit = hit and precision_hit
+
     # Decrement the magazine count when firing the round
     self.magazine -= 1
 
@@ -52,8 +138,8 @@ class Weapon ():
     self.shots_fired += 1
 
     # Apply perks or modifiers to the magazine if any
-    for perk in self.perks:
-      perk.shot_trigger(self)  # Call method on each perk to apply its on shot effect to the weapon
+    for shot_trigger in self.shot_hooks:
+      shot_trigger(self)  # Call method on each perk to apply its on shot effect to the weapon
 
     return True
 
@@ -79,11 +165,39 @@ class Weapon ():
     self.reloads += 1
 
     # Call the method on each perk to trigger its reload check
-    for perk in self.perks:
-      perk.reload_trigger(self)  # Call method on each perk to apply its on reload effect to the weapon
+    for reload_trigger in self.reload_hooks:
+      reload_trigger(self)  # Call method on each perk to apply its on reload effect to the weapon
 
     return True
   
+  def events(self, all_ammo: bool = False, hit: bool = True, precision_hit: bool = True):
+    """
+    Fires the weapon round by round and yields a WeaponEvent for every shot, and with `all_ammo` every reload, as it
+    happens. Stops once the magazine is empty, or with `all_ammo` once a reload fails.
+
+    Nothing is fired until the next event is asked for, so the timeline is never held in memory and the caller can stop
+    at any point, with the weapon left as of the last event. A weapon that never runs out of ammo yields events forever.
+
+    Parameters:
+    - all_ammo (bool): Whether to reload every time the magazine is empty (default is False, one magazine).
+    - hit (bool): Whether every round hits (default is True).
+    - precision_hit (bool): Whether every round is a precision hit (default is True).
+    """
+    shoot = self.shoot
+    # Events are made straight from tuples, skipping the NamedTuple constructor's argument handling on every shot
+    event = tuple.__new__
+
+    while True:
+      magazine = self.magazine
+      while shoot(hit, precision_hit):
+        after = self.magazine
+        yield event(WeaponEvent, ("shot", self.shots_fired, after, self.reserves, after - magazine + 1))
+        magazine = after
+
+      if not all_ammo or not self.reload():
+        return
+      yield WeaponEvent("reload", self.shots_fired, self.magazine, self.reserves, self.magazine - magazine)
+
   def resupply(self):
     """
     Resets the weapon to its initial state.
@@ -93,31 +207,20 @@ class Weapon ():
     self.shots_fired = 0  # Reset shots fired counter
     self.reloads = 0  # Reset reloads counter
 
-    for perk in self.perks:
-      perk.reset()
+    for reset in self.reset_hooks:
+      reset()
 
-  def report(self):
+  def state(self):
     """
-    Prints a report of the weapon's current state, including magazine, reserves, shots fired, and reloads.
-    Also calls the report method on each perk to display their individual states.
-    Returns an object that contains the current state of the weapon and its perks.
+    Returns an object that contains the current state of the weapon and its perks without printing anything.
     """
-    # Calculate extra shots fired
-
-    print(f"Magazine: {self.magazine}/{self.magazine_size}")
-    print(f"Reserves: {self.reserves}/{self.reserves_size}")
-    print(f"Shots Fired: {self.shots_fired}")
-    print(f"Reloads: {self.reloads}")
-
-
-    # Collect the report from each perk to include in the final report
+    # Collect the state of each perk to include in the final state
     perk_states = {}
 
     for perk in self.perks:
-      perk_states[perk.__class__.__name__] = perk.report()
+      perk_states[perk.__class__.__name__] = perk.state()
 
-    # Return an object with the current state of the weapon and its perks for further use if needed
-    report = {
+    state = {
       "magazine": self.magazine,
       "magazine_size": self.magazine_size,
       "reserves": self.reserves,
@@ -126,8 +229,26 @@ class Weapon ():
       "perks": perk_states
     }
 
-    return report
+    return state
 
-    
+  def report(self, sink=None):
+    """
+    Shows a report of the weapon's current state, including magazine, reserves, shots fired, and reloads.
+    Also calls the report method on each perk to display their individual states.
+    Returns an object that contains the current state of the weapon and its perks.
 
-    
\ No newline at end of file
+    Parameters:
+    - sink (ResultSink): The sink to show the report on (default is the current sink, see resultSink.py).
+    """
+    sink = sink or current_sink()
+    sink.message(f"Magazine: {self.magazine}/{self.magazine_size}")
+    sink.message(f"Reserves: {self.reserves}/{self.reserves_size}")
+    sink.message(f"Shots Fired: {self.shots_fired}")
+    sink.message(f"Reloads: {self.reloads}")
+
+    # Let each perk show its own report
+    for perk in self.perks:
+      perk.report(sink)
+
+    # Return an object with the current state of the weapon and its perks for further use if needed
+    return self.state()
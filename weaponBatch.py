@@ -0,0 +1,260 @@
+"""
+WeaponBatch stores many weapons that share the same perks as columns of numbers instead of objects.
+
+A Weapon and its perks are a handful of Python objects each, which adds up quickly in a sweep of a million
+configurations. A batch keeps every weapon's configuration and state in `array` columns, one per field, plus one column
+per counter and total of each perk (see Perk.counter_fields and Perk.total_fields).
+
+The batch doesn't reimplement any perk logic. A single Weapon with a single set of perks is kept as a working copy:
+to run an operation on a row, the row is loaded into the working copy, the regular Weapon/MagazineEngine method is run,
+and the result is stored back. Bulk operations that empty whole magazines go through MagazineEngine, so a row is only
+loaded and stored once per operation no matter how many shots are fired.
+"""
+
+import tracemalloc
+from array import array
+
+from weapon import Weapon
+from weaponConfig import WeaponConfig
+from magazineEngine import MagazineEngine
+
+# The columns of the weapon itself, in the order they are stored.
+CONFIG_FIELDS = ("magazine_size", "fire_rate", "reserves_size")
+STATE_FIELDS = ("magazine", "reserves", "shots_fired", "reloads")
+
+
+class WeaponBatch():
+  """
+  A batch of weapons with the same perks, stored in columns.
+
+  Attributes:
+  - perks (tuple): The perks on every weapon in the batch, as (perk name, enhanced) pairs.
+  - columns (dict): An `array` of signed integers for every weapon field, keyed by the Weapon attribute name.
+  - perk_columns (list): For each perk, a list of (attribute name, `array`) pairs for its counters and totals.
+  - weapon (Weapon): The working copy rows are loaded into.
+  """
+  def __init__(self, perks: tuple = ()):
+    """
+    Initializes a new, empty instance of the WeaponBatch class.
+
+    Parameters:
+    - perks (tuple): The perks on every weapon in the batch, as (perk name, enhanced) pairs (default is no perks).
+    """
+    self.perks = tuple(perks)
+    self.columns = {field: array('q') for field in CONFIG_FIELDS + STATE_FIELDS}
+
+    self.weapon = WeaponConfig(0, perks=self.perks).build()
+    self.perk_columns = [[(field, array('q')) for field in perk.counter_fields + perk.total_fields] for perk in self.weapon.perks]
+
+    # The configuration the working copy was last compiled for
+    self._compiled = None
+
+  def from_configs(configs):
+    """
+    Returns a WeaponBatch holding a fresh weapon for every configuration. Every configuration must have the same perks.
+
+    Parameters:
+    - configs (iterable): The WeaponConfig of each weapon.
+    """
+    batch = None
+
+    for config in configs:
+      if batch is None:
+        batch = WeaponBatch(config.perks)
+      batch.append(config)
+
+    return batch if batch is not None else WeaponBatch()
+
+  def __len__(self):
+    return len(self.columns["magazine_size"])
+
+  def append(self, config: WeaponConfig):
+    """
+    Adds a fresh weapon with the given configuration to the batch.
+
+    Parameters:
+    - config (WeaponConfig): The configuration of the weapon. Its perks must match the batch's perks.
+    """
+    if tuple(config.perks) != self.perks:
+      raise ValueError("Every weapon in a batch must have the same perks.")
+
+    columns = self.columns
+    columns["magazine_size"].append(config.magazine_size)
+    columns["fire_rate"].append(config.fire_rate)
+    columns["reserves_size"].append(config.reserves_size)
+    columns["magazine"].append(config.magazine_size)
+    columns["reserves"].append(config.reserves_size)
+    columns["shots_fired"].append(0)
+    columns["reloads"].append(0)
+
+    for perk_columns in self.perk_columns:
+      for field, column in perk_columns:
+        column.append(0)
+
+  def config(self, row: int):
+    """
+    Returns the WeaponConfig of a row.
+    """
+    columns = self.columns
+    return WeaponConfig(columns["magazine_size"][row], columns["reserves_size"][row], columns["fire_rate"][row], self.perks)
+
+  def load(self, row: int):
+    """
+    Loads a row into the working copy and returns it. Changes to the working copy are kept by calling store.
+
+    Parameters:
+    - row (int): The index of the row to load.
+    """
+    weapon = self.weapon
+    columns = self.columns
+
+    for field in CONFIG_FIELDS + STATE_FIELDS:
+      setattr(weapon, field, columns[field][row])
+
+    for perk, perk_columns in zip(weapon.perks, self.perk_columns):
+      for field, column in perk_columns:
+        setattr(perk, field, column[row])
+
+    # Perks work out some values from the configuration when compiled, only redo it when it changes
+    compiled = (weapon.magazine_size, weapon.fire_rate, weapon.reserves_size)
+    if compiled != self._compiled:
+      weapon.compile()
+      self._compiled = compiled
+
+    return weapon
+
+  def store(self, row: int):
+    """
+    Stores the state of the working copy back into a row.
+
+    Parameters:
+    - row (int): The index of the row to store into.
+    """
+    weapon = self.weapon
+    columns = self.columns
+
+    for field in STATE_FIELDS:
+      columns[field][row] = getattr(weapon, field)
+
+    for perk, perk_columns in zip(weapon.perks, self.perk_columns):
+      for field, column in perk_columns:
+        column[row] = getattr(perk, field)
+
+  def _apply(self, operation):
+    """
+    Runs an operation on the working copy for every row. Returns an array with the result of each row.
+    """
+    results = array('q')
+
+    for row in range(len(self)):
+      weapon = self.load(row)
+      results.append(operation(weapon))
+      self.store(row)
+
+    return results
+
+  def _fire(self, operation):
+    """
+    Runs a MagazineEngine operation on every row, the same way as magazineEngine.run_test: a weapon that never runs
+    out of ammo is stored with -1 shots fired and -1 in the results, so one such row doesn't stop the rest.
+    """
+    def fire(weapon):
+      try:
+        return operation(weapon)
+      except ValueError:
+        weapon.shots_fired = -1
+        return -1
+
+    return self._apply(fire)
+
+  def shoot(self):
+    """
+    Fires one round from every weapon in the batch, the same as Weapon.shoot.
+    Returns an array with 1 for each weapon that fired and 0 for each weapon with an empty magazine.
+    """
+    return self._apply(Weapon.shoot)
+
+  def reload(self):
+    """
+    Reloads every weapon in the batch, the same as Weapon.reload.
+    Returns an array with 1 for each weapon that reloaded and 0 for each weapon without reserves.
+    """
+    return self._apply(Weapon.reload)
+
+  def resupply(self):
+    """
+    Resets every weapon in the batch to its initial state, the same as Weapon.resupply.
+    """
+    columns = self.columns
+
+    columns["magazine"][:] = columns["magazine_size"]
+    columns["reserves"][:] = columns["reserves_size"]
+    columns["shots_fired"][:] = array('q', [0]) * len(self)
+    columns["reloads"][:] = array('q', [0]) * len(self)
+
+    for perk_columns in self.perk_columns:
+      for field, column in perk_columns:
+        column[:] = array('q', [0]) * len(self)
+
+  def fire_magazine(self):
+    """
+    Fires every weapon in the batch until its magazine is empty, see MagazineEngine.fire_magazine.
+    Returns an array with the number of shots each weapon fired, or -1 for a weapon that never runs out of ammo.
+    """
+    return self._fire(MagazineEngine.fire_magazine)
+
+  def expend_all(self):
+    """
+    Fires and reloads every weapon in the batch until it is out of ammo, see MagazineEngine.expend_all.
+    Returns an array with the number of shots each weapon fired, or -1 for a weapon that never runs out of ammo.
+    """
+    return self._fire(MagazineEngine.expend_all)
+
+  def state(self, row: int):
+    """
+    Returns the state of a row in the same shape as Weapon.report(), without printing anything.
+
+    Parameters:
+    - row (int): The index of the row.
+    """
+    return self.load(row).state()
+
+  def report(self, row: int, sink=None):
+    """
+    Shows a report of a row the same way as Weapon.report() and returns its state.
+
+    Parameters:
+    - row (int): The index of the row.
+    - sink (ResultSink): The sink to show the report on (default is the current sink).
+    """
+    return self.load(row).report(sink)
+
+
+def memory_per_configuration(configs: list):
+  """
+  Measures the memory used to hold the configurations as separate Weapon objects and as a WeaponBatch.
+  Returns a dictionary with the bytes used per configuration by each.
+
+  Parameters:
+  - configs (list): The configurations to measure with. Every configuration must have the same perks.
+  """
+  tracemalloc.start()
+
+  try:
+    before = tracemalloc.get_traced_memory()[0]
+    weapons = [config.build() for config in configs]
+    weapon_bytes = tracemalloc.get_traced_memory()[0] - before
+    del weapons
+
+    before = tracemalloc.get_traced_memory()[0]
+    batch = WeaponBatch.from_configs(configs)
+    batch_bytes = tracemalloc.get_traced_memory()[0] - before
+    del batch
+  finally:
+    tracemalloc.stop()
+
+  return {
+    "configurations": len(configs),
+    "weapon_bytes": weapon_bytes / max(len(configs), 1),
+    "batch_bytes": batch_bytes / max(len(configs), 1),
+  }
@@ -0,0 +1,475 @@
+"""
+WeaponCatalog holds real weapons loaded from spreadsheets, and runs the tests on every roll of every weapon.
+
+A catalog file is CSV, JSON (a list of objects) or JSONL, with one weapon per row:
+
+  name,archetype,magazine_size,reserves_size,fire_rate,perks1,perks2
+  Fatebringer,Hand Cannon,11,,140,Outlaw;Rapid Hit;TripleTap,Explosive Payload;FourthTimesTheCharm
+
+  {"name": "Fatebringer", "archetype": "Hand Cannon", "magazine_size": 11, "fire_rate": 140,
+   "perk_columns": [["Outlaw", "Rapid Hit", "TripleTap"], ["Explosive Payload", "FourthTimesTheCharm"]]}
+
+An empty or missing reserves size means infinite reserves (primary ammo). In CSV every column whose name starts with
+"perks" is a perk column, in the order of the header, holding the perks it can roll separated by ";". Names are unique,
+and loading a weapon with a name already in the catalog updates it.
+
+Weapons are stored as columns (an `array` per number, a list per text field) with indexes by archetype, by ammo type
+(primary when the reserves are infinite, special otherwise) and by every perk name, so queries like "every special
+ammo weapon that can roll TripleTap" never scan the catalog.
+
+A roll is one perk from each column. Perks the calculator doesn't know (anything not in perks.PERK_TYPES) behave the
+same as no perk, so they are all rolled as the placeholder, and rolls with the same perk twice are left out. Enhanced
+versions of each perk are rolled as well, unless turned off.
+
+Results are kept per weapon along with a signature of everything they depend on (the weapon's numbers, its perk columns
+and the versions of the perks in them). Evaluating the catalog again only runs the weapons whose signature changed, and identical
+configurations shared by several weapons are only run once. Results are written out column by column as JSON, and
+reading them back into a catalog keeps the ones that are still up to date:
+
+  python weaponCatalog.py weapons.csv --results results.json --ammo special --perk TripleTap
+"""
+
+import argparse
+import csv
+import json
+import sys
+from array import array
+from itertools import product
+
+from weaponConfig import WeaponConfig
+from magazineEngine import TESTS
+from parallelRange import run_config, run_grid
+from batchSweep import SweepTable
+from perks import PERK_TYPES
+from resultCache import canonical_key, perk_versions
+
+CATALOG_FORMATS = ("csv", "json", "jsonl")
+AMMO_TYPES = ("primary", "special")
+
+# Bump this whenever the layout of the results file changes.
+RESULTS_FORMAT = 2
+
+# The numeric columns of the catalog.
+NUMBER_FIELDS = ("magazine_size", "reserves_size", "fire_rate")
+
+
+def ammo_type(reserves_size: int):
+  """
+  Returns "primary" for weapons with infinite reserves, and "special" for any other (special and heavy ammo alike).
+  """
+  return "primary" if reserves_size == -1 else "special"
+
+
+def parse_weapon(record: dict):
+  """
+  Returns a weapon record from the catalog file with its fields cleaned up, or raises a ValueError.
+
+  Parameters:
+  - record (dict): The fields of the weapon. Perk columns are lists, or strings separated by ";" from CSV.
+  """
+  name = str(record.get("name") or "").strip()
+  if not name:
+    raise ValueError("Missing name.")
+
+  def number(field, default):
+    value = record.get(field)
+    return default if value is None or value == "" else int(value)
+
+  magazine_size = number("magazine_size", None)
+  if magazine_size is None or magazine_size < 1:
+    raise ValueError("The magazine size must be at least 1.")
+
+  perk_columns = []
+  for column in record.get("perk_columns") or []:
+    if isinstance(column, str):
+      column = column.split(";")
+    perk_columns.append(tuple(perk.strip() for perk in column if perk.strip()))
+
+  return {
+    "name": name,
+    "archetype": str(record.get("archetype") or "").strip(),
+    "magazine_size": magazine_size,
+    "reserves_size": number("reserves_size", -1),
+    "fire_rate": number("fire_rate", 0),
+    "perk_columns": tuple(perk_columns),
+  }
+
+
+def read_catalog(stream, catalog_format: str = "csv"):
+  """
+  Yields a weapon record (see parse_weapon) for every weapon in a catalog file.
+
+  Parameters:
+  - stream: The file to read from.
+  - catalog_format (str): "csv", "json" or "jsonl" (default is "csv").
+  """
+  if catalog_format == "csv":
+    def records():
+      for record in csv.DictReader(stream):
+        columns = [value for field, value in record.items() if field and field.strip().startswith("perks")]
+        yield {**record, "perk_columns": columns}
+    numbered = enumerate(records(), start=2)
+  elif catalog_format == "json":
+    numbered = enumerate(json.load(stream), start=1)
+  else:
+    numbered = ((number, json.loads(line)) for number, line in enumerate(stream, start=1) if line.strip())
+
+  for number, record in numbered:
+    try:
+      yield parse_weapon(record)
+    except (ValueError, TypeError, AttributeError) as error:
+      raise ValueError(f"Weapon {number}: {error}") from None
+
+
+class WeaponCatalog():
+  """
+  A catalog of weapons, stored in columns and indexed.
+
+  Attributes:
+  - names (list): The name of each weapon.
+  - archetypes (list): The archetype of each weapon.
+  - columns (dict): An `array` of signed integers for every number in NUMBER_FIELDS.
+  - perk_columns (list): The perk columns of each weapon, as tuples of perk names.
+  - by_name (dict): The row of each weapon, by name.
+  - by_archetype (dict): The set of rows of each archetype.
+  - by_ammo (dict): The set of rows of each ammo type, "primary" and "special".
+  - by_perk (dict): The set of rows of the weapons that can roll each perk.
+  - results (dict): For each row with results, the signature they were computed for and a dictionary of
+    (perks, state) lists by test.
+  """
+  def __init__(self):
+    """
+    Initializes a new, empty instance of the WeaponCatalog class.
+    """
+    self.names = []
+    self.archetypes = []
+    self.columns = {field: array('q') for field in NUMBER_FIELDS}
+    self.perk_columns = []
+
+    self.by_name = {}
+    self.by_archetype = {}
+    self.by_ammo = {ammo: set() for ammo in AMMO_TYPES}
+    self.by_perk = {}
+
+    self.results = {}
+
+  def __len__(self):
+    return len(self.names)
+
+  def _index(self, row: int, add: bool):
+    """
+    Adds a row to the archetype, ammo and perk indexes, or takes it out of them.
+    """
+    keys = [(self.by_archetype, self.archetypes[row]), (self.by_ammo, ammo_type(self.columns["reserves_size"][row]))]
+    keys += [(self.by_perk, perk) for column in self.perk_columns[row] for perk in column]
+
+    for index, key in keys:
+      if add:
+        index.setdefault(key, set()).add(row)
+      else:
+        index[key].discard(row)
+
+  def upsert(self, weapon: dict):
+    """
+    Adds a weapon to the catalog, or updates the weapon with the same name. Returns the weapon's row and whether
+    anything about it changed.
+
+    Parameters:
+    - weapon (dict): A weapon record, as returned by parse_weapon.
+    """
+    row = self.by_name.get(weapon["name"])
+
+    if row is None:
+      row = len(self.names)
+      self.by_name[weapon["name"]] = row
+      self.names.append(weapon["name"])
+      self.archetypes.append(weapon["archetype"])
+      for field in NUMBER_FIELDS:
+        self.columns[field].append(weapon[field])
+      self.perk_columns.append(weapon["perk_columns"])
+      self._index(row, True)
+      return row, True
+
+    if self.weapon(row) == weapon:
+      return row, False
+
+    self._index(row, False)
+    self.archetypes[row] = weapon["archetype"]
+    for field in NUMBER_FIELDS:
+      self.columns[field][row] = weapon[field]
+    self.perk_columns[row] = weapon["perk_columns"]
+    self._index(row, True)
+
+    return row, True
+
+  def load(self, weapons):
+    """
+    Adds or updates every weapon in an iterable of weapon records. Returns the number of weapons that were new or
+    changed.
+    """
+    return sum(1 for weapon in weapons if self.upsert(weapon)[1])
+
+  def weapon(self, row: int):
+    """
+    Returns the weapon record of a row.
+    """
+    return {
+      "name": self.names[row],
+      "archetype": self.archetypes[row],
+      **{field: self.columns[field][row] for field in NUMBER_FIELDS},
+      "perk_columns": self.perk_columns[row],
+    }
+
+  def find(self, archetype: str = None, ammo: str = None, perk: str = None):
+    """
+    Returns the rows of the weapons matching every filter given, in catalog order.
+
+    Parameters:
+    - archetype (str): The weapons' archetype (default is None, any).
+    - ammo (str): The weapons' ammo type, "primary" or "special" (default is None, any).
+    - perk (str): A perk the weapons can roll (default is None, any).
+    """
+    if ammo is not None and ammo not in AMMO_TYPES:
+      raise ValueError(f"Unknown ammo type '{ammo}'. Expected one of: {', '.join(AMMO_TYPES)}")
+
+    matches = None
+    for index, key in ((self.by_archetype, archetype), (self.by_ammo, ammo), (self.by_perk, perk)):
+      if key is None:
+        continue
+      rows = index.get(key, set())
+      matches = set(rows) if matches is None else matches & rows
+
+    return list(range(len(self.names))) if matches is None else sorted(matches)
+
+  def rolls(self, row: int, enhanced: bool = True):
+    """
+    Returns every roll of a weapon as a tuple of (perk name, enhanced) pairs, one per perk column.
+
+    Parameters:
+    - row (int): The row of the weapon.
+    - enhanced (bool): Whether to roll the enhanced version of each perk as well (default is True).
+    """
+    choices = []
+    for column in self.perk_columns[row]:
+      options = []
+      for perk in dict.fromkeys(column):
+        if perk not in PERK_TYPES or perk == "Perk":
+          option = [("Perk", False)]
+        else:
+          option = [(perk, False), (perk, True)] if enhanced else [(perk, False)]
+        options.extend(choice for choice in option if choice not in options)
+      choices.append(options or [("Perk", False)])
+
+    # A weapon can't roll the same perk twice, only the placeholder for no perk can repeat
+    rolls = []
+    for perks in product(*choices):
+      names = [name for name, _ in perks if name != "Perk"]
+      if len(set(names)) == len(names):
+        rolls.append(perks)
+
+    return rolls
+
+  def signature(self, row: int, enhanced: bool = True):
+    """
+    Returns a string describing everything a row's results depend on.
+    """
+    weapon = self.weapon(row)
+    names = ["Perk"] + [perk for column in weapon["perk_columns"] for perk in column]
+    return json.dumps([weapon["magazine_size"], weapon["reserves_size"], weapon["fire_rate"], weapon["perk_columns"],
+                       enhanced, perk_versions(names)])
+
+  def evaluate(self, rows=None, tests: tuple = TESTS, enhanced: bool = True, workers: int = 1):
+    """
+    Runs the tests on every roll of the given weapons, only for the weapons whose results are missing or out of date.
+    Returns the number of weapons that were run.
+
+    Parameters:
+    - rows (iterable): The rows to evaluate (default is None, every weapon).
+    - tests (tuple): The tests to run, out of "magazine" and "all_ammo" (default is both).
+    - enhanced (bool): Whether to roll the enhanced version of each perk as well (default is True).
+    - workers (int): The number of worker processes, 1 to run in this process (default is 1).
+    """
+    for test in tests:
+      if test not in TESTS:
+        raise ValueError(f"Unknown test '{test}'. Expected one of: {', '.join(TESTS)}")
+
+    rows = range(len(self.names)) if rows is None else rows
+    stale = []
+    for row in rows:
+      signature = self.signature(row, enhanced)
+      cached = self.results.get(row)
+      if cached is None or cached[0] != signature or any(test not in cached[1] for test in tests):
+        stale.append((row, signature))
+
+    # Every configuration the stale weapons need, each distinct one only once
+    needed = {}
+    for row, signature in stale:
+      weapon = self.weapon(row)
+      for perks in self.rolls(row, enhanced):
+        config = WeaponConfig(weapon["magazine_size"], weapon["reserves_size"], weapon["fire_rate"], perks)
+        for test in tests:
+          # Expending infinite reserves never ends, those weapons only get the magazine test
+          if test == "all_ammo" and config.reserves_size == -1:
+            continue
+          needed.setdefault(canonical_key(config, test), (config, test))
+
+    states = {}
+    if workers == 1:
+      for key, (config, test) in needed.items():
+        states[key] = run_config(config, test)
+    else:
+      for test in tests:
+        configs = [config for config, config_test in needed.values() if config_test == test]
+        for results in run_grid(configs, (test,), workers):
+          for config, config_test, state in results:
+            states[canonical_key(config, config_test)] = state
+
+    for row, signature in stale:
+      weapon = self.weapon(row)
+      # Results of other tests are still good if only a test was missing
+      cached = self.results.get(row)
+      by_test = dict(cached[1]) if cached is not None and cached[0] == signature else {}
+      for test in tests:
+        by_test[test] = []
+        for perks in self.rolls(row, enhanced):
+          config = WeaponConfig(weapon["magazine_size"], weapon["reserves_size"], weapon["fire_rate"], perks)
+          state = states.get(canonical_key(config, test))
+          if state is not None:
+            by_test[test].append((perks, state))
+      self.results[row] = (signature, by_test)
+
+    return len(stale)
+
+  def table(self, test: str, rows=None):
+    """
+    Returns the results of a test as columns: a list of weapon names, a list of rolls, and a SweepTable (see
+    batchSweep.py) with a row per roll of every weapon that has results.
+
+    Parameters:
+    - test (str): The test, "magazine" or "all_ammo".
+    - rows (iterable): The rows to include (default is None, every weapon).
+    """
+    rows = range(len(self.names)) if rows is None else rows
+    entries = [(row, perks, state) for row in rows if row in self.results
+               for perks, state in self.results[row][1].get(test, [])]
+
+    names = []
+    rolls = []
+    table = SweepTable(test, max((len(perks) for row, perks, state in entries), default=0))
+    for row, perks, state in entries:
+      weapon = self.weapon(row)
+      config = WeaponConfig(weapon["magazine_size"], weapon["reserves_size"], weapon["fire_rate"], perks)
+      names.append(self.names[row])
+      rolls.append(perks)
+      table.append(config, {**state, "perks": [state["perks"].get(name) for name, _ in perks]})
+
+    return names, rolls, table
+
+  def write_results(self, stream, rows=None):
+    """
+    Writes the results of every test as JSON columns, along with the signature of each weapon they are for and the
+    tests it was evaluated with.
+    """
+    tests = {}
+    for test in TESTS:
+      names, rolls, table = self.table(test, rows)
+      tests[test] = {"weapon": names, "perks": [[list(perk) for perk in perks] for perks in rolls],
+                     **{field: column.tolist() for field, column in table.columns.items()}}
+
+    rows = range(len(self.names)) if rows is None else rows
+    json.dump({
+      "format": RESULTS_FORMAT,
+      "signatures": {self.names[row]: self.results[row][0] for row in rows if row in self.results},
+      "evaluated": {self.names[row]: list(self.results[row][1]) for row in rows if row in self.results},
+      "tests": tests,
+    }, stream)
+
+  def read_results(self, stream):
+    """
+    Reads results written by write_results, keeping the ones for weapons in the catalog whose signature still matches.
+    Only the tests each weapon was evaluated with are restored, so the others are still run by evaluate.
+    Returns the number of weapons whose results were kept.
+    """
+    data = json.load(stream)
+    if data.get("format") != RESULTS_FORMAT:
+      return 0
+
+    # The fields each perk reports, looked up once per perk
+    perk_fields = {}
+
+    kept = {}
+    for name, signature in data["signatures"].items():
+      row = self.by_name.get(name)
+      if row is not None and signature in (self.signature(row, True), self.signature(row, False)):
+        kept[row] = (signature, {test: [] for test in data["evaluated"].get(name, ())})
+
+    for test, columns in data["tests"].items():
+
+      fields = [field for field in columns if field not in ("weapon", "perks")]
+      for index, name in enumerate(columns["weapon"]):
+        row = self.by_name.get(name)
+        if row not in kept or test not in kept[row][1]:
+          continue
+
+        perks = tuple((perk_name, enhanced) for perk_name, enhanced in columns["perks"][index])
+        values = {field: columns[field][index] for field in fields}
+        state = {field: values[field] for field in ("magazine", "magazine_size", "reserves", "shots_fired", "reloads")}
+        state["perks"] = {}
+        for slot, (perk_name, enhanced) in enumerate(perks):
+          if perk_name not in perk_fields:
+            perk_state = PERK_TYPES[perk_name]().state()
+            perk_fields[perk_name] = None if perk_state is None else tuple(perk_state)
+          fields_of_perk = perk_fields[perk_name]
+          state["perks"][perk_name] = None if fields_of_perk is None else {field: values[f"perk{slot}_{field}"] for field in fields_of_perk}
+        kept[row][1][test].append((perks, state))
+
+    self.results.update(kept)
+    return len(kept)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Run the tests on every roll of every weapon in a catalog.")
+  parser.add_argument("catalog", help="CSV, JSON or JSONL file of weapons")
+  parser.add_argument("--catalog-format", choices=CATALOG_FORMATS, help="format of the catalog (default is from the file extension)")
+  parser.add_argument("--results", required=True, help="JSON file of results, read first if it exists and then rewritten")
+  parser.add_argument("--tests", nargs="+", choices=TESTS, default=list(TESTS), help="tests to run (default is both)")
+  parser.add_argument("--archetype", help="only evaluate weapons of this archetype")
+  parser.add_argument("--ammo", choices=AMMO_TYPES, help="only evaluate weapons with this ammo type")
+  parser.add_argument("--perk", help="only evaluate weapons that can roll this perk")
+  parser.add_argument("--no-enhanced", action="store_true", help="leave out enhanced perks")
+  parser.add_argument("--workers", type=int, default=1, help="worker processes (default is 1)")
+  args = parser.parse_args(argv)
+
+  catalog_format = args.catalog_format
+  if catalog_format is None:
+    extension = args.catalog.lower().rsplit(".", 1)[-1]
+    catalog_format = extension if extension in CATALOG_FORMATS else "csv"
+
+  catalog = WeaponCatalog()
+  try:
+    with open(args.catalog, newline="") as stream:
+      catalog.load(read_catalog(stream, catalog_format))
+  except ValueError as error:
+    print(f"weaponCatalog.py: {error}", file=sys.stderr)
+    return 1
+
+  kept = 0
+  try:
+    with open(args.results) as stream:
+      kept = catalog.read_results(stream)
+  except (OSError, ValueError, KeyError):
+    pass
+
+  rows = catalog.find(args.archetype, args.ammo, args.perk)
+  run = catalog.evaluate(rows, tuple(args.tests), not args.no_enhanced, args.workers)
+
+  with open(args.results, "w") as stream:
+    catalog.write_results(stream)
+
+  print(f"{len(catalog)} weapons in the catalog, {len(rows)} selected: {run} evaluated, "
+        f"{len(rows) - run} already up to date ({kept} results read from {args.results})")
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+WeaponConfig is a plain, immutable description of a weapon and its perks.
+
+Weapons and perks hold mutable state while they are being fired, so they can't be shared or used as keys.
+A WeaponConfig can be hashed, compared, pickled and sent to other processes, and builds a fresh Weapon
+with fresh perks every time it is needed.
+"""
+
+from itertools import product
+from typing import NamedTuple
+
+from weapon import Weapon
+from perks import PERK_TYPES
+
+class WeaponConfig(NamedTuple):
+  """
+  An immutable description of a weapon configuration.
+
+  Attributes:
+  - magazine_size (int): The size of the weapon's magazine.
+  - reserves_size (int): The size of the weapon's reserves. If -1, the weapon has infinite reserves (primary ammo).
+  - fire_rate (int): The rate of fire of the weapon in rounds per minute.
+  - perks (tuple): The perks on the weapon as (perk name, enhanced) pairs, in the order they are applied.
+  """
+  magazine_size: int
+  reserves_size: int = -1
+  fire_rate: int = 0
+  perks: tuple = ()
+
+  def build(self):
+    """
+    Returns a new Weapon with new perk instances for this configuration.
+    """
+    perks = [PERK_TYPES[name](enhanced=enhanced) for name, enhanced in self.perks]
+    return Weapon(magazine_size=self.magazine_size, fire_rate=self.fire_rate, reserves_size=self.reserves_size, perks=perks)
+
+  def from_weapon(weapon: Weapon):
+    """
+    Returns the configuration of an existing weapon.
+
+    Parameters:
+    - weapon (Weapon): The weapon to describe.
+    """
+    perks = tuple((perk.__class__.__name__, perk.enhanced) for perk in weapon.perks)
+    return WeaponConfig(weapon.magazine_size, weapon.reserves_size, weapon.fire_rate, perks)
+
+
+def perk_pairs(perk_names: tuple = ("TripleTap", "FourthTimesTheCharm", "RewindRounds", "Perk"), enhanced: bool = True):
+  """
+  Returns every pair of perks that can be picked from the menu in main.py, as tuples for WeaponConfig.perks.
+
+  Parameters:
+  - perk_names (tuple): The names of the perks to pair up.
+  - enhanced (bool): Whether to include the enhanced version of each perk as well.
+  """
+  enhanced_options = (False, True) if enhanced else (False,)
+  options = list(product(perk_names, enhanced_options))
+
+  return [(first, second) for first, second in product(options, repeat=2)]
+
+
+def config_grid(magazine_sizes, reserves_sizes, perk_combos, fire_rates=(0,)):
+  """
+  Yields a WeaponConfig for every combination of the given values, ordered by perk combination, fire rate,
+  magazine size and then reserves size.
+
+  Parameters:
+  - magazine_sizes (iterable): The magazine sizes to include.
+  - reserves_sizes (iterable): The reserves sizes to include. -1 means infinite reserves.
+  - perk_combos (iterable): The perk combinations to include, as tuples of (perk name, enhanced) pairs.
+  - fire_rates (iterable): The fire rates to include, in rounds per minute.
+  """
+  for perks, fire_rate, magazine_size, reserves_size in product(perk_combos, fire_rates, magazine_sizes, reserves_sizes):
+    yield WeaponConfig(magazine_size, reserves_size, fire_rate, tuple(perks))
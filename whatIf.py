@@ -0,0 +1,280 @@
+"""
+WhatIf compares decisions in the middle of a fight, like "reload now, or keep firing until RewindRounds procs?".
+
+Every branch starts from a snapshot of the weapon (see Weapon.snapshot), a tuple of the weapon's and its perks'
+numbers. Trying a branch is restoring the snapshot and applying actions to the same Weapon, so no weapon or perk is ever
+copied or rebuilt. The actions are:
+- "shoot": fire a round that lands as a precision hit.
+- "body": fire a round that hits, but not as a precision hit.
+- "miss": fire a round that misses.
+- "reload": reload the weapon. A full magazine can't be reloaded, and weapons with infinite reserves always can.
+Firing from an empty magazine, or reloading without reserves, isn't a possible action.
+
+run and compare play out fixed plans. explore searches every sequence of actions up to a given length for the one that
+ends with the best score (the shots fired by default), depth first. Different sequences often lead to the same state
+(firing then reloading and reloading then firing can leave the weapon and its perks identical), so the best result from
+each (snapshot, actions left) is remembered and reused. That turns a tree of 2^depth sequences into one search per
+distinct state.
+
+  python whatIf.py --magazine 12 --reserves 40 --fire-rate 600 --perks RewindRounds --fire 9 --depth 24
+"""
+
+import argparse
+import sys
+
+from weapon import Weapon
+from weaponConfig import WeaponConfig
+from dpsPhase import DpsPhase
+from resultSink import SINKS, ResultSink, use_sink
+from headless import parse_perk
+
+ACTIONS = ("shoot", "body", "miss", "reload")
+
+# The default actions explored, the decision between firing on and reloading.
+DEFAULT_ACTIONS = ("shoot", "reload")
+
+
+def apply_action(weapon: Weapon, action: str):
+  """
+  Applies an action to the weapon. Returns False without changing the weapon if the action isn't possible.
+
+  Parameters:
+  - weapon (Weapon): The weapon.
+  - action (str): One of ACTIONS.
+  """
+  if action == "shoot":
+    return weapon.shoot(True, True)
+  if action == "body":
+    return weapon.shoot(True, False)
+  if action == "miss":
+    return weapon.shoot(False, False)
+  if action == "reload":
+    return weapon.magazine < weapon.magazine_size and DpsPhase.reload(weapon)
+
+  raise ValueError(f"Unknown action '{action}'. Expected one of: {', '.join(ACTIONS)}")
+
+
+def shots_fired(weapon: Weapon):
+  """
+  The default score of a branch, the shots the weapon has fired.
+  """
+  return weapon.shots_fired
+
+
+def rounds(weapon: Weapon):
+  """
+  A score for how much a branch gets out of the ammo: the shots fired plus the rounds still in the magazine and
+  reserves. Refunds raise it, so it ranks "reload now" against "keep firing" by the ammo each leaves. Weapons with
+  infinite reserves only count their magazine.
+  """
+  return weapon.shots_fired + weapon.magazine + max(weapon.reserves, 0)
+
+
+# The scores that can be picked on the command line.
+SCORES = {"shots": shots_fired, "rounds": rounds}
+
+
+class WhatIf():
+  """
+  Branches off a weapon's current state.
+
+  Attributes:
+  - weapon (Weapon): The weapon branches are played out on. It is back in the root state after every method.
+  - root (tuple): The snapshot every branch starts from.
+  """
+  def __init__(self, weapon: Weapon):
+    """
+    Initializes a new instance of the WhatIf class, branching off the weapon's current state.
+
+    Parameters:
+    - weapon (Weapon): The weapon to branch off.
+    """
+    self.weapon = weapon
+    self.root = weapon.snapshot()
+
+  def run(self, actions, snapshot: tuple = None):
+    """
+    Plays out a plan and returns the snapshot it ends in, and the number of actions that were possible. Actions that
+    aren't possible are skipped. The weapon is put back in the root state afterwards.
+
+    Parameters:
+    - actions (iterable): The actions to apply, in order.
+    - snapshot (tuple): The snapshot to start from (default is None, the root).
+    """
+    weapon = self.weapon
+    weapon.restore(self.root if snapshot is None else snapshot)
+    applied = 0
+
+    with use_sink(ResultSink()):
+      for action in actions:
+        if apply_action(weapon, action):
+          applied += 1
+
+    end = weapon.snapshot()
+    weapon.restore(self.root)
+
+    return end, applied
+
+  def state(self, snapshot: tuple):
+    """
+    Returns the state of the weapon in a snapshot, in the same shape as Weapon.state().
+    """
+    self.weapon.restore(snapshot)
+    state = self.weapon.state()
+    self.weapon.restore(self.root)
+
+    return state
+
+  def compare(self, plans: dict, score=shots_fired):
+    """
+    Plays out several plans from the root. Returns a dictionary with the score and end state of each plan, by name.
+
+    Parameters:
+    - plans (dict): The actions of each plan, by name.
+    - score: A function giving the score of a weapon at the end of a plan (default is the shots fired).
+    """
+    results = {}
+
+    for name, actions in plans.items():
+      end, applied = self.run(actions)
+      self.weapon.restore(end)
+      results[name] = {"score": score(self.weapon), "applied": applied, "state": self.weapon.state()}
+      self.weapon.restore(self.root)
+
+    return results
+
+  def explore(self, depth: int, actions: tuple = DEFAULT_ACTIONS, score=shots_fired):
+    """
+    Searches every sequence of up to `depth` actions from the root for the one with the best score. A sequence ends
+    early when no action is possible. Ties go to the action listed first.
+
+    Returns a dictionary with the best score, its actions, the state it ends in, the number of distinct states searched,
+    and the number of times a state was reused instead of searched again.
+
+    Parameters:
+    - depth (int): The most actions in a sequence.
+    - actions (tuple): The actions to choose from (default is "shoot" and "reload").
+    - score: A function giving the score of a weapon at the end of a sequence (default is the shots fired).
+    """
+    for action in actions:
+      if action not in ACTIONS:
+        raise ValueError(f"Unknown action '{action}'. Expected one of: {', '.join(ACTIONS)}")
+
+    weapon = self.weapon
+    # The best score and first action from each (snapshot, actions left)
+    memo = {}
+    reused = 0
+
+    def best(remaining):
+      nonlocal reused
+      snapshot = weapon.snapshot()
+      key = (snapshot, remaining)
+      known = memo.get(key)
+      if known is not None:
+        reused += 1
+        return known[0]
+
+      result = None
+      if remaining > 0:
+        for action in actions:
+          if not apply_action(weapon, action):
+            continue
+          value = best(remaining - 1)
+          weapon.restore(snapshot)
+          if result is None or value > result[0]:
+            result = (value, action)
+
+      # Nothing left to do, the sequence ends here
+      if result is None:
+        result = (score(weapon), None)
+
+      memo[key] = result
+      return result[0]
+
+    # Each action is a level of recursion
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, depth * 2 + 100))
+    try:
+      weapon.restore(self.root)
+      with use_sink(ResultSink()):
+        value = best(depth)
+
+        # Follow the best action from each state to recover the sequence
+        path = []
+        remaining = depth
+        while True:
+          action = memo[(weapon.snapshot(), remaining)][1]
+          if action is None:
+            break
+          apply_action(weapon, action)
+          path.append(action)
+          remaining -= 1
+
+      state = weapon.state()
+    finally:
+      sys.setrecursionlimit(limit)
+      weapon.restore(self.root)
+
+    return {
+      "score": value,
+      "actions": path,
+      "state": state,
+      "states": len(memo),
+      "reused": reused,
+    }
+
+
+def describe(actions: list):
+  """
+  Returns a short description of a sequence of actions, like "shoot x9, reload, shoot x12".
+  """
+  parts = []
+  for action in actions:
+    if parts and parts[-1][0] == action:
+      parts[-1][1] += 1
+    else:
+      parts.append([action, 1])
+
+  return ", ".join(action if count == 1 else f"{action} x{count}" for action, count in parts) or "nothing"
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Search the best sequence of actions from a point in a fight.")
+  parser.add_argument("--magazine", type=int, required=True, help="magazine size")
+  parser.add_argument("--reserves", type=int, default=-1, help="reserves size (default is -1, infinite)")
+  parser.add_argument("--fire-rate", type=int, default=0, help="fire rate in rounds per minute (default is 0)")
+  parser.add_argument("--perks", nargs="*", default=[], help="perk names, with a '+' after enhanced perks")
+  parser.add_argument("--fire", type=int, default=0, help="precision hits to fire before branching (default is 0)")
+  parser.add_argument("--depth", type=int, default=20, help="most actions to search (default is 20)")
+  parser.add_argument("--actions", nargs="+", choices=ACTIONS, default=list(DEFAULT_ACTIONS), help="actions to choose from")
+  parser.add_argument("--score", choices=list(SCORES), default="rounds", help="what makes a sequence best (default is rounds)")
+  parser.add_argument("--sink", choices=list(SINKS), default="text", help="how to write the result (default is text)")
+  args = parser.parse_args(argv)
+
+  try:
+    perks = tuple(parse_perk(perk) for perk in args.perks)
+  except ValueError as error:
+    parser.error(str(error))
+  if args.magazine < 1:
+    parser.error("--magazine must be at least 1")
+
+  weapon = WeaponConfig(args.magazine, args.reserves, args.fire_rate, perks).build()
+  with use_sink(ResultSink()):
+    for shot in range(args.fire):
+      weapon.shoot()
+
+  result = WhatIf(weapon).explore(args.depth, tuple(args.actions), SCORES[args.score])
+
+  sink = SINKS[args.sink]()
+  sink.message(f"\nBest sequence of up to {args.depth} actions after firing {args.fire}: {describe(result['actions'])}")
+  sink.message(f"Score: {result['score']} | {result['states']} states searched, {result['reused']} reused\n")
+  weapon.restore(WhatIf(weapon).run(result["actions"])[0])
+  weapon.report(sink)
+  sink.result(result)
+  sink.close()
+
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())